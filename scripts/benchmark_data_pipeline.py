@@ -0,0 +1,237 @@
+"""
+Microbenchmarks for the data pipeline. These print throughput numbers rather than asserting anything, so they live
+here instead of in the test suite.
+
+Usage:
+    python scripts/benchmark_data_pipeline.py [benchmark ...]
+
+With no arguments, every benchmark is run.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import equinox as eqx
+import jax
+import numpy as np
+
+import haliax as hax
+
+from levanter.data import ListAsyncDataset, MixtureDataset
+from levanter.data.text import BatchTokenizer, CausalLmDataset, TokenSeqDataset
+from levanter.models.lm_model import LmExample
+from levanter.store.cache import SerialCacheWriter
+from levanter.store.jagged_array import JaggedArrayStore
+
+
+async def causal_lm_dataset():
+    """Builds causal LmExamples a batch at a time with NumPy vs one jitted call per example."""
+    Pos = hax.Axis("position", 4096)
+    batch_size = 256
+    seqs = [np.random.randint(0, 50000, size=Pos.size, dtype=np.int32) for _ in range(batch_size)]
+    dataset = CausalLmDataset(ListAsyncDataset(seqs, is_complete=True), Pos, ignore_index=0, eos_id=1)
+
+    @eqx.filter_jit
+    def per_example(tokens):
+        return LmExample.causal(hax.named(tokens, Pos), ignore_id=0, eos_id=1)
+
+    # warm up both paths
+    jax.block_until_ready(per_example(seqs[0]))
+    await dataset.get_batch(range(batch_size))
+
+    start = time.perf_counter()
+    jax.block_until_ready([per_example(s) for s in seqs])
+    per_example_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await dataset.get_batch(range(batch_size))
+    batched_time = time.perf_counter() - start
+
+    print(
+        f"per-example jit: {batch_size / per_example_time:.0f} examples/s, "
+        f"batched numpy: {batch_size / batched_time:.0f} examples/s"
+    )
+
+
+def _write_token_cache(path, num_docs, doc_len):
+    rng = np.random.default_rng(0)
+    exemplar = {"input_ids": np.zeros((doc_len,), dtype=np.int32)}
+    with SerialCacheWriter(path, exemplar) as writer:
+        for _ in range(0, num_docs, 128):
+            writer.write_batch(
+                [{"input_ids": rng.integers(0, 1000, size=doc_len, dtype=np.int32)} for _ in range(128)]
+            )
+
+    return writer.result()
+
+
+async def token_seq_dataset():
+    """Reads batches of sequences from a token cache one read per sequence vs with coalesced reads."""
+    import tensorstore as ts
+
+    seq_len = 4096
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = _write_token_cache(tmpdir, num_docs=8192, doc_len=1024)
+        dataset = TokenSeqDataset(cache, seq_len)
+        data = (await dataset._await_token_cache()).data
+        num_seqs = await dataset.async_len()
+
+        batch_size = 256
+        rng = np.random.default_rng(0)
+        # contiguous runs of indices, like an unshuffled or era-shuffled epoch
+        batches = [list(range(start, start + batch_size)) for start in range(0, num_seqs - batch_size, batch_size)]
+        batches.append(rng.choice(num_seqs, size=batch_size, replace=False).tolist())
+
+        async def per_sequence(indices):
+            with ts.Batch():
+                futs = [data[i * seq_len : (i + 1) * seq_len].read() for i in indices]
+            return await asyncio.gather(*futs)
+
+        for name, fn in [("per-sequence", per_sequence), ("coalesced", dataset.get_batch)]:
+            await fn(batches[0])
+            start = time.perf_counter()
+            for indices in batches:
+                await fn(indices)
+            elapsed = time.perf_counter() - start
+            print(f"{name}: {len(batches) * batch_size / elapsed:.0f} seqs/s")
+
+
+async def jagged_array_get_batch():
+    """Reads random rows of a JaggedArrayStore with two reads per row vs with JaggedArrayStore.get_batch."""
+    import tensorstore as ts
+
+    num_rows = 256 * 1024
+    with tempfile.TemporaryDirectory() as tmpdir:
+        builder = await JaggedArrayStore.open_async(tmpdir, item_rank=1, dtype=np.int32, cache_metadata=True)
+        rng = np.random.default_rng(0)
+        lengths = rng.integers(1, 512, size=num_rows)
+        data = np.arange(lengths.sum(), dtype=np.int32)
+        await builder.extend_async(np.split(data, np.cumsum(lengths)[:-1]))
+
+        async def per_row(indices):
+            with ts.Batch():
+                offset_futs = [builder.offsets[i : i + 2].read() for i in indices]
+            bounds = await asyncio.gather(*offset_futs)
+            with ts.Batch():
+                data_futs = [builder.data[(0 if i == 0 else b[0]) : b[1]].read() for i, b in zip(indices, bounds)]
+            return await asyncio.gather(*data_futs)
+
+        for batch_size in [1024, 8192, 65536]:
+            indices = rng.choice(num_rows, size=batch_size, replace=False).tolist()
+            for name, fn in [("per-row", per_row), ("batched", builder.get_batch)]:
+                await fn(indices)
+                start = time.perf_counter()
+                await fn(indices)
+                elapsed = time.perf_counter() - start
+                print(f"{name} {batch_size} rows: {batch_size / elapsed:.0f} rows/s")
+
+
+async def mixture_dataset_get_batch():
+    """Time per MixtureDataset.get_batch call for different block sizes and block permutations."""
+    num_datasets = 48
+    batch_size = 8192
+    dses = {}
+    for i in range(num_datasets):
+        ds = ListAsyncDataset(list(range(100_000)))
+        ds.finalize()
+        dses[f"ds{i}"] = ds
+
+    mixture_weights = {name: float(i + 1) for i, name in enumerate(dses)}
+
+    for block_size, block_permutation_type in [(2048, None), (2**20, None), (2048, "feistel"), (2**20, "feistel")]:
+        mixture_ds = MixtureDataset(
+            dses,
+            mixture_weights,
+            block_size=block_size,
+            key=jax.random.PRNGKey(42),
+            block_permutation_type=block_permutation_type,
+        )
+
+        # warm up the block cache
+        await mixture_ds.get_batch(range(batch_size))
+
+        num_batches = 20
+        start = time.perf_counter()
+        for step in range(num_batches):
+            await mixture_ds.get_batch(range(step * batch_size, (step + 1) * batch_size))
+        elapsed = (time.perf_counter() - start) / num_batches
+
+        print(
+            f"MixtureDataset.get_batch (block_size={block_size}, permutation={block_permutation_type}): "
+            f"{elapsed * 1000:.2f}ms per batch of {batch_size} from {num_datasets} datasets"
+        )
+
+
+def _word_level_tokenizer(vocab_size=1000):
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import PreTrainedTokenizerFast
+
+    vocab = {"[UNK]": 0, "<s>": 1, "</s>": 2, **{f"w{i}": i + 3 for i in range(vocab_size)}}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, unk_token="[UNK]", bos_token="<s>", eos_token="</s>")
+
+
+async def parquet_tokenization():
+    """Tokenizes a parquet shard into a cache row by row vs with the columnar RecordBatch path."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    from levanter.data.sharded_datasource import ParquetDataSource
+    from levanter.store.cache import CacheOptions, _tokenize_one_shard_group
+
+    class RowWiseBatchTokenizer(BatchTokenizer):
+        @property
+        def supports_record_batches(self) -> bool:
+            return False
+
+    rng = np.random.default_rng(0)
+    num_docs = 100_000
+    words = np.array([f"w{i}" for i in range(1000)])
+    docs = [" ".join(words[rng.integers(0, 1000, size=rng.integers(10, 200))]) for _ in range(num_docs)]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "data.parquet")
+        pq.write_table(pa.table({"text": docs, "id": np.arange(num_docs)}), path, row_group_size=10_000)
+
+        source = ParquetDataSource([path])
+        options = CacheOptions(batch_size=1024)
+        tokenizer = _word_level_tokenizer()
+
+        for name, processor in [
+            ("row-wise", RowWiseBatchTokenizer(tokenizer)),
+            ("columnar", BatchTokenizer(tokenizer)),
+        ]:
+            start = time.perf_counter()
+            _tokenize_one_shard_group(
+                os.path.join(tmpdir, name),
+                source,
+                list(source.shard_names),
+                processor,
+                options,
+                lambda *args: None,
+                False,
+            )
+            elapsed = time.perf_counter() - start
+            print(f"{name}: {num_docs / elapsed:.0f} docs/s")
+
+
+BENCHMARKS = {
+    "causal_lm_dataset": causal_lm_dataset,
+    "token_seq_dataset": token_seq_dataset,
+    "jagged_array_get_batch": jagged_array_get_batch,
+    "mixture_dataset_get_batch": mixture_dataset_get_batch,
+    "parquet_tokenization": parquet_tokenization,
+}
+
+
+async def main(names):
+    for name in names or BENCHMARKS:
+        print(f"== {name}")
+        await BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
@@ -1,5 +1,6 @@
 import dataclasses
 import datetime
+import functools
 import json
 import logging
 import os
@@ -8,9 +9,10 @@ import queue
 import threading
 import time
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import timedelta
-from typing import Callable, List, Optional, ParamSpec, Sequence, TypeVar, Union
+from typing import Callable, Dict, List, Optional, ParamSpec, Sequence, TypeVar, Union
 
 import equinox
 import fsspec
@@ -20,13 +22,19 @@ from draccus import field
 from fsspec import AbstractFileSystem
 from jax.experimental.array_serialization.serialization import GlobalAsyncCheckpointManager
 from jax.experimental.multihost_utils import broadcast_one_to_all
+from jax.sharding import NamedSharding, PartitionSpec
 from jaxtyping import PyTree
 
 import haliax.partitioning
 from haliax.jax_utils import is_in_jit, is_jax_array_like
-
-from levanter.tensorstore_serialization import tree_deserialize_leaves_tensorstore, tree_serialize_leaves_tensorstore
-from levanter.utils import fsspec_utils
+from haliax.util import is_named_array
+
+from levanter.tensorstore_serialization import (
+    load_manifest,
+    tree_deserialize_leaves_tensorstore,
+    tree_serialize_leaves_tensorstore,
+)
+from levanter.utils import fsspec_utils, jax_utils
 from levanter.utils.types import FilterSpec
 
 
@@ -37,6 +45,13 @@ PathLike = Union[str, pathlib.Path]
 M = TypeVar("M", bound=PyTree)
 Sig = ParamSpec("Sig")
 
+# Incremental checkpoints record, for each leaf (by key path), a fingerprint of its contents and the name of the
+# sibling checkpoint directory that actually stores it.
+LeafIndex = Dict[str, dict]
+_LEAF_INDEX_FILE = "leaf_index.json"
+# Written in place of metadata.json when a checkpoint is deleted but some of its leaves are still used by others
+_DELETED_MARKER_FILE = "DELETED"
+
 
 @dataclass(frozen=True)
 class CheckpointInterval:
@@ -44,6 +59,15 @@ class CheckpointInterval:
     until: Optional[int] = None  # until what step to save checkpoints with this policy, None means forever
 
 
+@dataclass
+class _PendingUpload:
+    destination: str
+    manager: GlobalAsyncCheckpointManager  # the manager that is writing the local copy
+    commit_callback: Optional[Callable[[], None]]
+    upload_id: int  # same on every process, used to name the barrier
+    stored_in: set[str]  # checkpoints holding this checkpoint's leaves, which we need to keep locally
+
+
 class Checkpointer:
     """
     A checkpointer class that saves checkpoints with two different, but overlapping policies: time and step.
@@ -69,6 +93,10 @@ class Checkpointer:
         keep_params: PyTree[FilterSpec] = True,
         dt_now_injection: Optional[Callable[[], datetime.datetime]] = None,
         delete_old_temp_checkpoints: bool = True,
+        local_path: Optional[PathLike] = None,
+        max_concurrent_uploads: int = 8,
+        max_pending_uploads: int = 1,
+        incremental: bool = False,
     ):
         """
         Class for managing checkpoints. Saves checkpoints according to two policies: time and step.
@@ -78,6 +106,18 @@ class Checkpointer:
 
         Time checkpoints are deleted after the next checkpoint is saved. Step checkpoints are never deleted.
 
+        If `local_path` is set, checkpoints are tiered: each process first writes its shards to `local_path` (which
+        should be fast, host-local storage), and a background thread then uploads them to `base_path`. Training only
+        stalls for the device->host copy. `metadata.json` is uploaded last, so a checkpoint isn't visible in
+        `base_path` until the upload has finished on every process. Only the most recently uploaded checkpoint is
+        kept locally. Single-process runs will resume from it if it's newer than anything in `base_path`;
+        multi-process runs always resume from `base_path`. If a staged checkpoint fails to upload on any process, it
+        is never committed, and the error is raised from the next save (or from `wait_until_finished`).
+
+        If `incremental` is set, each array is fingerprinted on device before saving, and arrays that haven't changed
+        since the last checkpoint aren't written again. Instead, the checkpoint's `leaf_index.json` points at the
+        checkpoint that stores them. Deleting a checkpoint keeps any arrays that other checkpoints still use.
+
         Args:
             base_path: the base path to save checkpoints to. may be gcs, local, or anything that tensorstore supports
             save_interval: the minimum amount of time between checkpoints (for time)
@@ -85,8 +125,18 @@ class Checkpointer:
             keep_params: a PyTree of FilterSpecs that specifies which parameters to keep in the checkpoint
             dt_now_injection: a function that returns the current time. useful for testing
             delete_old_temp_checkpoints: if True, delete old checkpoints when saving a new one
+            local_path: if set, a local directory to stage checkpoints in before uploading them to `base_path`
+            max_concurrent_uploads: the maximum number of files to upload at once when uploading a staged checkpoint
+            max_pending_uploads: the maximum number of staged checkpoints waiting to be uploaded. Saving blocks
+                while this many are waiting.
+            incremental: if True, don't rewrite arrays that are unchanged since the previous checkpoint
         """
         self.base_path = str(base_path)
+        self.local_path = str(local_path) if local_path is not None else None
+        self.max_concurrent_uploads = max_concurrent_uploads
+        self.incremental = incremental
+        # the leaf index of the last checkpoint we saved
+        self._leaf_index: LeafIndex = {}
         self.save_interval = save_interval
         self.step_policies = list(step_policies)
         self.keep_params = keep_params
@@ -118,6 +168,18 @@ class Checkpointer:
             self._async_checkpoint_remover_thread.start()
             self._checkpoint_being_removed = None
 
+        if self.local_path is not None:
+            # every process uploads its own shards, so every process gets an uploader
+            # bounded, so that saves block instead of piling up staged checkpoints if uploads can't keep up
+            self._upload_queue: queue.Queue[_PendingUpload] = queue.Queue(maxsize=max_pending_uploads)
+            self._upload_error: Optional[Exception] = None
+            self._num_uploads = 0
+            self._staged_checkpoints: List[str] = []
+            self._async_checkpoint_uploader_thread = threading.Thread(
+                target=self._async_checkpoint_uploader, daemon=True
+            )
+            self._async_checkpoint_uploader_thread.start()
+
         # discover latest checkpoint and see if it's temporary
         self._last_temporary_checkpoint = None
         latest_checkpoint = discover_latest_checkpoint(self.base_path)
@@ -130,6 +192,16 @@ class Checkpointer:
                 )
                 self._last_temporary_checkpoint = latest_checkpoint
 
+        # pick up where the previous attempt left off. We don't do this when staging locally, since the previous
+        # attempt's checkpoints mostly aren't on this machine anymore.
+        if (
+            incremental
+            and self.local_path is None
+            and latest_checkpoint is not None
+            and os.path.dirname(latest_checkpoint.rstrip("/")) == self.base_path.rstrip("/")
+        ):
+            self._leaf_index = _load_leaf_index(latest_checkpoint) or {}
+
     def load_checkpoint(
         self,
         state: M,
@@ -141,6 +213,8 @@ class Checkpointer:
     ) -> Optional[M]:
         if path is None:
             path = self.base_path
+            if discover_latest and self.local_path is not None:
+                path = discover_latest_checkpoint(self.base_path, local_path=self.local_path) or self.base_path
         return load_checkpoint(state, path, discover_latest=discover_latest, axis_mapping=axis_mapping, mesh=mesh)
 
     def load_model(
@@ -233,6 +307,9 @@ class Checkpointer:
 
     def wait_until_finished(self):
         self._manager.wait_until_finished()
+        if self.local_path is not None:
+            self._upload_queue.join()
+            self._raise_upload_error()
         if jax.process_index() == 0:
             while self._checkpoint_being_removed is not None or not self._async_checkpoint_remover_queue.empty():
                 time.sleep(0.2)
@@ -249,12 +326,56 @@ class Checkpointer:
             cp_path = fsspec_utils.join_path(plain_path, checkpoint)
             logger.info(f"Deleting old checkpoint {checkpoint} from {cp_path}")
             time_in = time.time()
-            fs.rm(cp_path, recursive=True)
+            # read every live checkpoint's leaf index once, rather than once per checkpoint we collect.
+            # used_leaves maps a checkpoint to the keys of its leaves that live checkpoints use
+            used_leaves: dict[str, set[str]] = {}
+
+            def mark_used(leaf_index: LeafIndex):
+                for key, entry in leaf_index.items():
+                    used_leaves.setdefault(entry["stored_in"], set()).add(key)
+
+            mark_used(self._leaf_index)
+            deleted = []
+            for other in _list_checkpoint_dirs(fs, plain_path):
+                name = os.path.basename(other)
+                if name == checkpoint:
+                    continue
+                if fs.exists(fsspec_utils.join_path(other, _DELETED_MARKER_FILE)):
+                    deleted.append(name)
+                else:
+                    mark_used(_load_leaf_index(other, fs) or {})
+
+            self._gc_checkpoint(fs, plain_path, checkpoint, used_leaves.get(checkpoint, set()))
+            # deleting this checkpoint may have been the last use of leaves in earlier deleted checkpoints
+            for other in deleted:
+                self._gc_checkpoint(fs, plain_path, other, used_leaves.get(other, set()))
             time_out = time.time()
             logger.info(f"Deleted old checkpoint {checkpoint} from {cp_path} in {time_out - time_in:.2f} seconds")
         except Exception:  # pylint: disable=broad-except
             logger.exception(f"Failed to delete checkpoint {checkpoint}", exc_info=True)
 
+    def _gc_checkpoint(self, fs, plain_base_path, checkpoint, used_leaves: set[str]):
+        """
+        Deletes the checkpoint, except for `used_leaves`: the keys of its leaves that other (live) checkpoints still
+        use. Those are kept, and the checkpoint is marked as deleted so that it is no longer discovered.
+        """
+        cp_path = fsspec_utils.join_path(plain_base_path, checkpoint)
+        if not used_leaves:
+            fs.rm(cp_path, recursive=True)
+            return
+
+        logger.info(f"Keeping {len(used_leaves)} leaves of {checkpoint} that are used by other checkpoints")
+        metadata_path = fsspec_utils.join_path(cp_path, "metadata.json")
+        if fs.exists(metadata_path):
+            fs.rm(metadata_path)
+            fs.touch(fsspec_utils.join_path(cp_path, _DELETED_MARKER_FILE))
+
+        leaf_index = _load_leaf_index(cp_path, fs) or {}
+        for key, entry in leaf_index.items():
+            leaf_path = os.path.join(cp_path, *key.split("."))
+            if entry["stored_in"] == checkpoint and key not in used_leaves and fs.exists(leaf_path):
+                fs.rm(leaf_path, recursive=True)
+
     def save_checkpoint(
         self,
         info,
@@ -263,21 +384,61 @@ class Checkpointer:
         *,
         is_temporary: bool = False,
     ):
-        path = os.path.join(self.base_path, destination)
-        logger.info(f"Saving checkpoint at step {info.step} to {path}")
         state = info.state.saveable_state
 
-        save_checkpoint(
-            state,
-            step=info.step,
-            checkpoint_path=path,
-            manager=self._manager,
-            commit_callback=commit_callback,
-            is_temporary=is_temporary,
-        )
+        leaf_index = None
+        if self.incremental:
+            leaf_index = self._incremental_leaf_index(state, destination)
+            num_reused = sum(entry["stored_in"] != destination for entry in leaf_index.values())
+            logger.info(f"Reusing {num_reused} of {len(leaf_index)} arrays from previous checkpoints")
+            self._leaf_index = leaf_index
+
+        if self.local_path is None:
+            path = os.path.join(self.base_path, destination)
+            logger.info(f"Saving checkpoint at step {info.step} to {path}")
+            save_checkpoint(
+                state,
+                step=info.step,
+                checkpoint_path=path,
+                manager=self._manager,
+                commit_callback=commit_callback,
+                is_temporary=is_temporary,
+                leaf_index=leaf_index,
+            )
+        else:
+            self._raise_upload_error()
+            path = os.path.join(self.local_path, destination)
+            logger.info(f"Staging checkpoint at step {info.step} in {path}")
+            # a fresh manager per checkpoint: serialize() waits for the manager's previous commit, and we don't want
+            # to wait for anything but the device->host copy. The uploader waits on this manager instead.
+            manager = GlobalAsyncCheckpointManager(timeout_secs=60 * 30)
+            save_checkpoint(
+                state,
+                step=info.step,
+                checkpoint_path=path,
+                manager=manager,
+                is_temporary=is_temporary,
+                leaf_index=leaf_index,
+            )
+            stored_in = {destination}
+            if leaf_index is not None:
+                stored_in.update(entry["stored_in"] for entry in leaf_index.values())
+            self._upload_queue.put(_PendingUpload(destination, manager, commit_callback, self._num_uploads, stored_in))
+            self._num_uploads += 1
+
         self._last_save_step = info.step
         self._last_save_time = self._dt_now_injection()
 
+    def _incremental_leaf_index(self, state, destination: str) -> LeafIndex:
+        leaf_index = _fingerprint_leaves(_saveable_leaves(state))
+        for key, entry in leaf_index.items():
+            prev = self._leaf_index.get(key)
+            if prev is not None and all(prev[k] == entry[k] for k in ("fingerprint", "shape", "dtype")):
+                entry["stored_in"] = prev["stored_in"]
+            else:
+                entry["stored_in"] = destination
+        return leaf_index
+
     def _async_checkpoint_remover(self):
         while True:
             checkpoint = self._async_checkpoint_remover_queue.get(block=True)
@@ -285,6 +446,89 @@ class Checkpointer:
             self._do_rm_checkpoint(checkpoint)
             self._checkpoint_being_removed = None
 
+    def _async_checkpoint_uploader(self):
+        while True:
+            upload = self._upload_queue.get(block=True)
+            try:
+                self._do_upload_checkpoint(upload)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.exception(f"Failed to upload checkpoint {upload.destination}", exc_info=True)
+                # hand it to the training thread
+                self._upload_error = e
+            finally:
+                self._upload_queue.task_done()
+
+    def _raise_upload_error(self):
+        error, self._upload_error = self._upload_error, None
+        if error is not None:
+            raise RuntimeError("Failed to upload a staged checkpoint") from error
+
+    def _do_upload_checkpoint(self, upload: _PendingUpload):
+        assert self.local_path is not None
+        error: Optional[Exception] = None
+        try:
+            self._upload_staged_files(upload)
+        except Exception as e:  # pylint: disable=broad-except
+            error = e
+
+        # metadata.json goes last, and only once every process has uploaded its shards, so that partially uploaded
+        # checkpoints are never discovered. Failed processes still check in, so the others don't wait on them.
+        all_succeeded = _all_processes_succeeded(f"levanter_checkpoint_upload_{upload.upload_id}", error is None)
+        if error is not None:
+            raise error
+        if not all_succeeded:
+            raise RuntimeError(f"Another process failed to upload its shards of {upload.destination}")
+
+        remote_dir = os.path.join(self.base_path, upload.destination)
+        fs, plain_remote_dir = _get_fs_and_plain_path(remote_dir)
+        if jax.process_index() == 0:
+            fs.put_file(
+                os.path.join(self.local_path, upload.destination, "metadata.json"),
+                fsspec_utils.join_path(plain_remote_dir, "metadata.json"),
+            )
+            logger.info(f"Uploaded checkpoint {upload.destination}")
+            if upload.commit_callback is not None:
+                upload.commit_callback()
+
+        # keep only the newest local checkpoint (and whatever holds its leaves) around for restarts
+        self._staged_checkpoints.append(upload.destination)
+        for staged in list(self._staged_checkpoints):
+            if staged not in upload.stored_in:
+                logger.info(f"Deleting staged checkpoint {staged}")
+                local_fs, plain_local_path = _get_fs_and_plain_path(os.path.join(self.local_path, staged))
+                local_fs.rm(plain_local_path, recursive=True)
+                self._staged_checkpoints.remove(staged)
+
+    def _upload_staged_files(self, upload: _PendingUpload):
+        """Uploads this process's files of a staged checkpoint, except metadata.json"""
+        assert self.local_path is not None
+        # wait for the local copy to be committed on all processes
+        upload.manager.wait_until_finished()
+
+        local_dir = os.path.join(self.local_path, upload.destination)
+        remote_dir = os.path.join(self.base_path, upload.destination)
+        fs, plain_remote_dir = _get_fs_and_plain_path(remote_dir)
+
+        local_files = []
+        for root, _, files in os.walk(local_dir):
+            for f in files:
+                rel_path = os.path.relpath(os.path.join(root, f), local_dir)
+                if rel_path != "metadata.json":
+                    local_files.append(rel_path)
+
+        logger.info(f"Uploading {len(local_files)} files from {local_dir} to {remote_dir}")
+        time_in = time.time()
+        for d in sorted({os.path.dirname(f) for f in local_files}):
+            fs.makedirs(fsspec_utils.join_path(plain_remote_dir, d), exist_ok=True)
+
+        def upload_file(rel_path):
+            fs.put_file(os.path.join(local_dir, rel_path), fsspec_utils.join_path(plain_remote_dir, rel_path))
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_uploads) as pool:
+            list(pool.map(upload_file, local_files))
+
+        logger.info(f"Uploaded {len(local_files)} files to {remote_dir} in {time.time() - time_in:.2f} seconds")
+
 
 # In callbacks.py - Add a new callback that handles epoch checkpointing
 class EpochCheckpointer:
@@ -332,6 +576,7 @@ def save_checkpoint(
     *,
     commit_callback: Optional[Callable[[], None]] = None,
     is_temporary: bool = True,
+    leaf_index: Optional[LeafIndex] = None,
 ):
     """
     Save a checkpoint to a given path using TensorStore.
@@ -349,6 +594,9 @@ def save_checkpoint(
         manager: the GlobalAsyncCheckpointManager to use for saving the checkpoint
         commit_callback: a callback to call after the checkpoint has been saved
         is_temporary: whether the checkpoint is temporary
+        leaf_index: if given, this checkpoint is incremental: leaves whose `stored_in` isn't this checkpoint's
+            directory name are not written, since they're stored in that sibling checkpoint. The index is saved with
+            the checkpoint so that [levanter.checkpoint.load_checkpoint][] can find them.
     """
     step = int(step)
     checkpoint_path = str(checkpoint_path)
@@ -359,19 +607,202 @@ def save_checkpoint(
     fs.makedirs(plain_path, exist_ok=True)
 
     def my_callback():
+        if leaf_index is not None and jax.process_index() == 0:
+            with fs.open(os.path.join(checkpoint_path, _LEAF_INDEX_FILE), "w") as index_out:
+                json.dump(leaf_index, index_out)
         _save_metadata(checkpoint_path, fs, step, is_temporary)
         logger.info(f"Saved checkpoint to {checkpoint_path} for step {step}")
 
         if commit_callback is not None:
             commit_callback()
 
-    tree = equinox.filter(tree, lambda x: is_jax_array_like(x) or isinstance(x, (int, float, bool, complex)))
+    tree = _saveable_leaves(tree)
+
+    if leaf_index is not None:
+        this_checkpoint = os.path.basename(checkpoint_path.rstrip("/"))
+        stored_elsewhere = {key for key, entry in leaf_index.items() if entry["stored_in"] != this_checkpoint}
+        key_paths = jax_utils.leaf_key_paths(tree, is_leaf=is_named_array)
+        tree = jax.tree.map(
+            lambda key, leaf: None if key in stored_elsewhere else leaf,
+            key_paths,
+            tree,
+            is_leaf=lambda x: x is None,
+        )
 
     tree_serialize_leaves_tensorstore(checkpoint_path, tree, manager, commit_callback=my_callback)
 
     return checkpoint_path
 
 
+def _saveable_leaves(tree):
+    return equinox.filter(tree, lambda x: is_jax_array_like(x) or isinstance(x, (int, float, bool, complex)))
+
+
+def _fingerprint_leaves(tree) -> LeafIndex:
+    """
+    Fingerprints the contents of every jax.Array leaf of `tree`, keyed by leaf key path. The fingerprints are computed
+    on device, so only a few bytes per leaf are transferred.
+    """
+    key_paths = jax.tree.leaves(jax_utils.leaf_key_paths(tree, is_leaf=is_named_array), is_leaf=is_named_array)
+    leaves = jax.tree.leaves(tree, is_leaf=is_named_array)
+    assert len(key_paths) == len(leaves)
+
+    arrays = {}
+    for key, leaf in zip(key_paths, leaves):
+        if is_named_array(leaf):
+            leaf = leaf.array
+        if isinstance(leaf, jax.Array):
+            arrays[key] = leaf
+
+    fingerprints = jax.device_get({key: _fingerprint_array(a) for key, a in arrays.items()})
+
+    return {
+        key: {
+            "fingerprint": "".join(f"{int(h):08x}" for h in fingerprints[key]),
+            "shape": list(a.shape),
+            "dtype": str(a.dtype),
+        }
+        for key, a in arrays.items()
+    }
+
+
+def _fingerprint_array(x: jax.Array) -> jax.Array:
+    sharding = x.sharding
+    if isinstance(sharding, NamedSharding):
+        # make sure every process can read the fingerprint
+        return _fingerprint_fn(NamedSharding(sharding.mesh, PartitionSpec()))(x)
+    return _fingerprint_fn(None)(x)
+
+
+@functools.lru_cache(maxsize=None)
+def _fingerprint_fn(out_sharding):
+    if out_sharding is None:
+        return jax.jit(_fingerprint)
+    return jax.jit(_fingerprint, out_shardings=out_sharding)
+
+
+def _fingerprint(x):
+    # two independent 32-bit hashes of (position, bits) for each 32-bit word, summed
+    if jax.dtypes.issubdtype(x.dtype, jax.dtypes.prng_key):
+        x = jax.random.key_data(x)
+    if jnp.iscomplexobj(x):
+        x = jnp.stack([x.real, x.imag], axis=-1)
+
+    if x.dtype == jnp.bool_:
+        words = x.astype(jnp.uint32)
+    else:
+        uint_type = {1: jnp.uint8, 2: jnp.uint16, 4: jnp.uint32, 8: jnp.uint32}[x.dtype.itemsize]
+        words = jax.lax.bitcast_convert_type(x, uint_type).astype(jnp.uint32)
+    words = words.reshape(-1)
+
+    positions = jnp.arange(words.shape[0], dtype=jnp.uint32)
+    h1 = jnp.sum(_fmix32(words ^ _fmix32(positions + jnp.uint32(0x9E3779B9))), dtype=jnp.uint32)
+    h2 = jnp.sum(
+        _fmix32(words + _fmix32(positions ^ jnp.uint32(0x85EBCA6B)) * jnp.uint32(0xC2B2AE35)), dtype=jnp.uint32
+    )
+    return jnp.stack([h1, h2])
+
+
+def _fmix32(h):
+    # murmur3's finalizer
+    h = h ^ (h >> 16)
+    h = h * jnp.uint32(0x85EBCA6B)
+    h = h ^ (h >> 13)
+    h = h * jnp.uint32(0xC2B2AE35)
+    return h ^ (h >> 16)
+
+
+def _load_leaf_index(checkpoint_path, fs=None) -> Optional[LeafIndex]:
+    """Loads the leaf index of an incremental checkpoint, or returns None if the checkpoint isn't incremental"""
+    if fs is None:
+        fs, _ = _get_fs_and_plain_path(checkpoint_path)
+    index_path = os.path.join(checkpoint_path, _LEAF_INDEX_FILE)
+    if not fs.exists(index_path):
+        return None
+    with fs.open(index_path) as index_in:
+        return json.load(index_in)
+
+
+def _leaf_path_overrides(checkpoint_path: str, subpath: Optional[str]) -> Optional[Dict[str, str]]:
+    """
+    For incremental checkpoints, returns a map from leaf key path (relative to `subpath`) to the path that stores the
+    leaf, for leaves that are stored in another checkpoint.
+    """
+    leaf_index = _load_leaf_index(checkpoint_path)
+    if leaf_index is None:
+        return None
+
+    parent = os.path.dirname(checkpoint_path.rstrip("/"))
+    this_checkpoint = os.path.basename(checkpoint_path.rstrip("/"))
+    prefix = "" if not subpath else subpath.strip("/").replace("/", ".") + "."
+    indices = {this_checkpoint: leaf_index}
+
+    def resolve(key, stored_in):
+        # the chain is normally flattened at save time, but follow it just in case
+        seen = {this_checkpoint}
+        while stored_in not in seen:
+            seen.add(stored_in)
+            if stored_in not in indices:
+                indices[stored_in] = _load_leaf_index(os.path.join(parent, stored_in)) or {}
+            entry = indices[stored_in].get(key)
+            if entry is None or entry["stored_in"] == stored_in:
+                break
+            stored_in = entry["stored_in"]
+        return stored_in
+
+    overrides = {}
+    for key, entry in leaf_index.items():
+        if entry["stored_in"] == this_checkpoint or not key.startswith(prefix):
+            continue
+        holder = resolve(key, entry["stored_in"])
+        overrides[key[len(prefix) :]] = os.path.join(parent, holder, *key.split("."))
+    return overrides
+
+
+def _load_manifests(checkpoint_path: str, leaf_path_overrides: Optional[Dict[str, str]]) -> Optional[Dict[str, dict]]:
+    """
+    Loads the manifest of the checkpoint and of any checkpoints holding its leaves, keyed by full array path.
+    Returns None if the checkpoint doesn't have one.
+    """
+    manifest = load_manifest(checkpoint_path)
+    if manifest is None:
+        return None
+    out = {os.path.join(checkpoint_path, k): v for k, v in manifest.items()}
+
+    if leaf_path_overrides:
+        parent = os.path.dirname(checkpoint_path.rstrip("/"))
+        holders = {os.path.relpath(p, parent).split(os.sep)[0] for p in leaf_path_overrides.values()}
+        for holder in holders:
+            holder_path = os.path.join(parent, holder)
+            # holders without a manifest just fall back to checking each path
+            out.update({os.path.join(holder_path, k): v for k, v in (load_manifest(holder_path) or {}).items()})
+
+    return out
+
+
+def _list_checkpoint_dirs(fs, plain_path) -> List[str]:
+    return [d for d in fs.glob(os.path.join(plain_path, "*")) if fs.isdir(d)]
+
+
+def _all_processes_succeeded(key: str, succeeded: bool, timeout: float = 60 * 30) -> bool:
+    """
+    Like [levanter.utils.jax_utils.barrier_sync][], but with an explicit key so it can be used from background threads.
+    Every process reports whether it succeeded, and this returns True only if all of them did.
+    """
+    if jax.process_count() == 1:
+        return succeeded
+    import jax._src.distributed as distributed
+
+    client = distributed.global_state.client
+    if client is None:
+        raise RuntimeError("Waiting at a barrier requires jax distributed client to be initialized")
+
+    timeout_in_ms = int(timeout * 1000.0)
+    client.key_value_set(f"{key}/{jax.process_index()}", "ok" if succeeded else "failed")
+    client.wait_at_barrier(key, timeout_in_ms=timeout_in_ms)
+    return all(client.blocking_key_value_get(f"{key}/{i}", timeout_in_ms) == "ok" for i in range(jax.process_count()))
+
+
 def _save_metadata(checkpoint_path, fs, step, is_temporary):
     metadata = {"step": step, "timestamp": datetime.datetime.now().isoformat(), "is_temporary": is_temporary}
     if jax.process_index() == 0:
@@ -388,6 +819,7 @@ def load_checkpoint(
     axis_mapping: Optional[haliax.partitioning.ResourceMapping] = None,
     mesh: Optional[jax.sharding.Mesh] = None,
     allow_partial: bool = False,
+    concurrent_gb: int = 32,
 ) -> M:
     """
     Load a checkpoint from a given path. If discover_latest is True, then the latest checkpoint
@@ -403,6 +835,7 @@ def load_checkpoint(
         axis_mapping: the axis mapping to use for loading the checkpoint
         mesh: the mesh to use for loading the checkpoint
         allow_partial: if True, allow partial loading of the checkpoint. If False, all parameters must be present in the checkpoint.
+        concurrent_gb: the maximum number of gigabytes to have in flight while reading the checkpoint
     Returns:
         the loaded checkpoint, with the same structure as the exemplar tree
 
@@ -427,12 +860,22 @@ def load_checkpoint(
 
     logger.info(f"Loading checkpoint from {checkpoint_path}")
 
+    leaf_path_overrides = _leaf_path_overrides(checkpoint_path, subpath)
+    manifest = _load_manifests(checkpoint_path, leaf_path_overrides)
+
     if subpath:
         checkpoint_path = os.path.join(checkpoint_path, subpath)
 
     ser, non_ser = equinox.partition(tree, is_jax_array_like)
     tree = tree_deserialize_leaves_tensorstore(
-        checkpoint_path, ser, axis_mapping=axis_mapping, mesh=mesh, allow_missing=allow_partial
+        checkpoint_path,
+        ser,
+        axis_mapping=axis_mapping,
+        mesh=mesh,
+        allow_missing=allow_partial,
+        leaf_path_overrides=leaf_path_overrides,
+        manifest=manifest,
+        concurrent_gb=concurrent_gb,
     )
     tree = equinox.combine(tree, non_ser)
     return tree
@@ -451,6 +894,7 @@ def load_checkpoint_or_initialize(
     donate_kwargs: Optional[FilterSpec] = None,
     do_load: Optional[bool] = None,
     allow_partial: bool = False,
+    concurrent_gb: int = 32,
 ) -> Callable[Sig, M]:
     """
     Load a checkpoint from a given path. If discover_latest is True, then the latest checkpoint
@@ -483,6 +927,7 @@ def load_checkpoint_or_initialize(
         donate_kwargs: a FilterSpec that specifies which kwargs to donate to init_fn if we need to initialize
         do_load: if True, always load the checkpoint. If False, always initialize. If None, load if the checkpoint exists, otherwise initialize
         allow_partial: if True, allow partial loading of the checkpoint. If False, all parameters must be present in the checkpoint.
+        concurrent_gb: the maximum number of gigabytes to have in flight while reading the checkpoint
 
     Returns:
         A function that takes the same arguments as init_fn, but loads the checkpoint if it exists and returns the
@@ -526,6 +971,7 @@ def load_checkpoint_or_initialize(
                     axis_mapping=axis_mapping,
                     mesh=mesh,
                     allow_partial=allow_partial,
+                    concurrent_gb=concurrent_gb,
                 )
             except FileNotFoundError:
                 if do_load is True:
@@ -547,11 +993,34 @@ def _load_metadata(checkpoint_path, fs=None):
     return metadata
 
 
-def discover_latest_checkpoint(checkpoint_path: PathLike) -> Optional[str]:
+def discover_latest_checkpoint(checkpoint_path: PathLike, *, local_path: Optional[PathLike] = None) -> Optional[str]:
     """
-    Discover the latest checkpoint in a given path.
+    Discover the latest checkpoint in a given path. If `local_path` is given, checkpoints staged there
+    (see [levanter.checkpoint.Checkpointer][]) are considered too, and the newest checkpoint in either tier wins.
+
+    The local tier is only considered when there's a single process. With several, each host's staging directory
+    only has that host's shards (and only process 0's has `metadata.json`), so hosts would disagree about which
+    checkpoint to load.
     """
     checkpoint_path = str(checkpoint_path)
+    candidates = _discover_checkpoints(checkpoint_path)
+    if local_path is not None:
+        if jax.process_count() == 1:
+            candidates += _discover_checkpoints(str(local_path))
+        else:
+            logger.info(f"Ignoring checkpoints staged in {local_path} because there are multiple processes")
+
+    if len(candidates) > 0:
+        _, out = max(candidates)
+        logger.info(f"Discovered latest checkpoint from {checkpoint_path} at {out}")
+        return out
+    else:
+        logger.warning(f"No checkpoints found in {checkpoint_path}")
+        return None
+
+
+def _discover_checkpoints(checkpoint_path: str) -> List[tuple]:
+    """Returns a list of ((timestamp, step), path) for each checkpoint in checkpoint_path (or checkpoint_path itself)"""
     # need to use fsspec for this, as glob.glob doesn't work on gs://
     fs: AbstractFileSystem
     fs, _ = _get_fs_and_plain_path(checkpoint_path)
@@ -573,13 +1042,7 @@ def discover_latest_checkpoint(checkpoint_path: PathLike) -> Optional[str]:
         metadata = json.load(fs.open(os.path.join(ckpt_dir, "metadata.json")))
         return (datetime.datetime.fromisoformat(metadata["timestamp"]), metadata["step"])
 
-    if len(ckpt_dirs) > 0:
-        out = max(ckpt_dirs, key=checkpoint_sort_key)
-        logger.info(f"Discovered latest checkpoint from {checkpoint_path} at {out}")
-        return out
-    else:
-        logger.warning(f"No checkpoints found in {checkpoint_path}")
-        return None
+    return [(checkpoint_sort_key(d), d) for d in ckpt_dirs]
 
 
 def _get_fs_and_plain_path(path, fs=None):
@@ -601,6 +1064,16 @@ class CheckpointerConfig:
     )  # list of dicts with two keys: every and until
 
     append_run_id_to_base_path: bool = True
+    local_base_path: Optional[str] = None
+    """
+    If set, checkpoints are first written to this (fast, host-local) directory and then uploaded to base_path in the
+    background. The run id is appended just like for base_path.
+    """
+    max_concurrent_uploads: int = 8
+    max_pending_uploads: int = 1
+    """How many staged checkpoints can wait to be uploaded before saving blocks."""
+    incremental: bool = False
+    """If True, arrays that haven't changed since the previous checkpoint are referenced instead of rewritten."""
     delete_old_temp_checkpoints: bool = True
     """
     If True, delete old checkpoints from prior attempts at this run. If False, keep them.
@@ -613,6 +1086,13 @@ class CheckpointerConfig:
             return os.path.expanduser(os.path.join(self.base_path, run_id))
         return os.path.expanduser(self.base_path)
 
+    def expanded_local_path(self, run_id) -> Optional[str]:
+        if self.local_base_path is None:
+            return None
+        if self.append_run_id_to_base_path:
+            return os.path.expanduser(os.path.join(self.local_base_path, run_id))
+        return os.path.expanduser(self.local_base_path)
+
     def create(self, run_id) -> Checkpointer:
         keeps = [CheckpointInterval(**k) for k in self.keep]
         return Checkpointer(
@@ -620,6 +1100,10 @@ class CheckpointerConfig:
             save_interval=self.save_interval,
             step_policies=keeps,
             delete_old_temp_checkpoints=self.delete_old_temp_checkpoints,
+            local_path=self.expanded_local_path(run_id),
+            max_concurrent_uploads=self.max_concurrent_uploads,
+            max_pending_uploads=self.max_pending_uploads,
+            incremental=self.incremental,
         )
 
     def __post_init__(self):
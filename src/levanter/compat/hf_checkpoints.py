@@ -5,9 +5,12 @@ import json
 import logging
 import os
 import shutil
+import struct
 import tempfile
+import threading
 import urllib.parse
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from functools import cached_property
 from typing import Generic, Optional, Tuple, Type, TypeVar, Union, cast
@@ -19,6 +22,7 @@ import huggingface_hub
 import jax
 import jax.numpy as jnp
 import mergedeep
+import numpy as np
 import safetensors
 import safetensors.numpy
 import transformers.utils.hub
@@ -26,7 +30,7 @@ from fsspec import AbstractFileSystem
 from huggingface_hub import HfApi, hf_hub_download, repo_exists, snapshot_download
 from huggingface_hub.file_download import repo_folder_name
 from huggingface_hub.utils import EntryNotFoundError, GatedRepoError, HFValidationError, RepositoryNotFoundError
-from jax.experimental.multihost_utils import sync_global_devices
+from jax.experimental.multihost_utils import process_allgather, sync_global_devices
 from jax.random import PRNGKey
 from jaxtyping import Array, PRNGKeyArray
 from tqdm import tqdm
@@ -34,7 +38,12 @@ from tqdm import tqdm
 import haliax
 from haliax import Axis
 from haliax.partitioning import ResourceMapping
-from haliax.state_dict import from_torch_compatible_state_dict, save_state_dict, to_torch_compatible_state_dict
+from haliax.state_dict import (
+    flatten_modules_for_export,
+    from_torch_compatible_state_dict,
+    is_jax_array_like,
+    to_state_dict,
+)
 
 from levanter.callbacks import StepInfo
 from levanter.models.asr_model import ASRMixin
@@ -78,6 +87,9 @@ SAFE_TENSORS_MODEL = "model.safetensors"
 PYTORCH_WEIGHTS_INDEX_NAME = "pytorch_model.bin.index.json"
 SAFE_TENSORS_INDEX_NAME = "model.safetensors.index.json"
 
+# how many checkpoint shard files to fetch at once
+MAX_CONCURRENT_SHARD_LOADS = 8
+
 
 @dataclass(frozen=True)
 class RepoRef:
@@ -207,6 +219,121 @@ def _load_safe_tensors(path, dtype):
     return d
 
 
+_SAFETENSORS_DTYPES = {
+    "BOOL": np.bool_,
+    "U8": np.uint8,
+    "I8": np.int8,
+    "U16": np.uint16,
+    "I16": np.int16,
+    "U32": np.uint32,
+    "I32": np.int32,
+    "U64": np.uint64,
+    "I64": np.int64,
+    "F16": np.float16,
+    "BF16": jnp.bfloat16,
+    "F32": np.float32,
+    "F64": np.float64,
+    "F8_E4M3": jnp.float8_e4m3fn,
+    "F8_E5M2": jnp.float8_e5m2,
+}
+
+
+class _RemoteSafetensorsSlice:
+    """
+    Like safetensors' PySafeSlice, but for a tensor in a safetensors file on any fsspec filesystem. Indexing only
+    reads the rows (along the first axis) that the index touches, so each host only fetches the bytes it needs.
+
+    Each distinct row range is fetched once and then sliced locally: best_effort_sharding usually splits a later
+    axis, in which case every local device asks for the same rows.
+    """
+
+    def __init__(self, fs: AbstractFileSystem, path: str, offset: int, dtype, shape: Tuple[int, ...]):
+        self.fs = fs
+        self.path = path
+        self.offset = offset
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        self._rows: dict[tuple[int, int], np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def get_shape(self):
+        return list(self.shape)
+
+    def __getitem__(self, indices):
+        if not isinstance(indices, tuple):
+            indices = (indices,)
+
+        if len(self.shape) == 0:
+            # x[:] on a scalar is the scalar
+            return self._read_rows(0, 1).reshape(())[tuple(i for i in indices if i != slice(None))]
+
+        first = indices[0] if indices else slice(None)
+        if isinstance(first, slice) and first.step in (None, 1):
+            start, stop, _ = first.indices(self.shape[0])
+            stop = max(start, stop)
+            rows = self._read_rows(start, stop)
+            return rows[(slice(None),) + tuple(indices[1:])]
+
+        return self._read_rows(0, self.shape[0])[indices]
+
+    def _read_rows(self, start, stop):
+        with self._lock:
+            if (start, stop) not in self._rows:
+                self._rows[(start, stop)] = self._fetch_rows(start, stop)
+            return self._rows[(start, stop)]
+
+    def _fetch_rows(self, start, stop):
+        row_shape = self.shape[1:]
+        row_bytes = int(np.prod(row_shape, dtype=np.int64)) * self.dtype.itemsize
+        if stop <= start or row_bytes == 0:
+            return np.zeros((max(stop - start, 0),) + row_shape, dtype=self.dtype)
+        data = self.fs.cat_file(self.path, start=self.offset + start * row_bytes, end=self.offset + stop * row_bytes)
+        return np.frombuffer(data, dtype=self.dtype).reshape((stop - start,) + row_shape)
+
+
+def _load_safe_tensors_remote(fs: AbstractFileSystem, path: str, dtype):
+    """
+    Loads a safetensors file from any fsspec filesystem without downloading it: we read the header, and then each
+    device reads just the byte ranges for its shard of each tensor.
+    """
+    with fs.open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+
+    data_start = 8 + header_size
+    d = {}
+    keys = [k for k in header.keys() if k != "__metadata__"]
+    for key in tqdm(keys, total=len(keys), desc=f"Loading weights from {os.path.basename(path)}"):
+        info = header[key]
+        begin, _ = info["data_offsets"]
+        tensor_slice = _RemoteSafetensorsSlice(
+            fs, path, data_start + begin, _SAFETENSORS_DTYPES[info["dtype"]], info["shape"]
+        )
+        d[key] = _maybe_shard_best_effort(tensor_slice, dtype)
+
+    return d
+
+
+def _load_shards_concurrently(shard_paths, load_fn) -> dict:
+    """Calls load_fn on each shard path, MAX_CONCURRENT_SHARD_LOADS at a time, and merges the state dicts."""
+    # the mesh and default device are thread-local, so the workers need to re-enter the caller's
+    mesh = haliax.partitioning._get_mesh()
+    default_device = jax.config.jax_default_device  # type: ignore[attr-defined]
+
+    def load_in_context(shard_path):
+        with contextlib.ExitStack() as stack:
+            if mesh is not None:
+                stack.enter_context(mesh)
+            stack.enter_context(jax.default_device(default_device))
+            return load_fn(shard_path)
+
+    final_state_dict = {}
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SHARD_LOADS) as pool:
+        for shard_state_dict in pool.map(load_in_context, shard_paths):
+            final_state_dict.update(shard_state_dict)
+    return final_state_dict
+
+
 @dataclass_with_default_init(frozen=True)
 class HFCheckpointConverter(Generic[LevConfig]):
     """
@@ -489,26 +616,23 @@ class HFCheckpointConverter(Generic[LevConfig]):
             with open(index_path, "r", encoding="utf-8") as f:
                 index = json.load(f)
 
-            shard_files = list(set(index["weight_map"].values()))
-            final_state_dict = {}
+            shard_files = sorted(set(index["weight_map"].values()))
 
-            # right now we do safe tensors thing
-            # where we load into memory then update some dict
+            # safetensors are memory-mapped, so each device only reads its slice of each tensor
             if "safetensors" in index_file:
                 loader = _load_safe_tensors
             else:
                 loader = _load_torch
 
-            for shard_file in shard_files:
+            def load_shard(shard_file):
                 shard_path = os.path.join(id, shard_file)
                 if not os.path.exists(shard_path):
                     # Download the shard if not found locally
                     shard_path = hf_hub_download(id, shard_file, revision=rev)
 
-                shard_state_dict = loader(shard_path, dtype)
-                final_state_dict.update(shard_state_dict)
+                return loader(shard_path, dtype)
 
-        return final_state_dict
+            return _load_shards_concurrently(shard_files, load_shard)
 
     def _load_from_gcs(self, gcs_path: str, dtype: Optional[jnp.dtype] = None) -> dict:
         """Load a state dict from a GCS path"""
@@ -522,37 +646,33 @@ class HFCheckpointConverter(Generic[LevConfig]):
                 with fs.open(index_path, "r") as f:
                     index = json.load(f)
 
-                shard_files = list(set(index["weight_map"].values()))
-                final_state_dict = {}
+                shard_files = sorted(set(index["weight_map"].values()))
+                is_safetensors = "safetensors" in index_file
 
-                if "safetensors" in index_file:
-                    loader = _load_safe_tensors
-                else:
-                    loader = _load_torch
-
-                for shard_file in shard_files:
+                def load_shard(shard_file):
                     shard_path = os.path.join(path, shard_file)
                     if not fs.exists(shard_path):
                         raise FileNotFoundError(f"Shard file {shard_path} not found")
 
-                    # Download shard to temporary file
+                    if is_safetensors:
+                        return _load_safe_tensors_remote(fs, shard_path, dtype)
+
+                    # torch pickles need a real file
                     with tempfile.NamedTemporaryFile() as tmp:
                         fs.get(shard_path, tmp.name)
-                        shard_state_dict = loader(tmp.name, dtype)
-                        final_state_dict.update(shard_state_dict)
+                        return _load_torch(tmp.name, dtype)
 
-                return final_state_dict
+                return _load_shards_concurrently(shard_files, load_shard)
 
         # If no index file found, try loading single file checkpoint
         for model_file in [SAFE_TENSORS_MODEL, PYTORCH_MODEL]:
             model_path = os.path.join(path, model_file)
             if fs.exists(model_path):
+                if model_file == SAFE_TENSORS_MODEL:
+                    return _load_safe_tensors_remote(fs, model_path, dtype)
                 with tempfile.NamedTemporaryFile() as tmp:
                     fs.get(model_path, tmp.name)
-                    if model_file == SAFE_TENSORS_MODEL:
-                        return _load_safe_tensors(tmp.name, dtype)
-                    else:
-                        return _load_torch(tmp.name, dtype)
+                    return _load_torch(tmp.name, dtype)
 
         raise FileNotFoundError(f"No checkpoint files found in {gcs_path}")
 
@@ -594,8 +714,7 @@ class HFCheckpointConverter(Generic[LevConfig]):
             contexts.enter_context(use_cpu_device())
 
         with contexts:
-            # TODO: in an ideal world, we would only load the part of the array we needed, but
-            # AFAICT neither torch state dicts nor safetensors support this.
+            # for safetensors, each device only reads its shard of each tensor. torch state dicts are loaded whole.
             state_dict = self.load_state_dict(ref, dtype)
 
         ignore_prefix: Optional[str] = None
@@ -659,6 +778,7 @@ class HFCheckpointConverter(Generic[LevConfig]):
         max_shard_size: int,
         save_feature_extractor: bool = False,
         dtype: Optional[jnp.dtype] = None,
+        weights_path: Optional[str] = None,
     ):
         """
         Saves a HF-compatible checkpoint to a local path.
@@ -666,6 +786,7 @@ class HFCheckpointConverter(Generic[LevConfig]):
         :param path: The path to save the output to
         :param save_tokenizer: Save the tokenizer to the checkpoint
         :param save_reference_code: Save any code from the reference checkpoint
+        :param weights_path: Where to write the weights, if not `path`. May be any fsspec path.
         :return:
         """
         logger.info(f"Saving HF-compatible checkpoint to {path}")
@@ -743,25 +864,17 @@ class HFCheckpointConverter(Generic[LevConfig]):
             json.dump(dict_config, f, cls=ConfigJSONEncoder)
 
         # Model
-        state_dict = to_torch_compatible_state_dict(model)
+        # We keep the arrays on device (and sharded) here, and only bring one tensor at a time to the host as we write
+        state_dict = to_state_dict(flatten_modules_for_export(eqx.filter(model, is_jax_array_like)))
+        state_dict = {k: v for k, v in state_dict.items() if v is not None}
 
         if dtype is not None:
-            logger.info(f"Converting floating-point arrays in state_dict to {dtype}")
-            for k, v in state_dict.items():
-                if jnp.issubdtype(v.dtype, jnp.floating):
-                    state_dict[k] = v.astype(dtype)
-                else:
-                    logger.debug(f"Skipping dtype conversion for non-floating point array {k} with dtype {v.dtype}")
-
-        shards, index = _shard_hf_checkpoint(state_dict, max_shard_size, SAFE_TENSORS_MODEL)
-        if index is None:
-            save_state_dict(state_dict, os.path.join(path, SAFE_TENSORS_MODEL))
-        else:
-            for k, v in shards.items():
-                save_state_dict(v, os.path.join(path, k))
-            with open(os.path.join(path, SAFE_TENSORS_INDEX_NAME), "w") as f:
-                json.dump(index, f)
+            # each tensor is cast just before it's fetched, so we never hold a second copy of the whole model
+            logger.info(f"Converting floating-point arrays in state_dict to {dtype} as they are written")
 
+        shards, index = _shard_hf_checkpoint(state_dict, max_shard_size, SAFE_TENSORS_MODEL, dtype=dtype)
+        _save_hf_shards_streaming(shards, index, weights_path or path, dtype=dtype)
+        if index is not None:
             logger.info(f"Saved a sharded checkpoint with {len(shards)} shards, max size {max_shard_size} bytes")
 
         logger.info(f"Finished saving HF-compatible checkpoint to {path}")
@@ -797,6 +910,9 @@ class HFCheckpointConverter(Generic[LevConfig]):
         If None, will save code for models that aren't in the HF repo.
         """
         with temp_dir_before_upload(path) as local_path:
+            # weights are big, so we stream them straight to their destination unless we need a local copy to
+            # upload to the hub. the rest goes through the temp dir.
+            weights_path = path if upload_to_hf is False else local_path
             if path != local_path:
                 logger.info(f"Saving model to {path} via temp path {local_path}")
 
@@ -808,6 +924,7 @@ class HFCheckpointConverter(Generic[LevConfig]):
                 save_feature_extractor=save_feature_extractor,
                 max_shard_size=max_shard_size,
                 dtype=dtype,
+                weights_path=weights_path,
             )
 
             if upload_to_hf is True:
@@ -1026,6 +1143,7 @@ def _shard_hf_checkpoint(
     state_dict: dict[str, Array],
     max_shard_size: int = DEFAULT_MAX_SHARD_SIZE,
     weights_name: str = SAFE_TENSORS_MODEL,
+    dtype: Optional[jnp.dtype] = None,
 ):
     """
     Splits a model state dictionary in sub-checkpoints so that the final size of each sub-checkpoint does not exceed a
@@ -1049,6 +1167,8 @@ def _shard_hf_checkpoint(
             The maximum size of each sub-checkpoint.
         weights_name (`str`, *optional*, defaults to `"pytorch_model.bin"`):
             The name of the model save file.
+        dtype (`jnp.dtype`, *optional*):
+            If set, floating-point weights are sized as if they were saved in this dtype.
 
     Returns:
         A tuple comprising the sharded state dictionaries and the index. The index is a dictionary with two keys:
@@ -1062,7 +1182,7 @@ def _shard_hf_checkpoint(
     total_size = 0
 
     for key, weight in state_dict.items():
-        weight_size = weight.size * weight.itemsize
+        weight_size = weight.size * np.dtype(_export_dtype(weight, dtype)).itemsize
 
         # If this weight is going to tip up over the maximal size, we split, but only if we have put at least one
         # weight in the current shard.
@@ -1097,6 +1217,103 @@ def _shard_hf_checkpoint(
     return shards, index
 
 
+def _save_hf_shards_streaming(
+    shards: dict[str, dict[str, Array]], index: Optional[dict], path: str, dtype: Optional[jnp.dtype] = None
+):
+    """
+    Writes the shards from [levanter.compat.hf_checkpoints._shard_hf_checkpoint][] to `path` (any fsspec path).
+    Shard files are divided round-robin between processes, and each process streams its files to their destination
+    one tensor at a time, so no host ever holds more than a couple of tensors. If `dtype` is set, floating-point
+    tensors are cast to it one at a time as they are written. Must be called on all processes.
+    """
+    global _sync_count
+    fs, plain_path = fsspec.core.url_to_fs(path)
+    fs.makedirs(plain_path, exist_ok=True)
+
+    for i, (shard_file, shard) in enumerate(shards.items()):
+        is_writer = i % jax.process_count() == jax.process_index()
+        _write_safetensors_streaming(shard, os.path.join(path, shard_file), is_writer, dtype)
+
+    if index is not None and jax.process_index() == 0:
+        with fsspec.open(os.path.join(path, SAFE_TENSORS_INDEX_NAME), "w") as f:
+            json.dump(index, f)
+
+    sync_global_devices(f"save hf shards {_sync_count}")
+    _sync_count += 1
+
+
+def _write_safetensors_streaming(
+    tensors: dict[str, Array], path: str, is_writer: bool, dtype: Optional[jnp.dtype] = None
+):
+    """
+    Writes a safetensors file without building it in memory first: the header only needs shapes and dtypes, and
+    then each tensor is brought to the host and written in turn, overlapping the write with fetching the next tensor.
+    Processes that aren't the writer still participate in gathering tensors that span hosts.
+    """
+    header: dict = {"__metadata__": {"format": "pt"}}  # the "pt" is a lie but HF demands it
+    offset = 0
+    for key, v in tensors.items():
+        v_dtype = np.dtype(_export_dtype(v, dtype))
+        nbytes = int(np.prod(v.shape, dtype=np.int64)) * v_dtype.itemsize
+        header[key] = {
+            "dtype": _SAFETENSORS_DTYPE_NAMES[v_dtype],
+            "shape": list(v.shape),
+            "data_offsets": [offset, offset + nbytes],
+        }
+        offset += nbytes
+
+    if not is_writer:
+        for v in tensors.values():
+            if _needs_collective_to_fetch(v):
+                _fetch_to_host(_cast_for_export(v, dtype))
+        return
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    # safetensors pads the header to a multiple of 8 bytes
+    header_bytes += b" " * (-len(header_bytes) % 8)
+
+    with fsspec.open(path, "wb") as f, ThreadPoolExecutor(max_workers=1) as writer:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        pending = None
+        for key, v in tqdm(tensors.items(), total=len(tensors), desc=f"Writing {os.path.basename(path)}"):
+            data = np.ascontiguousarray(_fetch_to_host(_cast_for_export(v, dtype))).reshape(-1).view(np.uint8)
+            if pending is not None:
+                pending.result()
+            pending = writer.submit(f.write, data)
+        if pending is not None:
+            pending.result()
+
+
+_SAFETENSORS_DTYPE_NAMES = {np.dtype(v): k for k, v in _SAFETENSORS_DTYPES.items()}
+
+
+def _export_dtype(v, dtype):
+    """The dtype `v` is saved in: `dtype` for floating-point arrays (if set), otherwise its own."""
+    if dtype is not None and jnp.issubdtype(v.dtype, jnp.floating):
+        return dtype
+    return v.dtype
+
+
+def _cast_for_export(v, dtype):
+    export_dtype = _export_dtype(v, dtype)
+    if export_dtype == v.dtype:
+        return v
+    return v.astype(export_dtype)
+
+
+def _needs_collective_to_fetch(v) -> bool:
+    return isinstance(v, jax.Array) and not v.is_fully_addressable and not v.is_fully_replicated
+
+
+def _fetch_to_host(v) -> np.ndarray:
+    if not isinstance(v, jax.Array) or v.is_fully_addressable:
+        return np.asarray(v)
+    if v.is_fully_replicated:
+        return np.asarray(v.addressable_data(0))
+    return np.asarray(process_allgather(v, tiled=True))
+
+
 def _maybe_shard_best_effort(array_or_slice, dtype) -> jax.Array:
     """Shards an array to non-cpu devices if we have more than one device, otherwise just stays on cpu"""
     # We do this to not waste memory on the target device if it's not going to help us save memory/io
@@ -1,10 +1,13 @@
 from abc import ABC, abstractmethod
-from typing import Any, Callable, Dict, Generic, Iterable, Mapping, Sequence, TypeVar, Union
+from typing import TYPE_CHECKING, Any, Callable, Dict, Generic, Iterable, Mapping, Sequence, TypeVar, Union
 
 import numpy as np
 import pyarrow as pa
 
 
+if TYPE_CHECKING:
+    from levanter.store.jagged_array import PreparedBatch
+
 T = TypeVar("T")
 T_co = TypeVar("T_co", covariant=True)
 T_contra = TypeVar("T_contra", contravariant=True)
@@ -64,6 +67,21 @@ class BatchProcessor(Generic[T_contra, U_co], ABC):
         """Any metadata that changes the behavior of this processor."""
         raise NotImplementedError
 
+    @property
+    def supports_record_batches(self) -> bool:
+        """
+        Whether this processor implements [process_record_batch][]. If it does, and the data source can produce
+        record batches, the cache builder uses that columnar path instead of per-example dicts.
+        """
+        return False
+
+    def process_record_batch(self, batch: pa.RecordBatch) -> Mapping[str, "PreparedBatch"]:
+        """
+        Process a RecordBatch straight into one [PreparedBatch][] per output field (i.e. per key of the output
+        exemplar), ready to be appended to a cache.
+        """
+        raise NotImplementedError
+
 
 class _DatasetTransform(ABC):
     pass
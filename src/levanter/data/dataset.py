@@ -8,6 +8,8 @@ import jax.random
 import numpy as np
 from jaxtyping import PRNGKeyArray
 
+import haliax as hax
+
 from levanter.data._prp import PermType
 from levanter.utils import thread_utils
 
@@ -97,6 +99,15 @@ class AsyncDataset(DatasetBase[T_co]):
     async def get_batch(self, indices: Sequence[int]) -> Sequence[T_co]:
         raise NotImplementedError
 
+    async def get_batch_slices(self, indices: Sequence[int], item_slice: slice) -> Sequence[T_co]:
+        """
+        Like `get_batch`, but returns only `item_slice` of the first axis of every leaf of each item. The DataLoader
+        uses this when this host only needs part of each example (e.g. when the position axis is sharded).
+
+        The default implementation loads whole items and slices them. Override this if you can read less.
+        """
+        return [_slice_item(item, item_slice) for item in await self.get_batch(indices)]
+
     async def wait_until_len_at_least(self, length: int) -> int:
         """
         Returns the length of the dataset once it is at least `length` or if the dataset has a known (finished) length.
@@ -120,7 +131,9 @@ class AsyncDataset(DatasetBase[T_co]):
     def map(self, fn: MapFunction[U], *extra_args, **extra_kwargs) -> "MappedAsyncDataset[T_co, U]":
         return MappedAsyncDataset(self, fn, *extra_args, **extra_kwargs)
 
-    def map_batches(self, fn: MapFunction[Sequence[U]], *extra_args, **extra_kwargs) -> "BatchMappedAsyncDataset[U]":
+    def map_batches(
+        self, fn: MapFunction[Sequence[U]], *extra_args, **extra_kwargs
+    ) -> "BatchMappedAsyncDataset[T_co, U]":
         return BatchMappedAsyncDataset(self, fn, *extra_args, **extra_kwargs)
 
     def slice_dataset(self, start_index: Optional[int] = None, end_index: Optional[int] = None):
@@ -145,6 +158,31 @@ class AsyncDataset(DatasetBase[T_co]):
 
         return permutation.EraShufflingDataset(self, era_length, key=key, perm_type=perm_type)
 
+    def chunk_shuffle(
+        self, chunk_size: int, window_chunks: int, key: PRNGKeyArray, *, perm_type: PermType = "feistel"
+    ):
+        """
+        Shuffles chunks of `chunk_size` consecutive examples, then shuffles examples within windows of
+        `window_chunks` chunks. This keeps reads local to a few storage chunks per batch.
+        See [[ChunkShufflingDataset]].
+        """
+        import levanter.data.permutation as permutation
+
+        return permutation.ChunkShufflingDataset(self, chunk_size, window_chunks, key=key, perm_type=perm_type)
+
+
+def _slice_item(item, item_slice: slice):
+    """Slices the first axis of every leaf of `item`. For NamedArrays, this is the first named axis."""
+
+    def _slice_leaf(leaf):
+        if isinstance(leaf, hax.NamedArray):
+            first_axis = leaf.axes[0]
+            new_size = len(range(*item_slice.indices(first_axis.size)))
+            return hax.NamedArray(leaf.array[item_slice], (first_axis.resize(new_size), *leaf.axes[1:]))
+        return leaf[item_slice]
+
+    return jax.tree.map(_slice_leaf, item, is_leaf=lambda x: isinstance(x, hax.NamedArray))
+
 
 async def naive_busy_wait_until_len_at_least(dataset: AsyncDataset[T_co], length: int) -> int:
     """
@@ -407,13 +445,19 @@ class SlicedAsyncDataset(AsyncDataset[U]):
         self._min_known_len = dataset._min_known_len if end_index is None else (end_index - start_index)
 
     async def get_batch(self, indices: Sequence[int]) -> Sequence[U]:
+        return await self.dataset.get_batch(self._shift_indices(indices))
+
+    async def get_batch_slices(self, indices: Sequence[int], item_slice: slice) -> Sequence[U]:
+        return await self.dataset.get_batch_slices(self._shift_indices(indices), item_slice)
+
+    def _shift_indices(self, indices: Sequence[int]) -> list[int]:
         shifted_indices = [(index + self.start_index) for index in indices]
         max_index = max(shifted_indices)
 
         if self.end_index is not None and max_index > self.end_index:
             raise ValueError("Requested indices beyond the end of the dataset")
 
-        return await self.dataset.get_batch(shifted_indices)
+        return shifted_indices
 
     async def async_len(self) -> int:
         underlying_length = await self.dataset.async_len()
@@ -442,7 +486,7 @@ class SlicedAsyncDataset(AsyncDataset[U]):
             return underlying_length
 
 
-class BatchMappedAsyncDataset(AsyncDataset[U]):
+class BatchMappedAsyncDataset(AsyncDataset[U], Generic[T, U]):
     """
     A dataset that applies a function to each batch of items in the dataset.
     You can pass extra arguments to the function using `*extra_args` and `**extra_kwargs`.
@@ -544,6 +588,13 @@ class EpochDataset(AsyncDataset[T_co]):
         return self.max_epochs * await self.dataset.async_len()
 
     async def get_batch(self, indices: Sequence[int]) -> Sequence[T_co]:
+        # Delegate to the underlying dataset's get_batch
+        return await self.dataset.get_batch(await self._wrap_indices(indices))
+
+    async def get_batch_slices(self, indices: Sequence[int], item_slice: slice) -> Sequence[T_co]:
+        return await self.dataset.get_batch_slices(await self._wrap_indices(indices), item_slice)
+
+    async def _wrap_indices(self, indices: Sequence[int]) -> list[int]:
         # Use self.wait_until_len_at_least to ensure we have enough data for the batch.
         max_index = max(indices)
         ds_len = await self.dataset.wait_until_len_at_least(max_index + 1)
@@ -558,10 +609,7 @@ class EpochDataset(AsyncDataset[T_co]):
             )
 
         # Wrap the indices within the bounds of the dataset length
-        wrapped_indices = [idx % ds_len for idx in indices]
-
-        # Delegate to the underlying dataset's get_batch
-        return await self.dataset.get_batch(wrapped_indices)
+        return [idx % ds_len for idx in indices]
 
     async def wait_until_len_at_least(self, length: int) -> int:
         """
@@ -1,16 +1,19 @@
 import asyncio
 import dataclasses
 import functools
+import itertools
 import logging
+import threading
 import time
 import warnings
 from collections import defaultdict
-from collections.abc import AsyncIterator, Callable, Iterable, Iterator
+from collections.abc import AsyncIterator, Callable, Iterable, Iterator, Sequence
 from dataclasses import dataclass
 from functools import lru_cache
 from typing import Generic, TypeVar
 
 import jax
+import numpy as np
 from jax import Array
 from jax import numpy as jnp
 from jax import tree_util as jtu
@@ -24,7 +27,7 @@ from haliax import is_named_array
 from haliax._src.util import index_where
 from haliax.partitioning import ResourceMapping
 
-from levanter.data.dataset import AsyncDataset
+from levanter.data.dataset import AsyncDataset, _slice_item
 from levanter.data.utils import batched
 from levanter.models.attention import AttentionMask
 from levanter.models.lm_model import LmExample
@@ -75,14 +78,17 @@ class DataLoader(Iterable[Ex]):
         prefetch_size: int = 32,
         pad_final_batch: bool = True,
         allow_nondivisible_batch_size: bool = False,
+        max_buffered_bytes: int | None = None,
+        device_prefetch_size: int = 2,
     ):
         """
         Batch- and NamedArray-aware data loader. This class works with an [AsyncDataset][], a Mesh,
         and a resource mapping to load data in a way that is aware of the batch axis and the sharding
         of the data. In general, each machine only loads the data that it needs to process.
 
-        (At the moment, it's not smart enough to load parts of examples if examples are sharded across machines,
-        but whole examples are handled correctly.)
+        If examples are sharded across machines (e.g. along the sequence axis), each machine asks the dataset for
+        just its slice of each example with [levanter.data.AsyncDataset.get_batch_slices][]. Datasets that can't
+        read partial examples fall back to reading whole examples and slicing them.
 
         Args:
             batch_size (int | IntSchedule | None): The size of the batch or a schedule for the size of the batch
@@ -95,8 +101,15 @@ class DataLoader(Iterable[Ex]):
             batch_axis_name (str | None): The name of the batch axis. If None, defaults to "batch" unless batch_size is an Axis.
             pad_final_batch (bool): If True, the final batch will be padded to the size of the previous batch.
             allow_nondivisible_batch_size (bool): All the batch size to be non-divisible by the data axis size (typically the number of devices).
+            max_buffered_bytes (Optional[int]): The maximum number of bytes of examples to hold on the host in
+             retrieved batches that haven't been sent to devices yet. At least one batch is always allowed. If None,
+             only max_buffered_batches applies.
+            device_prefetch_size (int): The number of batches to stack and send to devices ahead of the consumer.
+             These batches live in device memory, so this should be small.
         """
         self.max_buffered_batches = max_buffered_batches
+        self.max_buffered_bytes = max_buffered_bytes
+        self.device_prefetch_size = device_prefetch_size
         self.prefetch_size = prefetch_size
         self.axis_resources = axis_resources
         self.data_store = data
@@ -131,6 +144,7 @@ class DataLoader(Iterable[Ex]):
             initial_example = blocking_wait(self.data_store.getitem_async(0))
             self._ex_leaves, self._ex_structure = jax.tree.flatten(initial_example, is_leaf=is_named_array)
             self._padding_example = _make_padding_example(initial_example)
+            self._example_nbytes = sum(getattr(leaf, "nbytes", 0) for leaf in jax.tree.leaves(initial_example))
 
         if not self._allow_non_divisible_batch_size:
             self._check_batch_size_divisibility()
@@ -234,18 +248,48 @@ class DataLoaderIterator(Iterator[Ex]):
         if self.mapping is None:
             self.mapping = hax.partitioning.current_thread_local_mapping()
 
+        # We load data in two background stages, so that the consumer only has to pop batches that are ready:
+        # 1. retrieve examples from the dataset (on a CPU-only thread), holding at most max_buffered_bytes of them
+        # 2. stack examples and transfer them to the devices, at most device_prefetch_size batches ahead
         buffered_batches = self.dl.max_buffered_batches
-        self._batches: Iterator[Ex]
+        self._byte_budget = _ByteBudget(self.dl.max_buffered_bytes)
+        # only the thread that batchifies touches these
+        self._host_buffers = _HostBufferRing(2) if _can_reuse_host_buffers(self.dl.mesh) else None
+
+        # If our devices only need part of each example (e.g. the position axis is sharded across hosts), we only
+        # load that part. This is a slice of the first axis of every leaf of the example.
+        self._item_slice = self._compute_local_item_slice()
+        self._padding_example = self.dl._padding_example
+        if self._item_slice is not None:
+            self._padding_example = _slice_item(self._padding_example, self._item_slice)
+        self._batches: Iterator[_Batch[Ex]]
+        self._ready_batches: Iterator[Ex] | None
         if buffered_batches == 0:
             self._batches = AsyncIteratorWrapper(self._produce_batches())
+            self._ready_batches = None
         else:
             self._batches = _JaxCpuBackgroundIterator(self._produce_batches, max_capacity=buffered_batches)
+            if buffered_batches is not None and buffered_batches < 0:
+                # single threaded operation
+                self._ready_batches = None
+            else:
+                self._ready_batches = BackgroundIterator(
+                    self._produce_ready_batches, max_capacity=max(self.dl.device_prefetch_size, 1)
+                )
 
     def __next__(self):
         time_start = time.time()
+        if self._ready_batches is not None:
+            batch = next(self._ready_batches)
+            time_end = time.time()
+            if (time_end - time_start) > 0.5:
+                logger.info(f"Prefetch wasn't fast enough: {time_end - time_start:.3f}.")
+            return batch
+
         individual_data_batch = next(self._batches)
         time_mid = time.time()
         batch = self._batchify_local_data(individual_data_batch)
+        self._byte_budget.release(self._nbytes_of(individual_data_batch))
 
         time_end = time.time()
         time_batch = time_end - time_mid
@@ -257,9 +301,23 @@ class DataLoaderIterator(Iterator[Ex]):
         return batch
 
     def __del__(self):
+        if hasattr(self, "_byte_budget"):
+            self._byte_budget.close()
+        # the ready-batch thread may be blocked waiting on the retrieval thread, so don't wait for it
+        if getattr(self, "_ready_batches", None) is not None:
+            self._ready_batches.stop(wait=False)  # type: ignore
         if hasattr(self, "_batches") and hasattr(self._batches, "stop"):
             self._batches.stop()
 
+    def _produce_ready_batches(self) -> Iterator[Ex]:
+        for individual_data_batch in self._batches:
+            batch = self._batchify_local_data(individual_data_batch)
+            self._byte_budget.release(self._nbytes_of(individual_data_batch))
+            yield batch
+
+    def _nbytes_of(self, batch: _Batch[Ex]) -> int:
+        return len(batch.data_by_local_index) * self.dl._example_nbytes
+
     async def _produce_batches(self):
         batch_number = self._start_from_batch or 0
         done = False
@@ -294,6 +352,9 @@ class DataLoaderIterator(Iterator[Ex]):
             batch_of_batches: list[_Batch[Ex]] = await self._do_retrieve_batch_of_batches(batches)
 
             for batch in batch_of_batches:
+                if not await asyncio.to_thread(self._byte_budget.acquire, self._nbytes_of(batch)):
+                    # we were stopped
+                    return
                 yield batch
 
             batch_number = next_batch_numbers[-1] + 1
@@ -342,6 +403,7 @@ class DataLoaderIterator(Iterator[Ex]):
         cache: dict[tuple[int, int], list[Array | hax.NamedArray]] = {}
         padded_batch_size = self.dl.rounded_batch_size_at_step(batch.index)
         Batch = hax.Axis(self.dl.batch_axis_name, padded_batch_size)
+        slot = self._host_buffers.start_batch() if self._host_buffers is not None else None
 
         def get_local_batch(begin: int, end: int) -> list:
             if (begin, end) in cache:
@@ -353,11 +415,12 @@ class DataLoaderIterator(Iterator[Ex]):
                     local_data.append(batch.data_by_local_index[i])
                 except KeyError:
                     assert self.dl._allow_non_divisible_batch_size or self.dl._pad_final_batch
-                    local_data.append(self.dl._padding_example)
+                    local_data.append(self._padding_example)
 
-            # TODO: if we ever do "big data" (i.e. huge examples) we might want to be able to load part of an example
-            # which will require support from the datastore (i.e. tensorstore)
-            device_batch = stack_tree(self.dl.batch_axis_name, local_data)
+            out_buffer = None
+            if self._host_buffers is not None:
+                out_buffer = functools.partial(self._host_buffers.buffer, slot, (begin, end))
+            device_batch = _stack_local_data(self.dl.batch_axis_name, local_data, out_buffer=out_buffer)
             batch_leaves = hax.tree_util.tree_leaves(device_batch)
 
             cache[(begin, end)] = batch_leaves
@@ -372,6 +435,10 @@ class DataLoaderIterator(Iterator[Ex]):
 
             leaf_data = get_local_batch(begin, end)[leaf_index]
 
+            if self._item_slice is not None:
+                # we only loaded part of each example, so shift the (first) item axis to match
+                indices = (indices[0], self._shift_into_item_slice(indices[1]), *indices[2:])
+
             if isinstance(leaf_data, hax.NamedArray):
                 # select out the batch axis
                 batch_index = index_where(lambda ax: ax.name == Batch.name, leaf_data.axes)
@@ -403,6 +470,9 @@ class DataLoaderIterator(Iterator[Ex]):
             make_global_array_for_leaf(leaf_index, _batchified_shape(Batch, item_leaf))
             for leaf_index, item_leaf in enumerate(self.dl._ex_leaves)
         ]
+        if self._host_buffers is not None:
+            assert slot is not None
+            self._host_buffers.finish_batch(slot, jax.tree.leaves(gda_leaves))
         gda_tree = jax.tree.unflatten(self.dl._ex_structure, gda_leaves)
         return gda_tree
 
@@ -430,16 +500,20 @@ class DataLoaderIterator(Iterator[Ex]):
 
                     distinct_local_indices_this_batch.add(local_index)
 
-            global_indices_for_this_batch = [global_offset + i for i in distinct_local_indices_this_batch]
+            # sorted so that datasets that build whole batches at once (e.g. CausalLmDataset) give us contiguous rows
+            global_indices_for_this_batch = [global_offset + i for i in sorted(distinct_local_indices_this_batch)]
             global_indices_for_each_batch.append(global_indices_for_this_batch)
 
         # flattened view so we can load all the data at once
         indices_for_this_batch_of_batches: list[int] = [
             i for indices in global_indices_for_each_batch for i in indices
         ]
+        if self._item_slice is not None:
+            retrieval = self.dl.data_store.get_batch_slices(indices_for_this_batch_of_batches, self._item_slice)
+        else:
+            retrieval = self.dl.data_store.get_batch(indices_for_this_batch_of_batches)
         individual_datums = await self.run_and_report_slowness(
-            self.dl.data_store.get_batch(indices_for_this_batch_of_batches),
-            f"Waiting for {len(indices_for_this_batch_of_batches)} items.",
+            retrieval, f"Waiting for {len(indices_for_this_batch_of_batches)} items."
         )
 
         # unflatten
@@ -459,12 +533,50 @@ class DataLoaderIterator(Iterator[Ex]):
 
         return out
 
+    def _compute_local_item_slice(self) -> slice | None:
+        """
+        Returns the part of the first axis of every example leaf that our local devices need, or None if they need
+        all of it (or if the leaves don't share a first axis we could slice).
+        """
+        item_lengths = set()
+        for leaf in self.dl._ex_leaves:
+            shape = leaf.array.shape if is_named_array(leaf) else getattr(leaf, "shape", ())
+            if len(shape) == 0:
+                return None
+            item_lengths.add(shape[0])
+
+        if len(item_lengths) != 1:
+            return None
+        (item_len,) = item_lengths
+        self._item_len = item_len
+
+        # the slices along the item axes don't depend on the batch size, so any valid batch size will do
+        Batch = hax.Axis(self.dl.batch_axis_name, self.dl._data_axis_size)
+        device_indices: list[tuple[slice, ...] | None] = []
+        for leaf in self.dl._ex_leaves:
+            shape_spec = _batchified_shape(Batch, leaf)
+            raw_shape = to_raw_shape(shape_spec)
+            assert raw_shape is not None
+            sharding = jax.sharding.NamedSharding(self.dl.mesh, self._pspec_for(shape_spec))
+            device_indices.extend(sharding.addressable_devices_indices_map(raw_shape).values())
+
+        return _union_of_item_slices(device_indices, item_len)
+
+    def _shift_into_item_slice(self, index: slice) -> slice:
+        assert self._item_slice is not None
+        start, stop, step = index.indices(self._item_len)
+        offset = self._item_slice.start
+        if start < offset or stop > self._item_slice.stop:
+            raise ValueError(f"Requested {index} but only loaded {self._item_slice} of each example")
+        return slice(start - offset, stop - offset, step)
+
     def _pspec_for(self, shape_spec: ShapeSpec | NamedShapeSpec) -> PartitionSpec:
         if isinstance(shape_spec, ShapeSpec):  # type: ignore
-            batch_name = hax.partitioning.physical_axis_name(self.dl.batch_axis_name, self.dl.axis_resources)
+            # nb: we use self.mapping rather than the thread-local mapping because this runs in a background thread
+            batch_name = hax.partitioning.physical_axis_name(self.dl.batch_axis_name, self.mapping)
             return PartitionSpec(batch_name, *((None,) * (len(shape_spec.shape) - 1)))
         else:
-            return hax.partitioning.pspec_for_axis(shape_spec.shape, self.dl.axis_resources)  # type: ignore
+            return hax.partitioning.pspec_for_axis(shape_spec.shape, self.mapping)  # type: ignore
 
     async def run_and_report_slowness(self, coro, description: str):
         threshold = 10.0
@@ -523,6 +635,29 @@ def stack_batches(example_iterator, Pos, Batch):
             yield stack_tree(Batch, batch)
 
 
+def _union_of_item_slices(device_indices: Iterable, item_len: int) -> slice | None:
+    """
+    Given the index of each local device into a batched leaf, returns the smallest slice of the item axis (dimension 1)
+    that covers all of them, or None if that's the whole axis.
+    """
+    start, stop = item_len, 0
+    for index in device_indices:
+        if index is None:
+            continue
+        if len(index) < 2:
+            return None
+        this_start, this_stop, step = index[1].indices(item_len)
+        if step != 1:
+            return None
+        start = min(start, this_start)
+        stop = max(stop, this_stop)
+
+    if start >= stop or (start == 0 and stop == item_len):
+        return None
+
+    return slice(start, stop)
+
+
 def _batchified_shape(Batch, leaf: hax.NamedArray | Array) -> ShapeSpec | NamedShapeSpec:
     if is_named_array(leaf):
         return NamedShapeSpec((Batch,) + leaf.axes, leaf.dtype)
@@ -543,6 +678,44 @@ class _JaxCpuBackgroundIterator(BackgroundIterator[Ex]):
             super()._fill_queue_with_batches()
 
 
+class _ByteBudget:
+    """
+    Bounds the number of bytes of examples that have been retrieved but not yet sent to devices. acquire blocks until
+    there's room, but always lets at least one batch through so that batches bigger than the budget can't deadlock.
+    """
+
+    def __init__(self, max_bytes: int | None):
+        self.max_bytes = max_bytes
+        self._used = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes: int) -> bool:
+        """Returns False if the budget was closed while waiting."""
+        with self._cond:
+            while (
+                not self._closed
+                and self.max_bytes is not None
+                and self._used > 0
+                and self._used + nbytes > self.max_bytes
+            ):
+                self._cond.wait()
+            if self._closed:
+                return False
+            self._used += nbytes
+            return True
+
+    def release(self, nbytes: int):
+        with self._cond:
+            self._used -= nbytes
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
 # @equinox.filter_jit
 @functools.partial(jax.jit, static_argnums=(0,))
 def stack_tree(batch_name, individual_datums):
@@ -555,6 +728,120 @@ def stack_tree(batch_name, individual_datums):
     return jax.tree.map(_stack_leaves_unchecked, *individual_datums, is_leaf=is_named_array)
 
 
+def _stack_local_data(
+    batch_name: str,
+    individual_datums: list,
+    out_buffer: Callable[[int, tuple[int, ...], np.dtype], np.ndarray] | None = None,
+):
+    """
+    Stacks examples into a batch. If every leaf is a NumPy array (as produced by most of our datasets), we stack on
+    the host with NumPy (reusing the underlying buffer if the examples are already consecutive rows of one array).
+    Otherwise, we fall back to the jitted [stack_tree][].
+
+    If given, out_buffer(leaf_index, shape, dtype) returns a preallocated array to stack each leaf into.
+    """
+    if not all(isinstance(leaf, np.ndarray) for leaf in jax.tree.leaves(individual_datums[0])):
+        return stack_tree(batch_name, individual_datums)
+
+    leaf_indices = itertools.count()
+
+    def _stack_into_buffer(arrays):
+        leaf_index = next(leaf_indices)
+        out = None
+        if out_buffer is not None and isinstance(arrays[0], np.ndarray):
+            out = out_buffer(leaf_index, (len(arrays),) + arrays[0].shape, arrays[0].dtype)
+        return _stack_numpy(arrays, out=out)
+
+    def _stack_leaves(*leaves):
+        if is_named_array(leaves[0]):
+            Batch = hax.Axis(batch_name, len(leaves))
+            return hax.NamedArray(_stack_into_buffer([leaf.array for leaf in leaves]), (Batch,) + leaves[0].axes)
+        else:
+            return _stack_into_buffer(leaves)
+
+    try:
+        return jax.tree.map(_stack_leaves, *individual_datums, is_leaf=is_named_array)
+    except TypeError:
+        # not all leaves were numpy arrays after all
+        return stack_tree(batch_name, individual_datums)
+
+
+def _stack_numpy(arrays: Sequence, out: np.ndarray | None = None) -> np.ndarray:
+    """
+    np.stack, except that if `arrays` are consecutive rows of a single array, we return a view of that array.
+    Otherwise, we stack into `out` if it's given.
+    """
+    first = arrays[0]
+    if not isinstance(first, np.ndarray):
+        raise TypeError(f"Expected a numpy array, got {type(first)}")
+
+    base = first.base
+    if isinstance(base, np.ndarray) and base.ndim == first.ndim + 1 and base.shape[1:] == first.shape:
+        row_stride = base.strides[0]
+        base_address = base.__array_interface__["data"][0]
+        first_address = first.__array_interface__["data"][0]
+        if row_stride > 0 and (first_address - base_address) % row_stride == 0:
+            start = (first_address - base_address) // row_stride
+            candidate = base[start : start + len(arrays)]
+            if len(candidate) == len(arrays) and all(
+                isinstance(a, np.ndarray)
+                and a.base is base
+                and a.__array_interface__["data"][0] == row.__array_interface__["data"][0]
+                for a, row in zip(arrays, candidate)
+            ):
+                return candidate
+
+    if not all(isinstance(a, np.ndarray) for a in arrays):
+        raise TypeError("Expected numpy arrays")
+    if out is not None:
+        return np.stack(arrays, out=out)
+    return np.stack(arrays)
+
+
+class _HostBufferRing:
+    """
+    A ring of preallocated host buffers to stack batches into, so that we don't allocate fresh host memory for every
+    leaf of every batch. Each slot holds one buffer per (slice of the batch, leaf). Before a slot is reused, we wait
+    for the device arrays made from its buffers, so that nothing is still reading them.
+    """
+
+    def __init__(self, num_slots: int):
+        self._buffers: list[dict[tuple, np.ndarray]] = [{} for _ in range(num_slots)]
+        self._in_use: list[list[Array]] = [[] for _ in range(num_slots)]
+        self._used_keys: list[set[tuple]] = [set() for _ in range(num_slots)]
+        self._next_slot = 0
+
+    def start_batch(self) -> int:
+        slot = self._next_slot
+        self._next_slot = (slot + 1) % len(self._buffers)
+        jax.block_until_ready(self._in_use[slot])
+        self._in_use[slot] = []
+        self._used_keys[slot] = set()
+        return slot
+
+    def buffer(self, slot: int, key: tuple, leaf_index: int, shape: tuple[int, ...], dtype) -> np.ndarray:
+        full_key = (*key, leaf_index)
+        buffers = self._buffers[slot]
+        buffer = buffers.get(full_key)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            buffers[full_key] = buffer
+        self._used_keys[slot].add(full_key)
+        return buffer
+
+    def finish_batch(self, slot: int, arrays: Sequence[Array]):
+        self._in_use[slot] = list(arrays)
+        # drop buffers for shapes we no longer use (e.g. after the batch size changes)
+        for key in list(self._buffers[slot]):
+            if key not in self._used_keys[slot]:
+                del self._buffers[slot][key]
+
+
+def _can_reuse_host_buffers(mesh: Mesh) -> bool:
+    # On CPU, arrays may alias the host buffers they're made from, so we can't overwrite those buffers.
+    return all(device.platform != "cpu" for device in mesh.devices.flat)
+
+
 def check_sharded_consistency(tree: PyTree, check_disjoint_indices_are_different: bool = False):
     """Checks the following consistency conditions on an array:
     - all replicas have the same data
@@ -618,6 +905,9 @@ def check_sharded_consistency(tree: PyTree, check_disjoint_indices_are_different
 
 
 def _make_padding_example(ex: Ex) -> Ex:
+    if all(isinstance(leaf, np.ndarray) for leaf in jax.tree.leaves(ex)):
+        # keep host-side examples on the host
+        return jax.tree.map(np.zeros_like, ex)
     with local_cpu_mesh():
         return tree_zeros_like(ex)
 
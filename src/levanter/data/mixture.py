@@ -1,6 +1,7 @@
 import asyncio
+import functools
 import warnings
-from typing import List, Mapping, Optional, Sequence, Tuple, TypeVar
+from typing import Awaitable, Callable, List, Mapping, Optional, Sequence, Tuple, TypeVar
 
 import jax
 import numpy as np
@@ -11,6 +12,7 @@ from jaxtyping import PRNGKeyArray
 from haliax.util import StringHolderEnum
 
 from levanter.data import AsyncDataset
+from levanter.data._prp import PermType, Permutation
 from levanter.schedule import BatchSchedule
 from levanter.utils.index import Index
 from levanter.utils.thread_utils import future_from_value
@@ -34,6 +36,10 @@ class MixtureDataset(AsyncDataset[T]):
     dataset. To solve this, we instead use "block-deterministic" mixtures, where the number of samples from each dataset
     in each block is always identical (and we shuffle the order of the dataset ids in each block). To handle the case where the dataset mixture changes over time, we use a list of stages and precompute statistics to accurately compute the index of each dataset in each block.
 
+    Within a stage, the unpermuted block is each dataset's examples in order: dataset i occupies positions
+    [block_starts[i], block_starts[i+1]). A block's shuffle maps each position in the block to a position in the
+    unpermuted block, so there's no limit on the block size or number of datasets.
+
     Args:
         datasets: A dict of datasets, where the key is the name of the dataset and the value is the dataset itself
         weights: Weights for each dataset. This can be provided in a list of stages, where each stage is a tuple of (start_seq_index, weights). Note that start_seq_index corresponds to the sequence index at which the weights should change, not the training batch index.
@@ -42,6 +48,10 @@ class MixtureDataset(AsyncDataset[T]):
             - ALL_STOP_STRATEGY: stop when all datasets have been exhausted
             - RESTART_STRATEGY: restart the dataset when it has been exhausted
         key: random key for datasets sampling
+        block_permutation_type: how to shuffle each block. None (the default) uses jax.random.permutation, which
+            materializes each block's permutation. "feistel" or "linear" use a stateless pseudo-random permutation
+            (see [[Permutation]]) that is evaluated only at the positions we need, which is much cheaper for large
+            blocks. Changing this changes the order of the mixture.
     """
 
     def __init__(
@@ -53,6 +63,7 @@ class MixtureDataset(AsyncDataset[T]):
         randomize_blocks: bool = True,
         key: PRNGKeyArray | int,
         stop_strategy: str = StopStrategy.RESTART_STRATEGY,
+        block_permutation_type: Optional[PermType] = None,
     ):
         super().__init__()
         if isinstance(weights, dict):
@@ -84,11 +95,13 @@ class MixtureDataset(AsyncDataset[T]):
         }
         self.dataset_index = Index(self.datasets.keys())
         self.block_size = block_size
-        # we pack index and ds id into a single 32 bit, so block size must be at most 2^16
-        if block_size >= 2**16:
-            raise ValueError(f"Block size must be at most 2^16, got {block_size}")
+        if block_size <= 0:
+            raise ValueError(f"Block size must be positive, got {block_size}")
 
         self.randomize_blocks = randomize_blocks
+        self.block_permutation_type = block_permutation_type
+        # per instance, so the cache doesn't keep the dataset alive
+        self._block_permutation = functools.lru_cache(maxsize=128)(self._make_block_permutation)
 
         if isinstance(key, int):
             key = PRNGKey(key)
@@ -104,24 +117,33 @@ class MixtureDataset(AsyncDataset[T]):
 
         self.stop_strategy = stop_strategy
 
-        # Initialize stage-related counts and IDs
-        (
-            self._counts_per_block_per_stage,
-            self._counts_after_stage,
-            self._unpermuted_ids_per_stage,
-        ) = self._initialize_stage_counts()
+        # Initialize stage-related counts
+        self._counts_per_block_per_stage, self._counts_after_stage = self._initialize_stage_counts()
+
+        # tables so that we can map whole batches of positions to datasets at once. All are [num_stages, num_datasets]
+        self._stage_starts = np.array([start for start, _ in self.weight_stages], dtype=np.int64)
+        self._counts_per_block_table = np.stack(self._counts_per_block_per_stage).astype(np.int64)
+        # number of examples drawn from each dataset before the start of each stage
+        self._base_offsets_table = np.stack(
+            [np.zeros(len(self.datasets), dtype=np.int64), *self._counts_after_stage]
+        ).astype(np.int64)
+        # where each dataset starts in the unpermuted block
+        self._block_starts_table = np.cumsum(self._counts_per_block_table, axis=1) - self._counts_per_block_table
+        # the same, but with stage s shifted by s * block_size so that one searchsorted handles every stage
+        num_stages = len(self.weight_stages)
+        self._flat_block_starts = (
+            self._block_starts_table + np.arange(num_stages, dtype=np.int64)[:, None] * block_size
+        ).ravel()
 
     def _initialize_stage_counts(self):
         counts_per_block_per_stage = []
         counts_after_stage = []
-        unpermuted_ids_per_stage = []
 
-        cumulative_counts = np.zeros(len(self.datasets), dtype=np.int32)
+        cumulative_counts = np.zeros(len(self.datasets), dtype=np.int64)
 
         for stage_idx, (start_seq_index, stage_weights) in enumerate(self.weight_stages):
             counts_this_stage = self._compute_expected_counts_per_block(stage_weights, self.block_size)
             counts_per_block_per_stage.append(counts_this_stage)
-            unpermuted_ids_per_stage.append(self._compute_unpermuted_ids(counts_this_stage))
 
             if stage_idx < len(self.weight_stages) - 1:
                 next_start = self.weight_stages[stage_idx + 1][0]
@@ -130,10 +152,10 @@ class MixtureDataset(AsyncDataset[T]):
                 cumulative_counts += stage_total_counts
                 counts_after_stage.append(cumulative_counts.copy())
 
-        return counts_per_block_per_stage, counts_after_stage, unpermuted_ids_per_stage
+        return counts_per_block_per_stage, counts_after_stage
 
     def _compute_expected_counts_per_block(self, weights: dict[str, float], block_size: int):
-        _expected_values_per_block = np.zeros(len(self.datasets), dtype=np.int32)
+        _expected_values_per_block = np.zeros(len(self.datasets), dtype=np.int64)
         for i, dsname in enumerate(self.dataset_index):
             _expected_values_per_block[i] = weights.get(dsname, 0) * block_size
 
@@ -151,15 +173,6 @@ class MixtureDataset(AsyncDataset[T]):
 
         return _expected_values_per_block
 
-    def _compute_unpermuted_ids(self, counts_per_block):
-        unpermuted_ids = np.zeros(int(counts_per_block.sum()), dtype=np.int64)
-        start = 0
-        for i, dsname in enumerate(self.dataset_index):
-            count = counts_per_block[i]
-            unpermuted_ids[start : start + count] = (i << 16) + np.arange(count)
-            start += count
-        return unpermuted_ids
-
     @staticmethod
     def _normalize_weights(weights: dict[str, float]) -> dict[str, float]:
         """Normalize the weights to sum to 1"""
@@ -201,70 +214,118 @@ class MixtureDataset(AsyncDataset[T]):
         raise NotImplementedError("Length is not known for other strategies")
 
     def _get_stage_for_block(self, block_id: int) -> int:
-        block_start = block_id * self.block_size
-        stage_starts = np.array([start for start, _ in self.weight_stages])
-        return max(0, np.searchsorted(stage_starts, block_start, side="right") - 1)
+        return int(self._get_stages_for_blocks(np.array([block_id]))[0])
+
+    def _get_stages_for_blocks(self, block_ids: np.ndarray) -> np.ndarray:
+        block_starts = block_ids * self.block_size
+        return np.maximum(0, np.searchsorted(self._stage_starts, block_starts, side="right") - 1)
 
     @alru_cache(maxsize=32)
-    async def _get_block(self, index: int) -> Optional[np.ndarray]:
-        stage = self._get_stage_for_block(index)
+    async def _get_block(self, index: int) -> np.ndarray:
+        """
+        Returns the block's permutation: for each position in the block, the position in the unpermuted block
+        """
+        positions = np.arange(self.block_size, dtype=np.int64)
         if not self.randomize_blocks:
-            return self._unpermuted_ids_per_stage[stage]
+            return positions
+        elif self.block_permutation_type is None:
+            return np.array(_compute_block_assignment(positions, index, self.key))
+        else:
+            return self._block_permutation(index)(positions).astype(np.int64)
+
+    def _make_block_permutation(self, index: int) -> Permutation:
+        assert self.block_permutation_type is not None
+        return Permutation.make(self.block_permutation_type, self.block_size, jax.random.fold_in(self.key, index))
 
-        return np.array(_compute_block_assignment(self._unpermuted_ids_per_stage[stage], index, self.key))
+    async def _unpermuted_positions(self, block_id: int, positions: np.ndarray) -> np.ndarray:
+        """Maps positions in the block to positions in the unpermuted block. See [[_get_block]]"""
+        if self.randomize_blocks and self.block_permutation_type is not None:
+            # no need to materialize the whole block
+            return self._block_permutation(block_id)(positions).astype(np.int64)
+
+        return (await self._get_block(block_id))[positions]
 
     def _index_into_dataset_for_id(self, id: int, block_id: int) -> tuple[int, int]:
-        stage = self._get_stage_for_block(block_id)
-        dataset_id = id >> 16
-        dataset_index = id & 0xFFFF
+        dataset_ids, dataset_indices = self._index_into_datasets_for_ids(np.array([id]), np.array([block_id]))
+        return int(dataset_ids[0]), int(dataset_indices[0])
+
+    def _index_into_datasets_for_ids(self, ids: np.ndarray, block_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Maps positions in unpermuted blocks (see [[_get_block]]) to (dataset_id, index into that dataset).
+        """
+        stages = self._get_stages_for_blocks(block_ids)
+        stage_offsets = stages * self.block_size
+        dataset_ids = np.searchsorted(self._flat_block_starts, ids + stage_offsets, side="right") - 1
+        dataset_ids -= stages * len(self.datasets)
+        dataset_indices = ids - self._block_starts_table[stages, dataset_ids]
 
         # Get the base offset from previous stages
-        base_offset = self._counts_after_stage[stage - 1][dataset_id] if stage > 0 else 0
+        base_offsets = self._base_offsets_table[stages, dataset_ids]
         # Add offset within current stage
-        offset_in_stage = (block_id * self.block_size - self.weight_stages[stage][0]) // self.block_size
-        current_stage_offset = offset_in_stage * self._counts_per_block_per_stage[stage][dataset_id]
+        blocks_into_stage = (block_ids * self.block_size - self._stage_starts[stages]) // self.block_size
+        current_stage_offsets = blocks_into_stage * self._counts_per_block_table[stages, dataset_ids]
 
-        return dataset_id, dataset_index + base_offset + current_stage_offset
+        return dataset_ids, dataset_indices + base_offsets + current_stage_offsets
 
     async def get_batch(self, indices: Sequence[int]) -> Sequence[T]:
-        block_ids = np.array([idx // self.block_size for idx in indices])
-
-        blocks = [self._get_block(block_id) for block_id in block_ids]
-        blocks = await asyncio.gather(*blocks)
-
-        # split the indices into batches for each dataset
-        batches_per_dataset: list[list[int]] = [[] for _ in range(len(self.datasets))]
-        indices_in_final_batch: list[list[int]] = [[] for _ in range(len(self.datasets))]
-
-        assert len(indices) == len(blocks) == len(block_ids)
-
-        for batch_index, (idx, block, block_id) in enumerate(zip(indices, blocks, block_ids)):
-            index_within_block = idx % self.block_size  # which element of the block to get
-            id = block[index_within_block]  # for this block, which dataset+base dataset offset
-            dataset_id, dataset_index = self._index_into_dataset_for_id(id, block_id)
-            batches_per_dataset[dataset_id].append(dataset_index)
-            indices_in_final_batch[dataset_id].append(batch_index)
+        return await self._get_batch(indices, lambda dataset, ds_indices: dataset.get_batch(ds_indices))
+
+    async def get_batch_slices(self, indices: Sequence[int], item_slice: slice) -> Sequence[T]:
+        return await self._get_batch(
+            indices, lambda dataset, ds_indices: dataset.get_batch_slices(ds_indices, item_slice)
+        )
+
+    async def _get_batch(
+        self, indices: Sequence[int], fetch: Callable[[AsyncDataset[T], list[int]], Awaitable[Sequence[T]]]
+    ) -> Sequence[T]:
+        """Maps `indices` to indices into each dataset and gets them with `fetch(dataset, indices_into_dataset)`."""
+        index_array = np.asarray(indices, dtype=np.int64)
+        if len(index_array) == 0:
+            return []
+
+        block_ids = index_array // self.block_size
+        unique_block_ids, block_of_index = np.unique(block_ids, return_inverse=True)
+
+        # for each index, its position in the unpermuted block, which tells us the dataset and offset into it
+        index_within_block: np.ndarray = index_array % self.block_size
+        masks = [block_of_index == i for i in range(len(unique_block_ids))]
+        unpermuted = await asyncio.gather(
+            *(
+                self._unpermuted_positions(int(block_id), index_within_block[mask])
+                for block_id, mask in zip(unique_block_ids, masks)
+            )
+        )
+        ids = np.empty(len(index_array), dtype=np.int64)
+        for mask, block_positions in zip(masks, unpermuted):
+            ids[mask] = block_positions
+
+        dataset_ids, dataset_indices = self._index_into_datasets_for_ids(ids, block_ids)
+
+        # split the indices into batches for each dataset. positions_by_dataset[i] are the positions in the final
+        # batch of the examples from dataset i
+        order = np.argsort(dataset_ids, kind="stable")
+        dataset_bounds = np.cumsum(np.bincount(dataset_ids, minlength=len(self.datasets)))
+        positions_by_dataset = np.split(order, dataset_bounds[:-1])
 
         # get the batches from each dataset
         batch_futures = []
-        for dataset_id, indices_for_dataset in enumerate(batches_per_dataset):
-            if len(indices_for_dataset) == 0:
+        for dataset_id, positions in enumerate(positions_by_dataset):
+            if len(positions) == 0:
                 batch_futures.append(future_from_value([]))
             else:
                 dataset = self._dataset_of_id(dataset_id)
-                indices_for_dataset = await self._remap_indices(dataset, indices_for_dataset)
-                batch_futures.append(dataset.get_batch(indices_for_dataset))
+                indices_for_dataset = await self._remap_indices(dataset, dataset_indices[positions].tolist())
+                batch_futures.append(fetch(dataset, indices_for_dataset))
 
         batches = await asyncio.gather(*batch_futures)
 
         # reassemble the final batch
-        final_batch = [None] * len(indices)
+        final_batch = [None] * len(index_array)
 
-        for dataset_id, indices_into_batch in enumerate(indices_in_final_batch):
-            for i, idx in enumerate(indices_into_batch):
-                assert final_batch[idx] is None
-                assert len(final_batch) > idx
-                final_batch[idx] = batches[dataset_id][i]
+        for positions, batch in zip(positions_by_dataset, batches):
+            assert len(positions) == len(batch)
+            for position, item in zip(positions.tolist(), batch):
+                final_batch[position] = item
 
         return final_batch  # type: ignore
 
@@ -272,8 +333,8 @@ class MixtureDataset(AsyncDataset[T]):
         # simpler implementation because there's only one
         block_id = index // self.block_size
         index = index % self.block_size
-        permuted_ids = await self._get_block(block_id)
-        dataset_id, dataset_index = self._index_into_dataset_for_id(permuted_ids[index], block_id)
+        position = (await self._unpermuted_positions(block_id, np.array([index])))[0]
+        dataset_id, dataset_index = self._index_into_dataset_for_id(position, block_id)
 
         dataset = self._dataset_of_id(dataset_id)
         dataset_index = (await self._remap_indices(dataset, [dataset_index]))[0]
@@ -286,9 +347,9 @@ class MixtureDataset(AsyncDataset[T]):
         """
         if self.stop_strategy == StopStrategy.RESTART_STRATEGY:
             if ds.is_finite():
-                max_elem = max(indices_into_ds)
-                length_of_dataset = await ds.wait_until_len_at_least(max_elem + 1)
-                indices_into_ds = [idx % length_of_dataset for idx in indices_into_ds]
+                indices_array = np.asarray(indices_into_ds)
+                length_of_dataset = await ds.wait_until_len_at_least(int(indices_array.max()) + 1)
+                indices_into_ds = (indices_array % length_of_dataset).tolist()
 
             return indices_into_ds
 
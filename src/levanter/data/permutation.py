@@ -1,6 +1,9 @@
+import asyncio
+import functools
 from typing import Optional, Sequence
 
 import jax.random
+import numpy as np
 from async_lru import alru_cache
 
 from levanter.data import AsyncDataset
@@ -41,10 +44,14 @@ class PermutationDataset(AsyncDataset[T_co]):
         return await self.dataset.getitem_async(permutation(index))
 
     async def get_batch(self, indices: Sequence[int]) -> Sequence[T_co]:
+        return await self.dataset.get_batch(await self._permuted_indices(indices))
+
+    async def get_batch_slices(self, indices: Sequence[int], item_slice: slice) -> Sequence[T_co]:
+        return await self.dataset.get_batch_slices(await self._permuted_indices(indices), item_slice)
+
+    async def _permuted_indices(self, indices: Sequence[int]) -> list[int]:
         permutation = await self._get_permutation()
-        return await self.dataset.get_batch(
-            [int(permutation(i)) for i in indices]
-        )  # cast to int to be sure it's python int
+        return [int(permutation(i)) for i in indices]  # cast to int to be sure it's python int
 
     async def _get_permutation(self):
         if self._permutation is None:
@@ -95,6 +102,7 @@ class EraShufflingDataset(AsyncDataset[T_co]):
             return Permutation.make(self._perm_type, era_length_val, mix_key)
 
         self.gen_era_permutation = gen_era_permutation
+        self._prefetch_tasks: set[asyncio.Task] = set()
 
     async def _get_index(self, idx: int) -> int:
         if idx < 0:
@@ -132,7 +140,45 @@ class EraShufflingDataset(AsyncDataset[T_co]):
         return await self.dataset.getitem_async(await self._get_index(index))
 
     async def get_batch(self, indices: Sequence[int]) -> Sequence[T_co]:
-        return await self.dataset.get_batch([await self._get_index(i) for i in indices])
+        return await self.dataset.get_batch((await self._get_indices(np.asarray(indices, dtype=np.int64))).tolist())
+
+    async def get_batch_slices(self, indices: Sequence[int], item_slice: slice) -> Sequence[T_co]:
+        inner_indices = await self._get_indices(np.asarray(indices, dtype=np.int64))
+        return await self.dataset.get_batch_slices(inner_indices.tolist(), item_slice)
+
+    async def _get_indices(self, indices: np.ndarray) -> np.ndarray:
+        """Like [[_get_index]], but evaluates each era's permutation once on all of the batch's indices in it."""
+        if np.any(indices < 0):
+            raise ValueError("Negative indices are not supported")
+
+        eras = indices // self.era_length
+        unique_eras = np.unique(eras)
+        permutations = await asyncio.gather(*(self.gen_era_permutation(int(era)) for era in unique_eras))
+
+        out = np.empty(len(indices), dtype=np.int64)
+        for era, permutation in zip(unique_eras, permutations):
+            in_era = eras == era
+            era_start = era * self.era_length
+            out[in_era] = np.asarray(permutation(indices[in_era] - era_start), dtype=np.int64) + era_start
+
+        if len(unique_eras) > 0:
+            await self._prefetch_era(int(unique_eras[-1]) + 1)
+
+        return out
+
+    async def _prefetch_era(self, era: int):
+        """Starts making an era's permutation in the background, if we already know the era's length."""
+        inner_current_len = await self.dataset.current_len()
+        if inner_current_len is None or inner_current_len <= era * self.era_length:
+            return
+        if inner_current_len < (era + 1) * self.era_length and not await self.dataset.final_length_is_known():
+            # the era is still filling up, so making its permutation would have to wait
+            return
+
+        task = asyncio.create_task(self.gen_era_permutation(era))
+        # hold a reference so the task isn't garbage collected before it finishes
+        self._prefetch_tasks.add(task)
+        task.add_done_callback(self._prefetch_tasks.discard)
 
     def __repr__(self):
         return f"EraShufflingDataset({repr(self.dataset)}, era_length={self.era_length})"
@@ -144,3 +190,120 @@ class EraShufflingDataset(AsyncDataset[T_co]):
         # wait until we hit the next era
         next_era_end = (length // self.era_length + 1) * self.era_length
         return await self.dataset.wait_until_len_at_least(next_era_end)
+
+
+class ChunkShufflingDataset(AsyncDataset[T_co]):
+    r"""
+    A dataset that shuffles at the granularity of storage chunks and then within a bounded window of chunks.
+
+    The dataset is split into chunks of `chunk_size` consecutive examples. The order of the chunks is permuted, the
+    permuted chunks are grouped into windows of `window_chunks` chunks, and the examples within each window are
+    permuted. So a batch of consecutive indices reads from at most a handful of windows' worth of chunks, rather than
+    scattering reads across the whole dataset like a [[PermutationDataset]] does. `chunk_size` should be a multiple
+    of the number of examples in one (read) chunk of the underlying store.
+
+    Like the other shuffles here, this is stateless: index i maps to the same example on every run, so resumes are easy.
+    The last chunk may be partial; it's always placed in the last window.
+    """
+
+    def __init__(
+        self,
+        dataset: AsyncDataset[T_co],
+        chunk_size: int,
+        window_chunks: int,
+        *,
+        key: jax.random.PRNGKey,
+        perm_type: PermType = "feistel",
+    ):
+        super().__init__()
+        if chunk_size <= 0:
+            raise ValueError(f"chunk_size must be positive, got {chunk_size}")
+        if window_chunks <= 0:
+            raise ValueError(f"window_chunks must be positive, got {window_chunks}")
+
+        self.dataset = dataset
+        self.chunk_size = chunk_size
+        self.window_chunks = window_chunks
+        self.key = key
+        self._perm_type = perm_type
+        self._chunk_key, self._window_key = jax.random.split(key)
+        self._length: Optional[int] = None
+        self._chunk_permutation: Optional[Permutation] = None
+        # per instance, so the cache doesn't keep the dataset alive. We're mostly going to be going sequentially
+        self._window_permutation = functools.lru_cache(maxsize=8)(self._make_window_permutation)
+
+    @property
+    def window_size(self) -> int:
+        return self.chunk_size * self.window_chunks
+
+    async def async_len(self) -> int:
+        return await self.dataset.async_len()
+
+    async def final_length_is_known(self) -> bool:
+        return await self.dataset.final_length_is_known()
+
+    def is_finite(self) -> bool:
+        return self.dataset.is_finite()
+
+    async def current_len(self) -> Optional[int]:
+        if await self.final_length_is_known():
+            return await self.async_len()
+        # like PermutationDataset, we need the whole length to permute the chunks
+        return None
+
+    async def getitem_async(self, index: int) -> T_co:
+        return await self.dataset.getitem_async(int((await self._get_indices(np.array([index])))[0]))
+
+    async def get_batch(self, indices: Sequence[int]) -> Sequence[T_co]:
+        return await self.dataset.get_batch((await self._get_indices(np.asarray(indices, dtype=np.int64))).tolist())
+
+    async def get_batch_slices(self, indices: Sequence[int], item_slice: slice) -> Sequence[T_co]:
+        inner_indices = await self._get_indices(np.asarray(indices, dtype=np.int64))
+        return await self.dataset.get_batch_slices(inner_indices.tolist(), item_slice)
+
+    async def _get_indices(self, indices: np.ndarray) -> np.ndarray:
+        if self._length is None:
+            length = await self.async_len()
+            num_full_chunks = length // self.chunk_size
+            if num_full_chunks > 0:
+                self._chunk_permutation = Permutation.make(self._perm_type, num_full_chunks, self._chunk_key)
+            self._length = length
+
+        if np.any(indices < 0) or np.any(indices >= self._length):
+            raise IndexError(f"Indices out of bounds for length {self._length}")
+
+        windows = indices // self.window_size
+        out = np.empty(len(indices), dtype=np.int64)
+        for window in np.unique(windows):
+            in_window = windows == window
+            positions = self._window_permutation(int(window))(indices[in_window] - window * self.window_size)
+            positions = np.asarray(positions, dtype=np.int64)
+            # every chunk but the partial last one is full, so a position's chunk is position // chunk_size
+            slots = window * self.window_chunks + positions // self.chunk_size
+            out[in_window] = self._chunk_ids(slots) * self.chunk_size + positions % self.chunk_size
+
+        return out
+
+    def _chunk_ids(self, slots: np.ndarray) -> np.ndarray:
+        """Maps slots in the permuted chunk order to chunk ids. The partial chunk, if any, stays last."""
+        assert self._length is not None
+        num_full_chunks = self._length // self.chunk_size
+        is_full = slots < num_full_chunks
+        chunk_ids = np.full(len(slots), num_full_chunks, dtype=np.int64)
+        if self._chunk_permutation is not None and np.any(is_full):
+            chunk_ids[is_full] = np.asarray(self._chunk_permutation(slots[is_full]), dtype=np.int64)
+        return chunk_ids
+
+    def _make_window_permutation(self, window: int) -> Permutation:
+        assert self._length is not None
+        window_len = min(self.window_size, self._length - window * self.window_size)
+        return Permutation.make(self._perm_type, window_len, jax.random.fold_in(self._window_key, window))
+
+    def __repr__(self):
+        return (
+            f"ChunkShufflingDataset({repr(self.dataset)}, chunk_size={self.chunk_size},"
+            f" window_chunks={self.window_chunks})"
+        )
+
+    def __str__(self):
+        return f"ChunkShufflingDataset({str(self.dataset)})"
@@ -22,6 +22,7 @@ from typing import (
 import datasets
 import fsspec
 import numpy as np
+import pyarrow as pa
 import pyarrow.parquet as pq
 
 from levanter.utils import fsspec_utils
@@ -71,6 +72,35 @@ class ShardedDataSource(Generic[T_co]):
     def open_shard_at_row(self, shard_name: str, row: int) -> Iterator[T_co]:
         raise NotImplementedError
 
+    def supports_byte_offsets(self, shard_name: str) -> bool:
+        """
+        Whether [open_shard_at_byte_offset][] can be used for this shard. Sources that can seek directly to a row
+        (e.g. uncompressed jsonl) override this, so that resuming a partially processed shard doesn't have to
+        re-read everything before it.
+        """
+        return False
+
+    def open_shard_at_byte_offset(self, shard_name: str, byte_offset: int) -> Iterator[tuple[T_co, int]]:
+        """
+        Opens a shard at a byte offset that was previously yielded by this method (or 0 for the start of the shard).
+        Yields each item together with the byte offset of the item after it.
+        """
+        raise NotImplementedError
+
+    def supports_record_batches(self, shard_name: str) -> bool:
+        """
+        Whether [open_shard_record_batches_at_row][] can be used for this shard. Columnar sources (e.g. parquet)
+        override this so that processors that support it can skip building a dict per row.
+        """
+        return False
+
+    def open_shard_record_batches_at_row(self, shard_name: str, row: int, batch_size: int) -> Iterator[pa.RecordBatch]:
+        """
+        Like [open_shard_at_row][], but yields pyarrow RecordBatches of (at most) `batch_size` rows whose rows are
+        the same dicts that open_shard_at_row would yield.
+        """
+        raise NotImplementedError
+
     def __iter__(self):
         """
         Iterate over all data in the dataset, in order.
@@ -282,6 +312,25 @@ class UrlDataSource(UrlBackedShardedDataSource[dict]):
         super().__init__(urls)
         self.columns = columns
 
+    def supports_byte_offsets(self, shard_name: str) -> bool:
+        url = self._shard_name_to_url_mapping[shard_name]
+        return _sniff_format_for_dataset(url) == ".jsonl" and _is_uncompressed(url)
+
+    def supports_record_batches(self, shard_name: str) -> bool:
+        return _sniff_format_for_dataset(self._shard_name_to_url_mapping[shard_name]) == ".parquet"
+
+    def open_shard_record_batches_at_row(self, shard_name: str, row: int, batch_size: int) -> Iterator[pa.RecordBatch]:
+        url = self._shard_name_to_url_mapping[shard_name]
+        return _iter_parquet_record_batches(url, row, batch_size, self.columns)
+
+    def open_shard_at_byte_offset(self, shard_name: str, byte_offset: int) -> Iterator[tuple[dict, int]]:
+        url = self._shard_name_to_url_mapping[shard_name]
+        for line, next_offset in _iter_lines_from_byte_offset(url, byte_offset):
+            obj = json.loads(line)
+            if self.columns:
+                obj = {col: obj[col] for col in self.columns}
+            yield obj, next_offset
+
     def open_shard_at_row(self, shard_name: str, row: int) -> Iterator[dict]:
         url = self._shard_name_to_url_mapping[shard_name]
         i = 0
@@ -461,6 +510,14 @@ class JsonlDataSource(UrlBackedShardedDataSource[dict]):
     def __init__(self, urls):
         super().__init__(urls)
 
+    def supports_byte_offsets(self, shard_name: str) -> bool:
+        return _is_uncompressed(self._shard_name_to_url_mapping[shard_name])
+
+    def open_shard_at_byte_offset(self, shard_name: str, byte_offset: int) -> Iterator[tuple[dict, int]]:
+        url = self._shard_name_to_url_mapping[shard_name]
+        for line, next_offset in _iter_lines_from_byte_offset(url, byte_offset):
+            yield json.loads(line), next_offset
+
     def open_shard_at_row(self, shard_name: str, row: int) -> Iterator[dict]:
         url = self._shard_name_to_url_mapping[shard_name]
         i = 0
@@ -473,6 +530,21 @@ class JsonlDataSource(UrlBackedShardedDataSource[dict]):
                 i += 1
 
 
+def _is_uncompressed(url: str) -> bool:
+    # compressed streams can't be seeked into without decompressing everything before the offset
+    return fsspec.utils.infer_compression(url) is None and not url.endswith(".zstd")
+
+
+def _iter_lines_from_byte_offset(url: str, byte_offset: int) -> Iterator[tuple[bytes, int]]:
+    """Yields the lines of an uncompressed file starting at `byte_offset`, along with the offset of the next line."""
+    with fsspec.open(url, "rb") as f:
+        f.seek(byte_offset)
+        offset = byte_offset
+        for line in f:
+            offset += len(line)
+            yield line, offset
+
+
 class JsonDataSource(UrlBackedShardedDataSource[dict]):
     def __init__(self, urls):
         super().__init__(urls)
@@ -494,6 +566,13 @@ class ParquetDataSource(UrlBackedShardedDataSource[dict]):
         super().__init__(urls)
         self.columns = columns
 
+    def supports_record_batches(self, shard_name: str) -> bool:
+        return True
+
+    def open_shard_record_batches_at_row(self, shard_name: str, row: int, batch_size: int) -> Iterator[pa.RecordBatch]:
+        url = self._shard_name_to_url_mapping[shard_name]
+        return _iter_parquet_record_batches(url, row, batch_size, self.columns)
+
     def open_shard_at_row(self, shard_name: str, row: int) -> Iterator[dict]:
         url = self._shard_name_to_url_mapping[shard_name]
         with fsspec.open(url, "rb", compression="infer") as f:
@@ -528,6 +607,34 @@ class ParquetDataSource(UrlBackedShardedDataSource[dict]):
                 yield from table.to_pylist()
 
 
+def _iter_parquet_record_batches(
+    url: str, row: int, batch_size: int, columns: Optional[Sequence[str]]
+) -> Iterator[pa.RecordBatch]:
+    with fsspec.open(url, "rb", compression="infer") as f:
+        parquet_file = pq.ParquetFile(f)
+        if row >= parquet_file.metadata.num_rows:
+            return
+
+        num_row_groups = parquet_file.metadata.num_row_groups
+        row_group_ends = np.cumsum([parquet_file.metadata.row_group(i).num_rows for i in range(num_row_groups)])
+
+        # skip whole row groups, then the rows before `row` in the first one we read
+        first_row_group = int(np.searchsorted(row_group_ends, row, side="right"))
+        to_skip = row - (int(row_group_ends[first_row_group - 1]) if first_row_group > 0 else 0)
+
+        for batch in parquet_file.iter_batches(
+            batch_size=batch_size, row_groups=range(first_row_group, num_row_groups), columns=columns
+        ):
+            if to_skip >= batch.num_rows:
+                to_skip -= batch.num_rows
+                continue
+            elif to_skip > 0:
+                batch = batch.slice(to_skip)
+                to_skip = 0
+
+            yield batch
+
+
 def _mk_shard_name_mapping(urls):
     _shard_name_to_url_mapping = {}
     # remove common prefix
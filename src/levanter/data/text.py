@@ -1,5 +1,4 @@
 import abc
-import asyncio
 import dataclasses
 import functools
 import json
@@ -31,8 +30,8 @@ import fsspec
 import jax
 import jax.numpy as jnp
 import numpy as np
+import pyarrow as pa
 import regex
-import tensorstore as ts
 from draccus import ChoiceRegistry, field
 from jaxtyping import PRNGKeyArray
 from tokenizers import normalizers
@@ -42,14 +41,15 @@ from haliax import Axis
 
 import levanter
 from levanter.data import AsyncDataset
-from levanter.data.dataset import EpochDataset, MappedAsyncDataset
+from levanter.data.dataset import BatchMappedAsyncDataset, EpochDataset, MappedAsyncDataset
 from levanter.data.mixture import MixtureDataset, StopStrategy, rescale_mixture_schedule_for_batch_schedule
-from levanter.data.packing import GreedyPrepackedDataset
+from levanter.data.packing import PACK_INDEX_DIR_NAME, GreedyPrepackedDataset
 from levanter.data.passthrough_tokenizer import PassthroughTokenizer
+from levanter.models.attention import AttentionMask
 from levanter.models.lm_model import LmExample
 from levanter.schedule import BatchSchedule
 from levanter.store.cache import CacheMetadata, CacheOptions, TreeCache
-from levanter.store.jagged_array import JaggedArrayStore
+from levanter.store.jagged_array import JaggedArrayStore, PreparedBatch, read_coalesced_ranges
 from levanter.store.tree_store import TreeStore
 from levanter.utils import fsspec_utils
 from levanter.utils.hf_utils import HfTokenizer, num_cpus_used_by_tokenizer
@@ -107,7 +107,7 @@ class TokenSeqDataset(AsyncDataset[np.ndarray]):
     async def async_len(self) -> int:
         await self.doc_cache.finished()
         token_arrays = await self._await_token_cache()
-        return token_arrays.data_size // self.seq_len
+        return await token_arrays.data_size_async() // self.seq_len
 
     async def _await_token_cache(self) -> JaggedArrayStore:
         if self._store is None:
@@ -122,22 +122,29 @@ class TokenSeqDataset(AsyncDataset[np.ndarray]):
 
     async def current_len(self) -> Optional[int]:
         store = await self._await_token_cache()
-        return store.data_size // self.seq_len
+        return await store.data_size_async() // self.seq_len
 
-    async def get_batch(self, indices: Sequence[int]) -> Sequence[T_co]:
+    async def get_batch(self, indices: Sequence[int]) -> Sequence[np.ndarray]:
         token_arrays = await self._await_token_cache()
         # logger.info(f"Time to get token cache: {time.time() - time_in}")
         ds_len = await self.wait_until_len_at_least(max(indices) + 1)
         if ds_len is not None and ds_len < max(indices) + 1:
             raise ValueError("Requested indices beyond the end of the dataset")
         offsets = np.array(indices, dtype=np.int64) * self.seq_len
-        with ts.Batch():
-            out = []
-            for offset in offsets:
-                out.append(token_arrays.data[offset : offset + self.seq_len].read())
+        return await read_coalesced_ranges(token_arrays.data, offsets, offsets + self.seq_len)
 
-        out = await asyncio.gather(*out)
-        return out
+    async def get_batch_slices(self, indices: Sequence[int], item_slice: slice) -> Sequence[np.ndarray]:
+        # only read the tokens we were asked for
+        start, stop, step = item_slice.indices(self.seq_len)
+        if step != 1:
+            return await super().get_batch_slices(indices, item_slice)
+
+        token_arrays = await self._await_token_cache()
+        ds_len = await self.wait_until_len_at_least(max(indices) + 1)
+        if ds_len is not None and ds_len < max(indices) + 1:
+            raise ValueError("Requested indices beyond the end of the dataset")
+        offsets = np.array(indices, dtype=np.int64) * self.seq_len
+        return await read_coalesced_ranges(token_arrays.data, offsets + start, offsets + max(start, stop))
 
     async def wait_until_len_at_least(self, length: int) -> int:
         # length is brutally slow to compute, so we cache it
@@ -150,7 +157,20 @@ class TokenSeqDataset(AsyncDataset[np.ndarray]):
         return length
 
 
-class CausalLmDataset(MappedAsyncDataset[np.ndarray, LmExample]):
+class CausalLmDataset(BatchMappedAsyncDataset[np.ndarray, LmExample]):
+    """
+    Turns a dataset of token sequences into causal [LmExample][]s.
+
+    Examples are built a whole batch at a time with NumPy (rather than one jitted call per example). The examples in a
+    batch are row views into shared stacked arrays, so the [DataLoader][] can usually hand them to devices without
+    restacking them.
+
+    `get_batch_slices` only reads the requested positions (plus one for the loss mask) when `eos_id` is None. With
+    `eos_id` set, the segment ids of a slice depend on how many eos tokens come before it, so it still reads every
+    position from the start of the sequence up to the slice. For sequence-sharded data, that means the last shard
+    reads whole sequences and hosts read about half of each sequence on average.
+    """
+
     def __init__(
         self,
         dataset: AsyncDataset[np.ndarray],
@@ -159,26 +179,91 @@ class CausalLmDataset(MappedAsyncDataset[np.ndarray, LmExample]):
         ignore_index: Optional[int] = None,
         eos_id: Optional[int] = None,
     ):
-        self.dataset = dataset
         self.Pos = Pos
         self.ignore_id = ignore_index
         self.eos_id = eos_id
 
-        sharding = jax.sharding.SingleDeviceSharding(jax.local_devices(backend="cpu")[0])
-
-        @functools.partial(eqx.filter_jit, out_shardings=sharding)
-        def _create_lm_example(tokens):
-            tokens = hax.named(tokens, self.Pos)
-            example = LmExample.causal(tokens=tokens, ignore_id=self.ignore_id, eos_id=eos_id)
+        super().__init__(dataset, self._create_lm_examples)
+
+    def _create_lm_examples(self, token_seqs: Sequence[np.ndarray]) -> list[LmExample]:
+        tokens = np.stack(token_seqs)
+        loss_mask, segment_ids = causal_lm_masks(tokens, ignore_id=self.ignore_id, eos_id=self.eos_id)
+        return self._to_lm_examples(self.Pos, tokens, loss_mask, segment_ids)
+
+    async def get_batch_slices(self, indices: Sequence[int], item_slice: slice) -> Sequence[LmExample]:
+        start, stop, step = item_slice.indices(self.Pos.size)
+        if step != 1 or start >= stop:
+            return await super().get_batch_slices(indices, item_slice)
+
+        # the loss mask at a position depends on the next token, and the segment ids depend on every eos before it,
+        # so we read a little more than we return. Counting those eos tokens needs the whole prefix (see the class
+        # docstring).
+        read_start = 0 if self.eos_id is not None else start
+        read_stop = min(stop + 1, self.Pos.size)
+        tokens = np.stack(await self.dataset.get_batch_slices(indices, slice(read_start, read_stop)))
+        # if we read past stop, the last position's loss mask is wrong, but we drop it
+        loss_mask, segment_ids = causal_lm_masks(tokens, ignore_id=self.ignore_id, eos_id=self.eos_id)
+
+        window = slice(start - read_start, stop - read_start)
+        return self._to_lm_examples(
+            self.Pos.resize(stop - start),
+            tokens[:, window],
+            loss_mask[:, window],
+            segment_ids[:, window] if segment_ids is not None else None,
+        )
 
-            return example
+    @staticmethod
+    def _to_lm_examples(
+        Pos: Axis, tokens: np.ndarray, loss_mask: np.ndarray, segment_ids: Optional[np.ndarray]
+    ) -> list[LmExample]:
+        out = []
+        for i in range(tokens.shape[0]):
+            attn_mask = AttentionMask.causal()
+            if segment_ids is not None:
+                attn_mask = attn_mask.with_segment_ids(hax.NamedArray(segment_ids[i], (Pos,)))
+            out.append(
+                LmExample(
+                    tokens=hax.NamedArray(tokens[i], (Pos,)),
+                    loss_mask=hax.NamedArray(loss_mask[i], (Pos,)),
+                    attn_mask=attn_mask,
+                )
+            )
 
-        super().__init__(self.dataset, _create_lm_example)
+        return out
 
     async def async_len(self) -> int:
         return await self.dataset.async_len()
 
 
+def causal_lm_masks(
+    tokens: np.ndarray, *, ignore_id: Optional[int] = None, eos_id: Optional[int] = None
+) -> tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    NumPy version of the masks computed by [LmExample.causal][] for a batch of token sequences of shape
+    (batch, pos).
+
+    Returns:
+        The loss mask (int32) and, if `eos_id` is set, the segment ids (int32), both of shape (batch, pos).
+    """
+    # we don't compute loss for the last token
+    loss_mask = np.ones(tokens.shape, dtype=np.int32)
+    loss_mask[:, -1] = 0
+
+    if ignore_id is not None:
+        # we don't compute loss for any tokens matching the ignore index
+        loss_mask[:, :-1] *= tokens[:, 1:] != ignore_id
+
+    if eos_id is None:
+        return loss_mask, None
+
+    # the next token after an eos token is in a new segment. The first token is always in segment 0
+    eos_mask = np.zeros(tokens.shape, dtype=np.int32)
+    eos_mask[:, 1:] = tokens[:, :-1] == eos_id
+    segment_ids = np.cumsum(eos_mask, axis=1, dtype=np.int32)
+
+    return loss_mask, segment_ids
+
+
 def _maybe_force_tokenizer_parallelism(tokenizer: PreTrainedTokenizerBase):
     if tokenizer.is_fast and os.getenv("TOKENIZERS_PARALLELISM") is None:
         # if we're using a fast tokenizer, we want to force parallelism
@@ -234,6 +319,7 @@ class BatchTokenizer(BatchProcessor[dict, dict]):
         if enforce_eos or enforce_bos:
             # Check if this is a PassthroughTokenizer to avoid the "hi there" test
             from levanter.data.passthrough_tokenizer import PassthroughTokenizer
+
             if isinstance(tokenizer, PassthroughTokenizer):
                 # PassthroughTokenizer doesn't need EOS/BOS handling since data is pre-tokenized
                 should_append_eos = False
@@ -252,7 +338,33 @@ class BatchTokenizer(BatchProcessor[dict, dict]):
 
     def __call__(self, batch: Sequence[dict]) -> list[dict]:
         batch_text = [example[self.text_field] for example in batch]
+        encoding = self._encode(batch_text)
+
+        # debatch the encoding
+        unbatched = [dict(zip(encoding, t)) for t in zip(*[encoding[k] for k in encoding])]
+
+        return unbatched
+
+    @property
+    def supports_record_batches(self) -> bool:
+        return True
+
+    def process_record_batch(self, batch: pa.RecordBatch) -> dict[str, PreparedBatch]:
+        """
+        Tokenizes the text column of a RecordBatch directly into flat token buffers, without building a dict per
+        document.
+        """
+        encoding = self._encode(batch.column(self.text_field).to_pylist())
+        return {
+            key: PreparedBatch.from_ragged_sequences(encoding[key], dtype)
+            for key, dtype in self._output_dtypes.items()
+        }
+
+    @cached_property
+    def _output_dtypes(self) -> dict[str, np.dtype]:
+        return {key: np.asarray(value).dtype for key, value in self.output_exemplar.items()}
 
+    def _encode(self, batch_text: list[str]):
         if self._need_to_add_bos:
             batch_text = [self.tokenizer.bos_token + " " + d for d in batch_text]
 
@@ -282,10 +394,7 @@ class BatchTokenizer(BatchProcessor[dict, dict]):
             new_encoding = self._merge_split_encodings(batch_text, encoding, needs_merge)
             encoding = BatchEncoding(new_encoding)
 
-        # debatch the encoding
-        unbatched = [dict(zip(encoding, t)) for t in zip(*[encoding[k] for k in encoding])]
-
-        return unbatched
+        return encoding
 
     def _break_for_long_sequences(self, batch):
         orig_lengths = [len(d) for d in batch]
@@ -330,6 +439,7 @@ class BatchTokenizer(BatchProcessor[dict, dict]):
     def output_exemplar(self) -> dict:
         # Handle PassthroughTokenizer which expects pre-tokenized data
         from levanter.data.passthrough_tokenizer import PassthroughTokenizer
+
         if isinstance(self.tokenizer, PassthroughTokenizer):
             # Use a sample of space-separated integers for PassthroughTokenizer
             return dict(**self.tokenizer("1 2 3 4 5", return_attention_mask=self.return_attention_mask, verbose=False))
@@ -512,11 +622,14 @@ class UrlDatasetSourceConfig(LmDatasetSourceConfigBase):
 
         # Check if any URLs are .txt files - if so, use TextUrlDataSource
         # which has built-in support for .txt files
-        has_txt_files = any(url.endswith('.txt') or url.endswith('.txt.gz') or url.endswith('.txt.bz2') for url in split_urls)
-        
+        has_txt_files = any(
+            url.endswith(".txt") or url.endswith(".txt.gz") or url.endswith(".txt.bz2") for url in split_urls
+        )
+
         if has_txt_files:
             # Use TextUrlDataSource for .txt files, which wraps each line in a dict with text_key
             from levanter.data.sharded_datasource import TextUrlDataSource
+
             text_source = TextUrlDataSource(split_urls, text_key="text")
             # TextUrlDataSource returns strings, but we need dicts, so we map each string to {"text": string}
             return text_source.map(lambda text_line: {"text": text_line.strip()})
@@ -563,6 +676,13 @@ class LMTaskConfig(abc.ABC):
 
     If None, defaults to linear, but this will change in the future since Feistel is better.
     """
+    shuffle_chunk_size: Optional[int] = None
+    """If set and shuffle is True, shuffle chunks of this many consecutive examples and then shuffle examples within
+    windows of `shuffle_window_chunks` chunks, instead of shuffling the whole dataset. This keeps each batch's reads
+    within a few storage chunks, which matters on remote object stores. Should be a multiple of the number of examples
+    in one chunk of the cache."""
+    shuffle_window_chunks: int = 64
+    """Number of chunks to shuffle together when `shuffle_chunk_size` is set."""
 
     @cached_property
     def the_tokenizer(self) -> HfTokenizer:
@@ -679,7 +799,7 @@ class SupervisedHfSourceConfig(SupervisedSourceConfigBase):
     cache_dir: str
     id: str
     name: str | None = None
-    # add plaintext option 
+    # add plaintext option
 
     streaming: bool = True
 
@@ -877,6 +997,7 @@ def mk_single_turn_cached_sft_dataset(
 
     # Skip the EOS test for PassthroughTokenizer since it expects pre-tokenized data
     from levanter.data.passthrough_tokenizer import PassthroughTokenizer
+
     if isinstance(tokenizer, PassthroughTokenizer):
         should_append_eos = False
     else:
@@ -986,6 +1107,7 @@ def mk_chat_sft_dataset(
 
     # Skip the EOS test for PassthroughTokenizer since it expects pre-tokenized data
     from levanter.data.passthrough_tokenizer import PassthroughTokenizer
+
     if isinstance(tokenizer, PassthroughTokenizer):
         should_append_eos = False
     else:
@@ -1043,7 +1165,9 @@ class SingleDatasetLMConfigBase(LmDatasetSourceConfigBase, LMTaskConfig):
             )
             perm_type = "linear"
 
-        if self.shuffle is True:
+        if self.shuffle is True and self.shuffle_chunk_size is not None:
+            ds = ds.chunk_shuffle(self.shuffle_chunk_size, self.shuffle_window_chunks, key, perm_type=perm_type)
+        elif self.shuffle is True:
             ds = ds.shuffle(key, perm_type=perm_type)
         elif isinstance(self.shuffle, int) and self.shuffle > 0:
             ds = ds.era_shuffle(self.shuffle, key=key, perm_type=perm_type)
@@ -1170,6 +1294,10 @@ class LMMixtureDatasetConfig(LMTaskConfig):
     """Block size for deterministic mixing. In each block, a given dataset will have exactly the same number
     of samples, equal to the expected number of samples in the mixture, rounding in the expected way."""
 
+    mixture_block_permutation_type: Literal["feistel", "linear"] | None = None
+    """How to shuffle each mixture block. The default uses a materialized random permutation and preserves the data
+    order of existing runs. "feistel" or "linear" avoid materializing large blocks but change the order."""
+
     max_train_batches: Optional[Dict[str, int]] = None
     """ Maximum number of batches to use from each dataset for training (using the initial batch size)"""
 
@@ -1240,6 +1368,7 @@ class LMMixtureDatasetConfig(LMTaskConfig):
             stop_strategy=self.stop_strategy,
             key=mix_key,
             block_size=self.mixture_block_size,
+            block_permutation_type=self.mixture_block_permutation_type,
         )
 
         return mixture
@@ -1272,7 +1401,9 @@ class LMMixtureDatasetConfig(LMTaskConfig):
             perm_type = "linear"
 
         def shuffle_ds(ds, key):
-            if self.shuffle is True:
+            if self.shuffle is True and self.shuffle_chunk_size is not None:
+                ds = ds.chunk_shuffle(self.shuffle_chunk_size, self.shuffle_window_chunks, key, perm_type=perm_type)
+            elif self.shuffle is True:
                 ds = ds.shuffle(key, perm_type=perm_type)
             elif isinstance(self.shuffle, int) and self.shuffle > 0:
                 ds = ds.era_shuffle(self.shuffle, key=key, perm_type=perm_type)
@@ -1552,6 +1683,13 @@ class ChatProcessor(BatchProcessor[dict, ProcessedChatDict]):
         }
 
 
+def _pack_index_path(cache: TreeCache) -> Optional[str]:
+    """Where to persist the pack index for a cache. We only persist pack indices for finished caches."""
+    if not cache.is_finished:
+        return None
+    return os.path.join(cache.cache_dir, PACK_INDEX_DIR_NAME)
+
+
 class MultiturnChatDataset(MappedAsyncDataset[tuple[ProcessedChatDict, ProcessedChatDict], LmExample]):
     """
     A dataset that yields multiturn chat examples from a cache of processed chat data.
@@ -1581,6 +1719,7 @@ class MultiturnChatDataset(MappedAsyncDataset[tuple[ProcessedChatDict, Processed
             Pos.size,
             max_segments_per_example=max_segments_per_example,
             slice_strategy=slice_strategy,
+            pack_index_path=_pack_index_path(cache),
         )
         self.Pos = Pos
 
@@ -1698,6 +1837,7 @@ class SupervisedDataset(MappedAsyncDataset[tuple[ProcessedSupervisedDict, Proces
             Pos.size,
             max_segments_per_example=max_segments_per_example,
             slice_strategy=slice_strategy,
+            pack_index_path=_pack_index_path(cache),
         )
 
         def _create_lm_example(ex_pair: tuple[ProcessedSupervisedDict, ProcessedSupervisedDict]) -> LmExample:
@@ -0,0 +1,14 @@
+from .engine import DecodeState, InferenceEngine, SamplingParams, decode_step, generate, prefill
+from .sampling import sample_tokens, top_p_filter
+
+
+__all__ = [
+    "DecodeState",
+    "InferenceEngine",
+    "SamplingParams",
+    "decode_step",
+    "generate",
+    "prefill",
+    "sample_tokens",
+    "top_p_filter",
+]
@@ -0,0 +1,290 @@
+import dataclasses
+import logging
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import equinox as eqx
+import jax
+import jax.numpy as jnp
+import jax.random as jrandom
+import jmp
+import numpy as np
+from jaxtyping import PRNGKeyArray
+
+import haliax as hax
+from haliax import Axis, NamedArray
+from haliax.partitioning import ResourceMapping
+
+from levanter.inference.sampling import sample_tokens
+from levanter.models.attention import AttentionMask, KvCache
+from levanter.models.lm_model import LmHeadModel
+from levanter.utils.tree_utils import inference_mode
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class SamplingParams:
+    max_new_tokens: int = 128
+    temperature: float = 0.0
+    """0 means greedy decoding."""
+    top_p: float = 1.0
+    stop_sequences: Sequence[Sequence[int]] = ()
+    """A sequence is finished once it ends with any of these. You'll usually want to include the EOS token."""
+
+
+class DecodeState(eqx.Module):
+    kv_cache: KvCache
+    tokens: NamedArray  # [Batch, Pos]: each prompt followed by its generated tokens
+    prompt_lengths: NamedArray  # [Batch]
+    lengths: NamedArray  # [Batch]: number of valid tokens in `tokens`
+    done: NamedArray  # [Batch]
+    key: PRNGKeyArray
+
+
+def prefill(
+    model: LmHeadModel,
+    prompts: NamedArray,
+    prompt_lengths: NamedArray,
+    Pos: Axis,
+    stop_sequences: jnp.ndarray,
+    *,
+    temperature,
+    top_p,
+    key: PRNGKeyArray,
+    dtype,
+) -> DecodeState:
+    """
+    Runs (right-padded) prompts through the model in one pass, filling a fresh KV cache with room for Pos.size tokens
+    per sequence, and samples the first generated token.
+
+    Args:
+        prompts: [Batch, position] token ids, padded on the right
+        prompt_lengths: [Batch] the unpadded length of each prompt
+        Pos: the maximum length of prompt + generation
+        stop_sequences: [NumStops, StopLen] token ids, right-aligned and padded on the left with -1
+    """
+    PromptPos = prompts.resolve_axis("position")
+    kv_cache = model.initial_cache(prompt_lengths.axes, Pos.alias("key_position"), dtype=dtype)
+
+    x, kv_cache = model.decode(prompts, AttentionMask.causal(), kv_cache, hax.arange(PromptPos))
+    logits = hax.dot(x["position", prompt_lengths - 1], model.get_lm_head(), axis=model.Embed)
+
+    key, subkey = jrandom.split(key)
+    next_token = sample_tokens(logits, model.Vocab, temperature=temperature, top_p=top_p, key=subkey)
+
+    tokens = hax.zeros((*prompt_lengths.axes, Pos), dtype=prompts.dtype)
+    tokens = hax.updated_slice(tokens, {"position": 0}, prompts)
+    done = hax.zeros(prompt_lengths.axes, dtype=bool)
+    state = DecodeState(kv_cache, tokens, prompt_lengths, prompt_lengths, done, key)
+
+    return _append_tokens(state, next_token, stop_sequences)
+
+
+def decode_step(
+    model: LmHeadModel, state: DecodeState, stop_sequences: jnp.ndarray, *, temperature, top_p
+) -> DecodeState:
+    """
+    Feeds the last token of every sequence through the model, attending to the KV cache, and appends the next token
+    to every sequence that isn't done.
+    """
+    Step = Axis("position", 1)
+    last_pos = state.lengths - 1
+    last_token = state.tokens["position", last_pos]
+
+    x, kv_cache = model.decode(last_token.broadcast_axis(Step), None, state.kv_cache, last_pos.broadcast_axis(Step))
+    logits = hax.dot(x["position", 0], model.get_lm_head(), axis=model.Embed)
+
+    key, subkey = jrandom.split(state.key)
+    next_token = sample_tokens(logits, model.Vocab, temperature=temperature, top_p=top_p, key=subkey)
+
+    state = dataclasses.replace(state, kv_cache=kv_cache, key=key)
+    return _append_tokens(state, next_token, stop_sequences)
+
+
+def generate(
+    model: LmHeadModel,
+    prompts: NamedArray,
+    prompt_lengths: NamedArray,
+    Pos: Axis,
+    stop_sequences: jnp.ndarray,
+    *,
+    max_new_tokens: int,
+    temperature,
+    top_p,
+    key: PRNGKeyArray,
+    dtype,
+) -> DecodeState:
+    """
+    Prefills the prompts and then decodes until every sequence is done or has max_new_tokens new tokens. The decode
+    loop is a [jax.lax.while_loop][], so under jit the whole generation is a single call with no host round trips.
+    """
+    state = prefill(
+        model,
+        prompts,
+        prompt_lengths,
+        Pos,
+        stop_sequences,
+        temperature=temperature,
+        top_p=top_p,
+        key=key,
+        dtype=dtype,
+    )
+
+    def cond(carry):
+        step, state = carry
+        return (step < max_new_tokens) & ~hax.all(state.done).array
+
+    def body(carry):
+        step, state = carry
+        state = decode_step(model, state, stop_sequences, temperature=temperature, top_p=top_p)
+        return step + 1, state
+
+    _, state = jax.lax.while_loop(cond, body, (jnp.array(1), state))
+    return state
+
+
+def _append_tokens(state: DecodeState, next_token: NamedArray, stop_sequences: jnp.ndarray) -> DecodeState:
+    Pos = state.tokens.resolve_axis("position")
+    appending = ~state.done
+
+    tokens = hax.where(appending & (state.lengths.broadcast_axis(Pos) == hax.arange(Pos)), next_token, state.tokens)
+    lengths = state.lengths + appending.astype(state.lengths.dtype)
+
+    hit_stop = _ends_with_stop_sequence(tokens, lengths, state.prompt_lengths, stop_sequences)
+    done = state.done | hit_stop | (lengths >= Pos.size)
+
+    return dataclasses.replace(state, tokens=tokens, lengths=lengths, done=done)
+
+
+def _ends_with_stop_sequence(
+    tokens: NamedArray, lengths: NamedArray, prompt_lengths: NamedArray, stop_sequences: jnp.ndarray
+) -> NamedArray:
+    # stop_sequences is [NumStops, StopLen], right-aligned with -1 as a wildcard for padding
+    (Batch,) = lengths.axes
+    StopLen = stop_sequences.shape[1]
+
+    idx = lengths.array[:, None] - StopLen + jnp.arange(StopLen)
+    window = jnp.take_along_axis(tokens.rearrange((Batch, "position")).array, jnp.maximum(idx, 0), axis=1)
+    # only generated tokens count: a prompt that happens to end with a stop sequence shouldn't stop generation
+    window = jnp.where(idx >= prompt_lengths.array[:, None], window, -2)
+
+    matches = (stop_sequences[None] == -1) | (stop_sequences[None] == window[:, None])
+    return hax.named(jnp.any(jnp.all(matches, axis=-1), axis=-1), Batch)
+
+
+def _pack_stop_sequences(stop_sequences: Sequence[Sequence[int]]) -> np.ndarray:
+    stop_sequences = [list(s) for s in stop_sequences if len(s) > 0]
+    max_len = max((len(s) for s in stop_sequences), default=1)
+    packed = np.full((len(stop_sequences), max_len), -1, dtype=np.int32)
+    for i, s in enumerate(stop_sequences):
+        packed[i, max_len - len(s) :] = s
+    return packed
+
+
+class InferenceEngine:
+    """
+    Batched autoregressive generation for an [LmHeadModel][] using a KV cache.
+
+    Prompts are grouped into batches of batch_size and right-padded to a power of two (to bound the number of
+    compilations). Each batch is prefilled in one pass and then decoded a token at a time until every sequence has
+    ended with a stop sequence, produced max_new_tokens, or filled max_seq_len. Generation for a batch is a single
+    jitted call.
+
+    The model must implement [LmHeadModel.decode][]. Currently that's Llama, Mistral, Qwen and Gemma.
+    """
+
+    def __init__(
+        self,
+        model: LmHeadModel,
+        *,
+        max_seq_len: int,
+        batch_size: int = 1,
+        axis_mapping: Optional[ResourceMapping] = None,
+        mp: Optional[jmp.Policy] = None,
+    ):
+        self.model = inference_mode(model, True)
+        self.Pos = Axis("position", max_seq_len)
+        self.Batch = Axis("batch", batch_size)
+        self.mp = mp
+
+        if mp is not None:
+            self._dtype = mp.compute_dtype
+        else:
+            self._dtype = model.get_lm_head().dtype
+
+        self._generate = hax.named_jit(self._generate_batch, axis_resources=axis_mapping)
+
+    def generate(
+        self, prompts: Sequence[Sequence[int]], params: SamplingParams = SamplingParams(), *, key: PRNGKeyArray
+    ) -> list[list[int]]:
+        """
+        Returns the generated tokens for each prompt, including the stop sequence if one was hit.
+        """
+        if params.max_new_tokens < 1:
+            raise ValueError(f"max_new_tokens must be at least 1, got {params.max_new_tokens}")
+
+        for prompt in prompts:
+            if not 0 < len(prompt) < self.Pos.size:
+                raise ValueError(f"Prompts must have between 1 and {self.Pos.size - 1} tokens, got {len(prompt)}")
+
+        stop_sequences = jnp.asarray(_pack_stop_sequences(params.stop_sequences))
+        temperature = jnp.asarray(params.temperature, dtype=jnp.float32)
+        top_p = jnp.asarray(params.top_p, dtype=jnp.float32)
+
+        results: list[list[int]] = []
+        for start in range(0, len(prompts), self.Batch.size):
+            batch = prompts[start : start + self.Batch.size]
+            key, subkey = jrandom.split(key)
+
+            tokens, prompt_lengths = self._pad_batch(batch)
+            state = self._generate(
+                self.model,
+                tokens,
+                prompt_lengths,
+                stop_sequences,
+                temperature,
+                top_p,
+                subkey,
+                max_new_tokens=params.max_new_tokens,
+            )
+
+            out_tokens = np.asarray(jax.device_get(state.tokens.rearrange((self.Batch, self.Pos)).array))
+            out_lengths = np.asarray(jax.device_get(state.lengths.array))
+            for i, prompt in enumerate(batch):
+                results.append(out_tokens[i, len(prompt) : out_lengths[i]].tolist())
+
+        return results
+
+    def _pad_batch(self, batch: Sequence[Sequence[int]]) -> tuple[NamedArray, NamedArray]:
+        longest = max(len(p) for p in batch)
+        PromptPos = self.Pos.resize(min(1 << (longest - 1).bit_length(), self.Pos.size))
+
+        tokens = np.zeros((self.Batch.size, PromptPos.size), dtype=np.int32)
+        # pad the batch out with single-token prompts, which we ignore
+        lengths = np.ones((self.Batch.size,), dtype=np.int32)
+        for i, prompt in enumerate(batch):
+            tokens[i, : len(prompt)] = prompt
+            lengths[i] = len(prompt)
+
+        return hax.named(tokens, (self.Batch, PromptPos)), hax.named(lengths, self.Batch)
+
+    def _generate_batch(
+        self, model, tokens, prompt_lengths, stop_sequences, temperature, top_p, key, *, max_new_tokens
+    ):
+        if self.mp is not None:
+            model = self.mp.cast_to_compute(model)
+
+        return generate(
+            model,
+            tokens,
+            prompt_lengths,
+            self.Pos,
+            stop_sequences,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            key=key,
+            dtype=self._dtype,
+        )
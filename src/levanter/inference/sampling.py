@@ -0,0 +1,50 @@
+import jax.numpy as jnp
+
+import haliax as hax
+from haliax import AxisSelector, NamedArray
+
+
+def top_p_filter(logits: NamedArray, Vocab: AxisSelector, top_p: float | jnp.ndarray) -> NamedArray:
+    """
+    Nucleus filtering: keeps the smallest set of tokens whose probability mass is at least top_p and sets the logits
+    of everything else to -inf. The most likely token is always kept. top_p may be traced.
+    """
+    Vocab = logits.resolve_axis(Vocab)
+    logits = logits.rearrange((..., Vocab))
+    probs = hax.nn.softmax(logits, axis=Vocab).array
+
+    sorted_probs = -jnp.sort(-probs, axis=-1)
+    # a token is kept if the mass of the tokens more likely than it hasn't already reached top_p
+    mass_before = jnp.cumsum(sorted_probs, axis=-1) - sorted_probs
+    kept = (mass_before < top_p) | (jnp.arange(Vocab.size) == 0)
+    threshold = jnp.min(jnp.where(kept, sorted_probs, jnp.inf), axis=-1, keepdims=True)
+
+    filtered = jnp.where(probs >= threshold, logits.array, -jnp.inf)
+    return hax.named(filtered, logits.axes)
+
+
+def sample_tokens(
+    logits: NamedArray,
+    Vocab: AxisSelector,
+    *,
+    temperature: float | jnp.ndarray,
+    top_p: float | jnp.ndarray = 1.0,
+    key,
+) -> NamedArray:
+    """
+    Picks the next token from logits along Vocab. temperature == 0 means greedy decoding. Otherwise, we sample from
+    softmax(logits / temperature), restricted to the top_p nucleus.
+
+    temperature and top_p may be traced, so a single compiled decode step serves every sampling setting.
+
+    Returns:
+        NamedArray: token ids with the axes of logits, minus Vocab
+    """
+    logits = logits.astype(jnp.float32)
+    greedy = hax.argmax(logits, axis=Vocab)
+
+    safe_temperature = jnp.where(temperature > 0, temperature, 1.0)
+    filtered = top_p_filter(logits / safe_temperature, Vocab, top_p)
+    sampled = hax.random.categorical(key, filtered, Vocab)
+
+    return hax.where(temperature > 0, sampled, greedy)
@@ -20,7 +20,6 @@ from levanter.eval import TaggedEvaluator, eval_model
 from levanter.models.gpt2 import Gpt2Config
 from levanter.models.lm_model import LmConfig, LmExample, LmHeadModel, compute_next_token_loss
 from levanter.trainer import TrainerConfig
-from levanter.utils.jax_utils import use_cpu_device
 from levanter.utils.tree_utils import inference_mode
 
 
@@ -106,13 +105,16 @@ def main(config: EvalLmConfig):
         # initialize the model
         if config.checkpoint_path is not None:
             # initialize the model
-            with use_cpu_device():
-                model = eqx.filter_eval_shape(config.model.build, Vocab, key=key)
-                # TODO: can't load the EMA model with current setup here. Not a big deal for now.
-                # TODO: don't load the entire checkpoint into CPU memory when we only need our share of the model
-                model = load_checkpoint(model, config.checkpoint_path, subpath="model")
-
-            model = hax.shard_with_axis_mapping(model, parameter_axis_mapping)
+            model = eqx.filter_eval_shape(config.model.build, Vocab, key=key)
+            # TODO: can't load the EMA model with current setup here. Not a big deal for now.
+            # load straight into the parameter sharding, so each host only reads its share of the model
+            model = load_checkpoint(
+                model,
+                config.checkpoint_path,
+                subpath="model",
+                axis_mapping=parameter_axis_mapping,
+                mesh=config.trainer.device_mesh,
+            )
         elif config.hf_checkpoint is not None:
             # load the huggingface model
             model_config = config.model
@@ -20,7 +20,6 @@ from levanter.models.gpt2 import Gpt2Config
 from levanter.models.lm_model import LmConfig, LmExample, LmHeadModel
 from levanter.models.loss import next_token_loss
 from levanter.trainer import TrainerConfig
-from levanter.utils.jax_utils import use_cpu_device
 from levanter.utils.tree_utils import inference_mode
 from levanter.visualization import compute_and_diff_log_probs, compute_and_visualize_log_probs
 
@@ -109,10 +108,14 @@ def main(config: VizLmConfig):
                 model_config.model_type, ref=config.checkpoint_path, dtype=config.trainer.mp.compute_dtype  # type: ignore
             )
         else:
-            with use_cpu_device():
-                model = eqx.filter_eval_shape(config.model.build, Vocab, key=key)
-                model = load_checkpoint(model, config.checkpoint_path, subpath="model")
-            model = hax.shard(model, parameter_axis_mapping)
+            model = eqx.filter_eval_shape(config.model.build, Vocab, key=key)
+            model = load_checkpoint(
+                model,
+                config.checkpoint_path,
+                subpath="model",
+                axis_mapping=parameter_axis_mapping,
+                mesh=config.trainer.device_mesh,
+            )
 
         model = typing.cast(LmHeadModel, inference_mode(model, True))
 
@@ -125,10 +128,14 @@ def main(config: VizLmConfig):
                     model_config.model_type, ref=config.comparison_model_path, dtype=config.trainer.mp.compute_dtype  # type: ignore
                 )
             else:
-                with use_cpu_device():
-                    comparison_model = eqx.filter_eval_shape(config.model.build, Vocab, key=key)
-                    comparison_model = load_checkpoint(comparison_model, config.comparison_model_path, subpath="model")
-                comparison_model = hax.shard(comparison_model, parameter_axis_mapping)
+                comparison_model = eqx.filter_eval_shape(config.model.build, Vocab, key=key)
+                comparison_model = load_checkpoint(
+                    comparison_model,
+                    config.comparison_model_path,
+                    subpath="model",
+                    axis_mapping=parameter_axis_mapping,
+                    mesh=config.trainer.device_mesh,
+                )
             comparison_model = typing.cast(LmHeadModel, inference_mode(comparison_model, True))
         else:
             comparison_model = None
@@ -13,7 +13,7 @@ from jax.sharding import PartitionSpec
 from jaxtyping import PRNGKeyArray
 
 import haliax
-from haliax import Axis, AxisSelection, AxisSelector, NamedArray, axis_name
+from haliax import Axis, AxisSelection, AxisSelector, AxisSpec, NamedArray, axis_name
 from haliax.jax_utils import named_call
 from haliax.nn.attention import causal_mask, combine_masks_and, combine_masks_or
 from haliax.partitioning import pspec_for_axis
@@ -709,6 +709,108 @@ def materialize_mask(
         return None
 
 
+class KvCache(eqx.Module):
+    """
+    Preallocated keys and values for autoregressive decoding. The cache has a fixed "key_position" axis sized to the
+    longest sequence we'll decode, so that every decode step has the same shape and only needs to be compiled once.
+    For stacked transformers, the cache also has the layer axis and is scanned alongside the layers.
+    """
+
+    k: NamedArray  # [..., KVHeads, KeyPos, HeadSize]
+    v: NamedArray  # [..., KVHeads, KeyPos, HeadSize]
+
+    @staticmethod
+    def init(shape: AxisSpec, *, dtype) -> "KvCache":
+        """shape must include the "key_position" axis, which is the maximum number of tokens the cache can hold."""
+        k = haliax.shard(haliax.zeros(shape, dtype=dtype))
+        v = haliax.shard(haliax.zeros(shape, dtype=dtype))
+        return KvCache(k, v)
+
+    @property
+    def KeyPos(self) -> Axis:
+        return self.k.resolve_axis("key_position")
+
+    def update(self, start: NamedArray, k: NamedArray, v: NamedArray) -> "KvCache":
+        """
+        Writes k and v (which have a "key_position" axis of however many new tokens there are) into the cache at
+        start. start may have batch axes, in which case each sequence is written at its own offset.
+        """
+        k = haliax.updated_slice(self.k, {"key_position": start}, k.astype(self.k.dtype))
+        v = haliax.updated_slice(self.v, {"key_position": start}, v.astype(self.v.dtype))
+        return KvCache(haliax.shard(k), haliax.shard(v))
+
+
+def attend_with_kv_cache(
+    QPos: AxisSelector,
+    KPos: AxisSelector,
+    Key: AxisSelector,
+    query: NamedArray,
+    key: NamedArray,
+    value: NamedArray,
+    kv_cache: KvCache,
+    pos_ids: NamedArray,
+    mask: Optional[AttentionMask] = None,
+    attention_dtype: Optional[jnp.dtype] = None,
+    precision: PrecisionLike = None,
+    use_flash: Optional[bool] = None,
+    attn_backend: Optional[AttentionBackend] = None,
+    flash_block_size: Optional[int] = None,
+) -> tuple[NamedArray, KvCache]:
+    """
+    Writes key and value into kv_cache and attends to them. pos_ids are the (absolute) positions of the queries, with
+    shape at least {QPos}; the new keys and values are written starting at pos_ids[QPos, 0].
+
+    There are two modes:
+
+    * Prefill (mask is not None): the queries are a prompt that starts at position 0, so they only need to see each
+      other. We run the usual [dot_product_attention][] over the new keys and values with mask, which means prefill
+      uses whichever attention backend (flash, splash, TE) is configured.
+    * Decode (mask is None): each query attends to every cached key at or before its position. This is a (batched)
+      matrix-vector product over the cache, so we use vanilla attention.
+
+    Returns:
+        The attention output and the updated cache.
+    """
+    KPos = axis_name(KPos)
+    if KPos != "key_position":
+        raise ValueError(f"KV caches are indexed by 'key_position', but got KPos={KPos}")
+
+    kv_cache = kv_cache.update(pos_ids[QPos, 0], key, value)
+
+    if mask is not None:
+        attn_output = dot_product_attention(
+            QPos,
+            KPos,
+            Key,
+            query,
+            key,
+            value,
+            mask,
+            attention_dtype=attention_dtype,
+            precision=precision,
+            use_flash=use_flash,
+            attn_backend=attn_backend,
+            flash_block_size=flash_block_size,
+        )
+    else:
+        # slots past the current position hold either nothing or stale prompt padding, so mask them out
+        decode_mask = pos_ids.broadcast_axis(kv_cache.KeyPos) >= haliax.arange(kv_cache.KeyPos)
+        attn_output = dot_product_attention(
+            QPos,
+            KPos,
+            Key,
+            query,
+            kv_cache.k,
+            kv_cache.v,
+            decode_mask,
+            attention_dtype=attention_dtype,
+            precision=precision,
+            attn_backend=AttentionBackend.VANILLA,
+        )
+
+    return attn_output, kv_cache
+
+
 # TODO: padding mask
 # TODO: FCM mask?
 
@@ -14,11 +14,12 @@ from haliax.nn.scan import Stacked
 from haliax.state_dict import ModuleWithStateDictSerialization
 
 from levanter.compat.hf_checkpoints import HFCheckpointConverter, HFCompatConfig
-from levanter.models.attention import AttentionBackend, AttentionMask
+from levanter.models.attention import AttentionBackend, AttentionMask, KvCache
 from levanter.models.llama import (  # Gemma attention and MLP is identical to LLama
     LlamaAttention,
     LlamaEmbedding,
     LlamaMlp,
+    decode_layers,
 )
 from levanter.models.lm_model import LmConfig, LmHeadModel
 from levanter.models.rotary import DefaultRotaryEmbeddingsConfig, RotaryEmbeddingsConfig
@@ -258,11 +259,41 @@ class GemmaDecoderLayer(ModuleWithStateDictSerialization):
 
     @named_call
     def __call__(self, x: NamedArray, mask: NamedArray | AttentionMask | None, *, key=None) -> NamedArray:
+        output, _ = self._forward(x, mask, None, None, key=key)
+        return output
+
+    @named_call
+    def decode(
+        self,
+        x: NamedArray,
+        mask: AttentionMask | None,
+        kv_cache: KvCache,
+        pos_ids: NamedArray,
+        *,
+        key=None,
+    ) -> tuple[NamedArray, KvCache]:
+        output, new_cache = self._forward(x, mask, kv_cache, pos_ids, key=key)
+        assert new_cache is not None
+        return output, new_cache
+
+    def _forward(
+        self,
+        x: NamedArray,
+        mask: NamedArray | AttentionMask | None,
+        kv_cache: KvCache | None,
+        pos_ids: NamedArray | None,
+        *,
+        key,
+    ) -> tuple[NamedArray, KvCache | None]:
         k_attn, k_mlp = maybe_rng_split(key, 2)
         # self attention and skip connection
         residual = x
         x = self.input_layernorm(x)
-        attn_output = self.self_attn(x=x, mask=mask, key=k_attn)
+        if kv_cache is None:
+            attn_output = self.self_attn(x=x, mask=mask, key=k_attn)
+        else:
+            assert pos_ids is not None and not isinstance(mask, NamedArray)
+            attn_output, kv_cache = self.self_attn.decode(x, mask, kv_cache, pos_ids, key=k_attn)
         x = residual + attn_output
 
         # MLP and skip connection
@@ -270,7 +301,7 @@ class GemmaDecoderLayer(ModuleWithStateDictSerialization):
         x = self.post_attention_layernorm(x)
         mlp_output = self.mlp(x, key=k_mlp)
         output = residual + mlp_output
-        return output
+        return output, kv_cache
 
 
 class GemmaTransformer(ModuleWithStateDictSerialization):
@@ -302,6 +333,28 @@ class GemmaTransformer(ModuleWithStateDictSerialization):
 
         return x
 
+    def initial_cache(self, batch_axes: AxisSpec, KeyPos: Axis, *, dtype) -> KvCache:
+        c = self.config
+        return KvCache.init(
+            (c.Layers, *hax.axis_spec_to_tuple(batch_axes), c.KVHeads, KeyPos, c.HeadSize), dtype=dtype
+        )
+
+    @named_call
+    def decode(
+        self,
+        x: NamedArray,
+        attn_mask: AttentionMask | None,
+        kv_cache: KvCache,
+        pos_ids: NamedArray,
+        *,
+        key=None,
+    ) -> tuple[NamedArray, KvCache]:
+        keys = maybe_rng_split(key, self.config.num_layers) if key is not None else None
+        x, kv_cache = decode_layers(self.layers, x, attn_mask, kv_cache, pos_ids, keys=keys)
+        x = self.norm(x)
+
+        return x, kv_cache
+
 
 class GemmaLMHeadModel(LmHeadModel[GemmaConfig], ModuleWithStateDictSerialization):
     transformer: GemmaTransformer
@@ -362,6 +415,23 @@ class GemmaLMHeadModel(LmHeadModel[GemmaConfig], ModuleWithStateDictSerializatio
         x = self.transformer(x, attn_mask=attn_mask, key=key)
         return x
 
+    def initial_cache(self, batch_axes: AxisSpec, KeyPos: Axis, *, dtype) -> KvCache:
+        return self.transformer.initial_cache(batch_axes, KeyPos, dtype=dtype)
+
+    def decode(
+        self,
+        input_ids: NamedArray,
+        attn_mask: AttentionMask | None,
+        kv_cache: KvCache,
+        pos_ids: NamedArray,
+        *,
+        key=None,
+    ) -> tuple[NamedArray, KvCache]:
+        x = self.embeddings.embed(input_ids)
+        normalizer = jnp.sqrt(self.config.hidden_dim).astype(x.dtype)
+        x = x * normalizer
+        return self.transformer.decode(x, attn_mask, kv_cache, pos_ids, key=key)
+
     def resize_vocab(self, new_size: int, key=None) -> "LmHeadModel[GemmaConfig]":
         new_Vocab = self.Vocab.resize(new_size)
         k1, k2 = maybe_rng_split(key, 2)
@@ -11,11 +11,17 @@ import haliax as hax
 import haliax.nn as hnn
 from haliax import Axis, AxisSpec, NamedArray
 from haliax.jax_utils import maybe_rng_split, named_call, shaped_rng_split
-from haliax.nn.scan import ScanCheckpointPolicy, Stacked
+from haliax.nn.scan import BlockSeq, ScanCheckpointPolicy, Stacked
 from haliax.state_dict import ModuleWithStateDictSerialization
 
 from levanter.compat.hf_checkpoints import HFCheckpointConverter, HFCompatConfig
-from levanter.models.attention import AttentionBackend, AttentionMask, dot_product_attention
+from levanter.models.attention import (
+    AttentionBackend,
+    AttentionMask,
+    KvCache,
+    attend_with_kv_cache,
+    dot_product_attention,
+)
 from levanter.models.lm_model import LmConfig, LmHeadModel
 from levanter.models.rotary import DefaultRotaryEmbeddingsConfig, RotaryEmbeddingsConfig
 from levanter.utils.activation import ActivationFunctionEnum
@@ -279,6 +285,37 @@ class LlamaAttention(eqx.Module):
 
     @named_call
     def __call__(self, x: NamedArray, mask: Optional[NamedArray | AttentionMask], *, key=None) -> NamedArray:
+        attn_output, _ = self._forward(x, mask, None, None, key=key)
+        return attn_output
+
+    @named_call
+    def decode(
+        self,
+        x: NamedArray,
+        mask: Optional[AttentionMask],
+        kv_cache: KvCache,
+        pos_ids: NamedArray,
+        *,
+        key=None,
+    ) -> tuple[NamedArray, KvCache]:
+        """
+        Like __call__, but x holds the tokens at pos_ids and their keys and values are written into kv_cache.
+        See [levanter.models.attention.attend_with_kv_cache][] for how mask is used.
+        """
+        attn_output, new_cache = self._forward(x, mask, kv_cache, pos_ids, key=key)
+        assert new_cache is not None
+        return attn_output, new_cache
+
+    def _forward(
+        self,
+        x: NamedArray,
+        mask: Optional[NamedArray | AttentionMask],
+        kv_cache: Optional[KvCache],
+        pos_ids: Optional[NamedArray],
+        *,
+        key,
+    ) -> tuple[NamedArray, Optional[KvCache]]:
+        """The forward pass shared by __call__ (kv_cache is None) and decode."""
         key_q, key_k, key_v, key_o = maybe_rng_split(key, 4)
 
         # reorder heads and position for better training throughput
@@ -286,7 +323,11 @@ class LlamaAttention(eqx.Module):
         k = self.k_proj(x, key=key_k).rearrange((..., "kv_heads", "position", "head_size"))
         v = self.v_proj(x, key=key_v).rearrange((..., "kv_heads", "position", "head_size"))
 
-        rot_embs = self.config.rope.build(self.config.HeadSize, q.resolve_axis("position"))
+        if kv_cache is None:
+            rot_embs = self.config.rope.build(self.config.HeadSize, q.resolve_axis("position"))
+        else:
+            assert pos_ids is not None
+            rot_embs = self.config.rope.build(self.config.HeadSize, kv_cache.KeyPos).at(kv_cache.KeyPos, pos_ids)
         q, k = rot_embs(self.config.HeadSize, q, k)
 
         # gradient checkpointing
@@ -298,19 +339,38 @@ class LlamaAttention(eqx.Module):
         v = v.rename({"position": "key_position"})
 
         c = self.config
-        attn_output = dot_product_attention(
-            "position",
-            "key_position",
-            "head_size",
-            q,
-            k,
-            v,
-            mask,
-            attention_dtype=jnp.float32 if self.config.upcast_attn else x.dtype,
-            use_flash=c.use_flash_attention,
-            attn_backend=self.config.attn_backend,
-            flash_block_size=c.flash_attention_block_size,
-        )
+        attention_dtype = jnp.float32 if c.upcast_attn else x.dtype
+        if kv_cache is None:
+            attn_output = dot_product_attention(
+                "position",
+                "key_position",
+                "head_size",
+                q,
+                k,
+                v,
+                mask,
+                attention_dtype=attention_dtype,
+                use_flash=c.use_flash_attention,
+                attn_backend=c.attn_backend,
+                flash_block_size=c.flash_attention_block_size,
+            )
+        else:
+            assert pos_ids is not None and not isinstance(mask, NamedArray)
+            attn_output, kv_cache = attend_with_kv_cache(
+                "position",
+                "key_position",
+                "head_size",
+                q,
+                k,
+                v,
+                kv_cache,
+                pos_ids,
+                mask,
+                attention_dtype=attention_dtype,
+                use_flash=c.use_flash_attention,
+                attn_backend=c.attn_backend,
+                flash_block_size=c.flash_attention_block_size,
+            )
 
         attn_output = attn_output.flatten_axes(("kv_heads", "q_heads_per_group"), "heads")
         attn_output = attn_output.astype(x.dtype)
@@ -320,7 +380,7 @@ class LlamaAttention(eqx.Module):
         # gradient checkpointing
         attn_output = hax.tree_checkpoint_name(attn_output, "attn_output")
 
-        return attn_output
+        return attn_output, kv_cache
 
 
 class LlamaDecoderLayer(eqx.Module):
@@ -355,11 +415,41 @@ class LlamaDecoderLayer(eqx.Module):
 
     @named_call
     def __call__(self, x: NamedArray, mask: Optional[NamedArray | AttentionMask], *, key=None) -> NamedArray:
+        output, _ = self._forward(x, mask, None, None, key=key)
+        return output
+
+    @named_call
+    def decode(
+        self,
+        x: NamedArray,
+        mask: Optional[AttentionMask],
+        kv_cache: KvCache,
+        pos_ids: NamedArray,
+        *,
+        key=None,
+    ) -> tuple[NamedArray, KvCache]:
+        output, new_cache = self._forward(x, mask, kv_cache, pos_ids, key=key)
+        assert new_cache is not None
+        return output, new_cache
+
+    def _forward(
+        self,
+        x: NamedArray,
+        mask: Optional[NamedArray | AttentionMask],
+        kv_cache: Optional[KvCache],
+        pos_ids: Optional[NamedArray],
+        *,
+        key,
+    ) -> tuple[NamedArray, Optional[KvCache]]:
         k_attn, k_mlp = maybe_rng_split(key, 2)
         # self attention and skip connection
         residual = x
         x = self.input_layernorm(x)
-        attn_output = self.self_attn(x=x, mask=mask, key=k_attn)
+        if kv_cache is None:
+            attn_output = self.self_attn(x=x, mask=mask, key=k_attn)
+        else:
+            assert pos_ids is not None and not isinstance(mask, NamedArray)
+            attn_output, kv_cache = self.self_attn.decode(x, mask, kv_cache, pos_ids, key=k_attn)
         if self.post_attn_layernorm is not None:
             attn_output = self.post_attn_layernorm(attn_output)
         x = residual + attn_output
@@ -371,7 +461,7 @@ class LlamaDecoderLayer(eqx.Module):
         if self.post_mlp_layernorm is not None:
             mlp_output = self.post_mlp_layernorm(mlp_output)
         output = residual + mlp_output
-        return output
+        return output, kv_cache
 
 
 class LlamaTransformer(eqx.Module):
@@ -403,6 +493,63 @@ class LlamaTransformer(eqx.Module):
 
         return x
 
+    def initial_cache(self, batch_axes: AxisSpec, KeyPos: Axis, *, dtype) -> KvCache:
+        c = self.config
+        return KvCache.init(
+            (c.Layers, *hax.axis_spec_to_tuple(batch_axes), c.KVHeads, KeyPos, c.HeadSize), dtype=dtype
+        )
+
+    @named_call
+    def decode(
+        self,
+        x: NamedArray,
+        attn_mask: Optional[AttentionMask],
+        kv_cache: KvCache,
+        pos_ids: NamedArray,
+        *,
+        key=None,
+    ) -> tuple[NamedArray, KvCache]:
+        keys = maybe_rng_split(key, self.config.num_layers) if key is not None else None
+        x, kv_cache = decode_layers(self.layers, x, attn_mask, kv_cache, pos_ids, keys=keys)
+        x = self.norm(x)
+
+        return x, kv_cache
+
+
+def decode_layers(
+    layers: BlockFoldable,
+    x: NamedArray,
+    attn_mask: Optional[AttentionMask],
+    kv_cache: KvCache,
+    pos_ids: NamedArray,
+    *,
+    keys=None,
+) -> tuple[NamedArray, KvCache]:
+    """
+    Calls `layer.decode` on each layer in turn, giving each layer its slice of kv_cache (which is stacked along the
+    layer axis).
+    """
+    Block = layers.Block
+
+    # the whole cache is carried through the loop and each layer's slice is written back in place. Scanning over the
+    # cache instead would copy all of it every step, which dominates decode time since decoding is bandwidth bound.
+    def do_layer(layer, carry, i, key):
+        x, kv_cache = carry
+        layer_cache = hax.tree_util.tree_map(lambda a: a[Block, i], kv_cache)
+        x, layer_cache = layer.decode(x, attn_mask, layer_cache, pos_ids, key=key)
+        kv_cache = hax.tree_util.tree_map(lambda a, u: a.at[Block, i].set(u), kv_cache, layer_cache)
+        return x, kv_cache
+
+    if not isinstance(layers, BlockSeq):
+        return layers.fold_via(do_layer)((x, kv_cache), hax.arange(Block), keys)
+
+    # BlockSeq.fold_via doesn't slice its arguments along the block axis (Stacked's does), so we loop here
+    carry = (x, kv_cache)
+    for i, layer in enumerate(layers.blocks):
+        carry = do_layer(layer, carry, i, keys[i] if keys is not None else None)
+
+    return carry
+
 
 class LlamaEmbedding(ModuleWithStateDictSerialization, eqx.Module):
     """Similar to GPT2 Embedding, except that:
@@ -522,6 +669,21 @@ class LlamaLMHeadModel(ModuleWithStateDictSerialization, LmHeadModel[LlamaConfig
 
         return x
 
+    def initial_cache(self, batch_axes: AxisSpec, KeyPos: Axis, *, dtype) -> KvCache:
+        return self.transformer.initial_cache(batch_axes, KeyPos, dtype=dtype)
+
+    def decode(
+        self,
+        input_ids: NamedArray,
+        attn_mask: Optional[AttentionMask],
+        kv_cache: KvCache,
+        pos_ids: NamedArray,
+        *,
+        key=None,
+    ) -> tuple[NamedArray, KvCache]:
+        x = self.embeddings.embed(input_ids)
+        return self.transformer.decode(x, attn_mask, kv_cache, pos_ids, key=key)
+
     def get_lm_head(self) -> hax.NamedArray:
         if self.lm_head is None:
             return self.embeddings.token_embeddings.weight
@@ -8,9 +8,9 @@ import jax.numpy as jnp
 from jaxtyping import PRNGKeyArray
 
 import haliax as hax
-from haliax import Axis, NamedArray, NamedOrNumeric
+from haliax import Axis, AxisSpec, NamedArray, NamedOrNumeric
 
-from levanter.models.attention import AttentionMask
+from levanter.models.attention import AttentionMask, KvCache
 from levanter.models.loss import maybe_fused_next_token_loss
 
 
@@ -228,6 +228,37 @@ class LmHeadModel(eqx.Module, Generic[LmConfigT]):
         """
         pass
 
+    def initial_cache(self, batch_axes: AxisSpec, KeyPos: Axis, *, dtype) -> KvCache:
+        """
+        Allocates an empty KV cache for [decode][], able to hold KeyPos.size tokens for each sequence in batch_axes.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support decoding with a KV cache")
+
+    def decode(
+        self,
+        input_ids: NamedArray,
+        attn_mask: Optional[AttentionMask],
+        kv_cache: KvCache,
+        pos_ids: NamedArray,
+        *,
+        key=None,
+    ) -> tuple[NamedArray, KvCache]:
+        """
+        Compute the activations for input_ids using (and updating) a KV cache, for autoregressive decoding.
+        Args:
+            input_ids: token IDs with shape [..., Pos]
+            attn_mask: the causal mask when prefilling a prompt that starts at position 0, or None when decoding
+                tokens that should attend to everything already in the cache
+            kv_cache: the cache from [initial_cache][] or a previous call to decode
+            pos_ids: the position of each token in input_ids, with shape [..., Pos]
+            key: PRNGKeyArray for random number generation
+
+        Returns:
+            NamedArray: activations with shape [..., Pos, Embed], and the updated cache
+
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support decoding with a KV cache")
+
     @property
     def vocab_size(self) -> int:
         return self.Vocab.size
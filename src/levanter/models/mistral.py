@@ -6,12 +6,12 @@ import jax.random as jrandom
 
 import haliax as hax
 import haliax.nn as hnn
-from haliax import Axis, NamedArray
+from haliax import Axis, AxisSpec, NamedArray
 from haliax.jax_utils import maybe_rng_split
 from haliax.state_dict import ModuleWithStateDictSerialization
 
 from levanter.compat.hf_checkpoints import HFCheckpointConverter
-from levanter.models.attention import AttentionBackend, AttentionMask
+from levanter.models.attention import AttentionBackend, AttentionMask, KvCache
 from levanter.models.llama import LlamaConfig, LlamaEmbedding, LlamaTransformer
 from levanter.models.lm_model import LmConfig, LmHeadModel
 from levanter.utils.activation import ActivationFunctionEnum
@@ -196,6 +196,21 @@ class MistralLMHeadModel(ModuleWithStateDictSerialization, LmHeadModel[MistralCo
         x = self.transformer(x, attn_mask=attn_mask, key=k_t)
         return x
 
+    def initial_cache(self, batch_axes: AxisSpec, KeyPos: Axis, *, dtype) -> KvCache:
+        return self.transformer.initial_cache(batch_axes, KeyPos, dtype=dtype)
+
+    def decode(
+        self,
+        input_ids: NamedArray,
+        attn_mask: Optional[AttentionMask],
+        kv_cache: KvCache,
+        pos_ids: NamedArray,
+        *,
+        key=None,
+    ) -> tuple[NamedArray, KvCache]:
+        x = self.embeddings.embed(input_ids)
+        return self.transformer.decode(x, attn_mask, kv_cache, pos_ids, key=key)
+
     def resize_vocab(self, new_size: int, key=None) -> "LmHeadModel[MistralConfig]":
         new_Vocab = self.Vocab.resize(new_size)
         k1, k2 = maybe_rng_split(key, 2)
@@ -8,13 +8,13 @@ import jax.random as jrandom
 
 import haliax as hax
 import haliax.nn as hnn
-from haliax import Axis, NamedArray
+from haliax import Axis, AxisSpec, NamedArray
 from haliax.jax_utils import maybe_rng_split, named_call, shaped_rng_split
 from haliax.nn.scan import Stacked
 from haliax.state_dict import ModuleWithStateDictSerialization
 
 from levanter.compat.hf_checkpoints import HFCheckpointConverter
-from levanter.models.attention import AttentionMask, dot_product_attention
+from levanter.models.attention import AttentionMask, KvCache, attend_with_kv_cache, dot_product_attention
 from levanter.models.llama import LlamaConfig, LlamaEmbedding, LlamaMlp, LlamaTransformer
 from levanter.models.lm_model import LmConfig, LmHeadModel
 from levanter.models.rotary import RotaryEmbeddingsConfig
@@ -158,6 +158,42 @@ class QwenAttention(eqx.Module):
     def __call__(
         self, x: NamedArray, mask: Optional[NamedArray | AttentionMask], layer_idx: int = 0, *, key=None
     ) -> NamedArray:
+        attn_output, _ = self._forward(x, mask, None, None, layer_idx, key=key)
+        return attn_output
+
+    @named_call
+    def decode(
+        self,
+        x: NamedArray,
+        mask: Optional[AttentionMask],
+        kv_cache: KvCache,
+        pos_ids: NamedArray,
+        layer_idx: int = 0,
+        *,
+        key=None,
+    ) -> tuple[NamedArray, KvCache]:
+        attn_output, new_cache = self._forward(x, mask, kv_cache, pos_ids, layer_idx, key=key)
+        assert new_cache is not None
+        return attn_output, new_cache
+
+    def _forward(
+        self,
+        x: NamedArray,
+        mask: Optional[NamedArray | AttentionMask],
+        kv_cache: Optional[KvCache],
+        pos_ids: Optional[NamedArray],
+        layer_idx: int,
+        *,
+        key,
+    ) -> tuple[NamedArray, Optional[KvCache]]:
+        # Apply sliding window attention if configured and past max_window_layers
+        if (
+            self.config.use_sliding_window
+            and self.config.sliding_window is not None
+            and layer_idx >= self.config.max_window_layers
+        ):
+            raise ValueError("Sliding Window Attention is not currently supported.")
+
         key_q, key_k, key_v, key_o = maybe_rng_split(key, 4)
 
         # QKV projections
@@ -166,40 +202,55 @@ class QwenAttention(eqx.Module):
         v = self.v_proj(x, key=key_v).rearrange((..., "kv_heads", "position", "head_size"))
 
         # Apply rotary embeddings
-        rot_embs = self.config.rope.build(self.config.HeadSize, q.resolve_axis("position"))
+        if kv_cache is None:
+            rot_embs = self.config.rope.build(self.config.HeadSize, q.resolve_axis("position"))
+        else:
+            assert pos_ids is not None
+            rot_embs = self.config.rope.build(self.config.HeadSize, kv_cache.KeyPos).at(kv_cache.KeyPos, pos_ids)
         q, k = rot_embs(self.config.HeadSize, q, k)
 
         k = k.rename({"position": "key_position"})
         v = v.rename({"position": "key_position"})
 
-        # Apply sliding window attention if configured and past max_window_layers
-        if (
-            self.config.use_sliding_window
-            and self.config.sliding_window is not None
-            and layer_idx >= self.config.max_window_layers
-        ):
-            raise ValueError("Sliding Window Attention is not currently supported.")
-
         # Perform attention
-        attn_output = dot_product_attention(
-            "position",
-            "key_position",
-            "head_size",
-            q,
-            k,
-            v,
-            mask,
-            attention_dtype=jnp.float32 if self.config.upcast_attn else x.dtype,
-            use_flash=self.config.use_flash_attention,
-            attn_backend=self.config.attn_backend,
-            flash_block_size=self.config.flash_attention_block_size,
-        )
+        attention_dtype = jnp.float32 if self.config.upcast_attn else x.dtype
+        if kv_cache is None:
+            attn_output = dot_product_attention(
+                "position",
+                "key_position",
+                "head_size",
+                q,
+                k,
+                v,
+                mask,
+                attention_dtype=attention_dtype,
+                use_flash=self.config.use_flash_attention,
+                attn_backend=self.config.attn_backend,
+                flash_block_size=self.config.flash_attention_block_size,
+            )
+        else:
+            assert pos_ids is not None and not isinstance(mask, NamedArray)
+            attn_output, kv_cache = attend_with_kv_cache(
+                "position",
+                "key_position",
+                "head_size",
+                q,
+                k,
+                v,
+                kv_cache,
+                pos_ids,
+                mask,
+                attention_dtype=attention_dtype,
+                use_flash=self.config.use_flash_attention,
+                attn_backend=self.config.attn_backend,
+                flash_block_size=self.config.flash_attention_block_size,
+            )
 
         attn_output = attn_output.flatten_axes(("kv_heads", "q_heads_per_group"), "heads")
         attn_output = attn_output.astype(x.dtype)
 
         attn_output = self.o_proj(attn_output, key=key_o)
-        return attn_output
+        return attn_output, kv_cache
 
 
 # Modified decoder layer for Qwen
@@ -229,18 +280,48 @@ class QwenDecoderLayer(eqx.Module):
 
     @named_call
     def __call__(self, x: NamedArray, mask: Optional[NamedArray | AttentionMask], *, key=None) -> NamedArray:
+        output, _ = self._forward(x, mask, None, None, key=key)
+        return output
+
+    @named_call
+    def decode(
+        self,
+        x: NamedArray,
+        mask: Optional[AttentionMask],
+        kv_cache: KvCache,
+        pos_ids: NamedArray,
+        *,
+        key=None,
+    ) -> tuple[NamedArray, KvCache]:
+        output, new_cache = self._forward(x, mask, kv_cache, pos_ids, key=key)
+        assert new_cache is not None
+        return output, new_cache
+
+    def _forward(
+        self,
+        x: NamedArray,
+        mask: Optional[NamedArray | AttentionMask],
+        kv_cache: Optional[KvCache],
+        pos_ids: Optional[NamedArray],
+        *,
+        key,
+    ) -> tuple[NamedArray, Optional[KvCache]]:
         k_attn, k_mlp = maybe_rng_split(key, 2)
 
         residual = x
         x = self.input_layernorm(x)
-        attn_output = self.self_attn(x=x, mask=mask, key=k_attn)
+        if kv_cache is None:
+            attn_output = self.self_attn(x=x, mask=mask, key=k_attn)
+        else:
+            assert pos_ids is not None and not isinstance(mask, NamedArray)
+            attn_output, kv_cache = self.self_attn.decode(x, mask, kv_cache, pos_ids, key=k_attn)
         x = residual + attn_output
 
         residual = x
         x = self.post_attention_layernorm(x)
         mlp_output = self.mlp(x, key=k_mlp)
         output = residual + mlp_output
-        return output
+        return output, kv_cache
 
 
 # Modified transformer for Qwen
@@ -300,6 +381,21 @@ class QwenLMHeadModel(LmHeadModel[QwenConfig], ModuleWithStateDictSerialization)
 
         return x
 
+    def initial_cache(self, batch_axes: AxisSpec, KeyPos: Axis, *, dtype) -> KvCache:
+        return self.transformer.initial_cache(batch_axes, KeyPos, dtype=dtype)
+
+    def decode(
+        self,
+        input_ids: NamedArray,
+        attn_mask: Optional[AttentionMask],
+        kv_cache: KvCache,
+        pos_ids: NamedArray,
+        *,
+        key=None,
+    ) -> tuple[NamedArray, KvCache]:
+        x = self.embeddings.embed(input_ids)
+        return self.transformer.decode(x, attn_mask, kv_cache, pos_ids, key=key)
+
     def get_lm_head(self) -> hax.NamedArray:
         if self.lm_head is None:
             return self.embeddings.token_embeddings.weight
@@ -8,7 +8,7 @@ import jax
 import jax.numpy as jnp
 
 import haliax as hax
-from haliax import Axis, NamedArray
+from haliax import Axis, AxisSelector, NamedArray
 
 
 def _rotate_half(x: NamedArray, HeadSize: Axis) -> NamedArray:
@@ -36,6 +36,13 @@ class RotaryEmbeddings(eqx.Module):
         k_embed = k * self.nograd_cos + _rotate_half(k, HeadDim) * self.nograd_sin
         return q_embed, k_embed
 
+    def at(self, Pos: AxisSelector, position_ids: NamedArray) -> "RotaryEmbeddings":
+        """
+        Selects the embeddings for position_ids, replacing Pos with the axes of position_ids. This is used when
+        decoding with a KV cache, where the tokens in a batch aren't at positions 0..n.
+        """
+        return RotaryEmbeddings(cos=self.cos.take(Pos, position_ids), sin=self.sin.take(Pos, position_ids))
+
 
 @dataclass
 class RotaryEmbeddingsConfig(abc.ABC, draccus.ChoiceRegistry):
@@ -1,6 +1,13 @@
-from .cache import SerialCacheWriter, TreeCache, build_or_load_cache
+from .cache import SerialCacheWriter, TreeCache, build_or_load_cache, consolidate_cache
 from .jagged_array import JaggedArrayStore
 from .tree_store import TreeStore
 
 
-__all__ = ["TreeCache", "build_or_load_cache", "SerialCacheWriter", "JaggedArrayStore", "TreeStore"]
+__all__ = [
+    "TreeCache",
+    "build_or_load_cache",
+    "consolidate_cache",
+    "SerialCacheWriter",
+    "JaggedArrayStore",
+    "TreeStore",
+]
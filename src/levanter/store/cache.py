@@ -1,11 +1,16 @@
 import asyncio
 import concurrent
+import concurrent.futures
+import contextlib
 import copy
 import dataclasses
+import functools
 import logging as pylogging
+import multiprocessing
 import operator
 import os
 import pprint
+import queue
 import random
 import threading
 import time
@@ -13,7 +18,7 @@ from asyncio import InvalidStateError
 from concurrent.futures import Future as threading_Future
 from contextlib import AbstractContextManager
 from dataclasses import dataclass
-from typing import Any, Callable, Dict, List, Optional, Sequence, TypeVar, Union
+from typing import Any, Callable, Dict, Iterator, List, Literal, Optional, Sequence, TypeVar, Union
 
 import deepdiff
 import fsspec.core
@@ -37,6 +42,7 @@ from ..data.metrics_monitor import InProgressCacheMetrics, LoggerMetricsMonitor,
 from ..data.sharded_datasource import ShardedDataSource
 from ..utils.fsspec_utils import exists as fsspec_exists
 from ..utils.fsspec_utils import remove as fsspec_remove
+from ..utils.py_utils import logical_cpu_core_count
 from ..utils.ray_utils import ExceptionInfo, SnitchRecipient, current_actor_handle, log_failures_to, ser_exc_info
 from .jagged_array import JaggedArrayStore, PreparedBatch
 from .tree_store import TreeStore
@@ -74,6 +80,23 @@ class CacheOptions:
 
     batch_size: int = 128
 
+    backend: Literal["ray", "local"] = "ray"
+    """Where to build the cache. "ray" uses Ray actors and tasks, so the work can spread across a cluster. "local" uses
+    a process pool on this machine and doesn't need Ray at all."""
+
+    num_local_workers: Optional[int] = None
+    """Number of worker processes for the "local" backend. Defaults to the number of cores divided by the processor's
+    num_cpus."""
+
+    virtual_concat: bool = False
+    """If True, shard groups aren't copied into the final cache once they're tokenized. Instead, the ledger lists them,
+    and readers see the concatenation of the groups' stores as soon as all of them are done. This skips the copying
+    phase entirely. Use [[consolidate_cache]] to copy them in later if you want a single store."""
+
+    def __post_init__(self):
+        if self.backend not in ("ray", "local"):
+            raise ValueError(f"Unknown cache backend {self.backend}. Expected 'ray' or 'local'.")
+
     @property
     def target_bytes_per_flush(self):
         if isinstance(self.target_size_per_flush, int):
@@ -112,8 +135,8 @@ def build_or_load_cache(
     options: CacheOptions = CacheOptions.default(),
 ) -> "TreeCache[U]":
     """
-    Produces a sharded cache of the dataset using Ray for distributed processing. The cache can be any path
-    on any file system understood by fsspec.
+    Produces a sharded cache of the dataset using Ray for distributed processing (or a local process pool, if
+    `options.backend` is "local"). The cache can be any path on any file system understood by fsspec.
 
     This system is designed with tokenization and similar processes in mind, but it can potentially be used for any kind
     of preprocessing that converts input batches to output batches. The main design goal is to make it easy to
@@ -170,7 +193,7 @@ def build_or_load_cache(
 
 class TreeCache(AsyncDataset[T_co]):
     ledger: Optional["CacheLedger"]
-    _builder: Optional[ActorHandle]  # handle of _TreeStoreCacheBuilder
+    _builder: Optional[Union[ActorHandle, "_LocalCacheBuilder"]]  # handle of _TreeStoreCacheBuilder
     # monitor_thread waits for new metrics and also periodically reloads the cache
     _monitor_thread: Optional[threading.Thread]
     _metrics_monitors: List[MetricsMonitor]
@@ -180,7 +203,7 @@ class TreeCache(AsyncDataset[T_co]):
         cache_dir: str,
         exemplar: T_co,
         ledger: Optional["CacheLedger"],
-        _broker,  # handle of _TreeStoreCacheBuilder
+        _broker,  # handle of _TreeStoreCacheBuilder, or a _LocalCacheBuilder
     ):
         super().__init__()
         self.cache_dir = cache_dir
@@ -193,6 +216,8 @@ class TreeCache(AsyncDataset[T_co]):
         name = os.path.join(*cache_dir.split("/")[-2:])
         self.logger = pylogging.getLogger(f"TreeCache.{name}")
         self._store_future: threading_Future[TreeStore] = threading_Future()
+        # set once we've (re)opened the store knowing the cache is finished. After that, we never poll the builder.
+        self._store_is_final = False
         self._stop = False
         # assert _broker is None
 
@@ -200,7 +225,7 @@ class TreeCache(AsyncDataset[T_co]):
             self._monitor_thread = threading.Thread(target=self._monitor_metrics, daemon=True)
             self._monitor_thread.start()
         else:
-            self._attempt_to_load_store(cache_metadata=True)
+            self._load_final_store()
             assert self._store_future.done()
 
     @property
@@ -225,7 +250,7 @@ class TreeCache(AsyncDataset[T_co]):
         return len(self.store)
 
     async def final_length_is_known(self) -> bool:
-        return self.ledger is not None and self.ledger.is_finished
+        return self._store_is_final or (self.ledger is not None and self.ledger.is_finished)
 
     def is_finite(self) -> bool:
         return True
@@ -249,9 +274,17 @@ class TreeCache(AsyncDataset[T_co]):
         return await self.store.get_batch(indices)
 
     async def _wait_for_len(self, needed_len: int):
-        if self._builder is not None:
+        if self._builder is not None and not self._store_is_final:
+            builder = self._builder
             while needed_len > await self.current_len():
-                new_ledger: CacheLedger = await self._builder.updated_ledger.remote()
+                if isinstance(builder, _LocalCacheBuilder):
+                    new_ledger = await asyncio.to_thread(builder.wait_for_updated_ledger)
+                else:
+                    new_ledger = await builder.updated_ledger.remote()
+
+                if new_ledger.is_finished:
+                    # with virtual groups, rows past the first group are only readable from the final store
+                    self._load_final_store()
 
                 if needed_len <= new_ledger.total_num_rows:
                     break
@@ -269,18 +302,24 @@ class TreeCache(AsyncDataset[T_co]):
     def _wait_for_len_sync(self, needed_len, timeout: Optional[float] = None):
         time_in = time.time()
         t_max = time_in + (timeout or 1e6)
-        if self._builder is not None:
+        if self._builder is not None and not self._store_is_final:
+            builder = self._builder
             while needed_len > len(self.store):
                 cur_time = time.time()
                 if cur_time > t_max:
                     raise TimeoutError(f"Timed out waiting for cache to reach {needed_len}")
                 try:
-                    new_ledger: CacheLedger = ray.get(
-                        self._builder.updated_ledger.remote(), timeout=max(t_max - cur_time, 10)
-                    )
+                    if isinstance(builder, _LocalCacheBuilder):
+                        new_ledger = builder.wait_for_updated_ledger(timeout=max(t_max - cur_time, 10))
+                    else:
+                        new_ledger = ray.get(builder.updated_ledger.remote(), timeout=max(t_max - cur_time, 10))
                 except TimeoutError:
                     continue
 
+                if new_ledger.is_finished:
+                    # with virtual groups, rows past the first group are only readable from the final store
+                    self._load_final_store()
+
                 if needed_len <= new_ledger.total_num_rows:
                     break
 
@@ -322,18 +361,27 @@ class TreeCache(AsyncDataset[T_co]):
             return TreeCache.load(cache_dir, processor.output_exemplar, metadata)
         except FileNotFoundError:
             logger.info(f"Cache not found at {cache_dir}. Building.")
-            broker = _get_builder_actor(
-                cache_dir=cache_dir,
-                shard_source=shard_source,
-                processor=processor,
-                options=options,
-            )
+            broker: ActorHandle | _LocalCacheBuilder
+            if options.backend == "local":
+                broker = _LocalCacheBuilder(cache_dir, shard_source, processor, options)
+            else:
+                broker = _get_builder_actor(
+                    cache_dir=cache_dir,
+                    shard_source=shard_source,
+                    processor=processor,
+                    options=options,
+                )
             return TreeCache(cache_dir=cache_dir, exemplar=processor.output_exemplar, ledger=None, _broker=broker)
 
     def finished_sentinel(self):
-        """Returns a Ray-awaitable object that will be set when the cache is finished"""
+        """
+        Returns a Ray-awaitable object that will be set when the cache is finished. For caches built with the local
+        backend, this is a concurrent.futures.Future instead.
+        """
         if self._builder is None:
             return ray.remote(num_cpus=0)(lambda: None).remote()
+        elif isinstance(self._builder, _LocalCacheBuilder):
+            return self._builder.finished_sentinel()
         else:
             return self._builder.finished_sentinel.remote()
 
@@ -395,29 +443,74 @@ class TreeCache(AsyncDataset[T_co]):
     def await_finished(self, timeout: Optional[float] = None, await_cleanup: bool = False):
         if self._builder is None:
             return
-        x = ray.get(self.finished_sentinel(), timeout=timeout)
-        if await_cleanup:
-            ray.get(self._builder.await_cleanup.remote(), timeout=timeout)
-        self._attempt_to_load_store(cache_metadata=False)
+        if isinstance(self._builder, _LocalCacheBuilder):
+            x = self._builder.finished_sentinel().result(timeout=timeout)
+            if await_cleanup:
+                self._builder.await_cleanup(timeout=timeout)
+        else:
+            x = ray.get(self.finished_sentinel(), timeout=timeout)
+            if await_cleanup:
+                ray.get(self._builder.await_cleanup.remote(), timeout=timeout)
+        self._load_final_store()
         return x
 
     async def finished(self):
         if self._builder is None:
             return
-        x = await self.finished_sentinel()
+        if isinstance(self._builder, _LocalCacheBuilder):
+            x = await asyncio.wrap_future(self._builder.finished_sentinel())
+        else:
+            x = await self.finished_sentinel()
         # TODO: make an async version of this
-        self._attempt_to_load_store(cache_metadata=False)
+        self._load_final_store()
         return x
 
-    def _attempt_to_load_store(self, cache_metadata):
+    def _load_final_store(self):
+        """
+        Opens the store for a finished cache. A finished cache can't change, so its offsets are kept in memory
+        and lengths and row bounds are answered without going to tensorstore.
+        """
+        if self._store_is_final:
+            return
+
+        ledger = self.ledger if self.ledger is not None and self.ledger.is_finished else _try_load(self.cache_dir)
+
+        if ledger is not None and ledger.virtual_groups:
+            store = _open_virtually_concatenated_store(self._exemplar, self.cache_dir, ledger)
+            new_future: threading_Future[TreeStore] = threading_Future()
+            new_future.set_result(store)
+            self._store_future = new_future
+        elif not self._store_future.done():
+            self._attempt_to_load_store(cache_metadata=True, in_memory_metadata=True)
+        elif self.store.path == self.cache_dir:
+            # we opened the store while the cache was being built. Reopen it now that it's final
+            store = TreeStore.open(
+                self._exemplar, self.cache_dir, mode="r", cache_metadata=True, in_memory_metadata=True
+            )
+            new_future = threading_Future()
+            new_future.set_result(store)
+            self._store_future = new_future
+
+        self._store_is_final = True
+
+    def _attempt_to_load_store(self, cache_metadata, in_memory_metadata=False):
         if self._store_future.done():
             return
 
         try:
-            store = TreeStore.open(self._exemplar, self.cache_dir, mode="r", cache_metadata=cache_metadata)
+            store = TreeStore.open(
+                self._exemplar,
+                self.cache_dir,
+                mode="r",
+                cache_metadata=cache_metadata,
+                in_memory_metadata=in_memory_metadata,
+            )
         except FileNotFoundError:
             assert self._builder is not None
-            ledger = ray.get(self._builder.current_ledger.remote())
+            if isinstance(self._builder, _LocalCacheBuilder):
+                ledger = self._builder.current_ledger()
+            else:
+                ledger = ray.get(self._builder.current_ledger.remote())
             metrics = _ledger_to_metrics(ledger)
             if metrics.rows_finished == 0 and metrics.is_finished:
                 # this means we built an empty cache. go with it
@@ -442,8 +535,11 @@ class TreeCache(AsyncDataset[T_co]):
         while not self._stop:
             try:
                 try:
-                    # it's better to let the Ray actor handle the timeout
-                    ledger_or_timeout = ray.get(self._builder.updated_ledger.remote(timeout=4.0), timeout=10.0)
+                    if isinstance(self._builder, _LocalCacheBuilder):
+                        ledger_or_timeout = self._builder.updated_ledger(timeout=4.0)
+                    else:
+                        # it's better to let the Ray actor handle the timeout
+                        ledger_or_timeout = ray.get(self._builder.updated_ledger.remote(timeout=4.0), timeout=10.0)
                     if isinstance(ledger_or_timeout, Exception):
                         raise ledger_or_timeout
                     self.ledger = ledger_or_timeout
@@ -483,6 +579,12 @@ class CacheLedger:
     finished_shards: List[str] = dataclasses.field(default_factory=list)
     field_counts: Dict[str, int] = dataclasses.field(default_factory=dict)
     metadata: "CacheMetadata" = dataclasses.field(default_factory=lambda: CacheMetadata({}))
+    # for partially processed shards whose source supports it, the byte offset of row shard_rows[shard] in the shard.
+    # lets us seek straight to where we left off when resuming.
+    shard_byte_offsets: Dict[str, int] = dataclasses.field(default_factory=dict)
+    # shard group caches (relative to the cache dir) whose rows come after this cache's own rows.
+    # See CacheOptions.virtual_concat
+    virtual_groups: List[str] = dataclasses.field(default_factory=list)
 
     @staticmethod
     def load_or_initialize(cache_dir: str, source: ShardedDataSource, processor: BatchProcessor):
@@ -745,17 +847,7 @@ class _TreeStoreCacheBuilder(SnitchRecipient):
         """
         Called by the cache writer when it has updated the ledger.
         """
-        was_finished = self._ledger.is_finished
-        # ensure the ledger is "monotonic" meaning that we only expect it to grow
-        if ledger.total_num_rows < self._ledger.total_num_rows:
-            raise RuntimeError(f"Ledger went backwards: {ledger.total_num_rows} < {self._ledger.total_num_rows}")
-
-        for shard, rows in ledger.shard_rows.items():
-            if rows < self._ledger.shard_rows.get(shard, 0):
-                raise RuntimeError(f"Shard {shard} went backwards: {rows} < {self._ledger.shard_rows.get(shard, 0)}")
-
-        if was_finished:
-            raise RuntimeError("Ledger was already finished")
+        _check_ledger_update(self._ledger, ledger)
 
         self._ledger = ledger
         if self._ledger.is_finished:
@@ -826,6 +918,375 @@ def _get_builder_actor(cache_dir, shard_source, processor, options=CacheOptions.
     )
 
 
+def _check_ledger_update(old: CacheLedger, new: CacheLedger):
+    # ensure the ledger is "monotonic" meaning that we only expect it to grow
+    if new.total_num_rows < old.total_num_rows:
+        raise RuntimeError(f"Ledger went backwards: {new.total_num_rows} < {old.total_num_rows}")
+
+    for shard, rows in new.shard_rows.items():
+        if rows < old.shard_rows.get(shard, 0):
+            raise RuntimeError(f"Shard {shard} went backwards: {rows} < {old.shard_rows.get(shard, 0)}")
+
+    if old.is_finished:
+        raise RuntimeError("Ledger was already finished")
+
+
+class _LocalCacheBuilder:
+    """
+    Builds a cache on this machine without Ray. This is the "local" counterpart of [[_TreeStoreCacheBuilder]] and
+    [[_core_writer_task]]: shards are assigned to groups the same way, each group is tokenized by
+    [[_tokenize_one_shard_group]] (here in a process pool), the first group is written directly to the output cache
+    so that its rows are exposed as they're written, and the other groups are copied over in order as they finish.
+    Resuming works the same way too, since it's all driven by the ledgers on disk.
+
+    Unlike the Ray actor, the builder lives in a thread in this process and isn't shared between TreeCaches.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        source: ShardedDataSource[T],
+        processor: BatchProcessor[T, U],
+        options: CacheOptions,
+    ):
+        self._cache_dir = cache_dir
+        self.source = source
+        self._processor = processor
+        self._options = options
+        self._condition = threading.Condition()
+        # bumped on every ledger update, so that waiters can tell an update from a timeout
+        self._ledger_version = 0
+        self._finished_promise: threading_Future[None] = threading_Future()
+        self._thread: Optional[threading.Thread] = None
+
+        path_for_name = os.path.join(*self._cache_dir.split("/")[-2:])
+        self.logger = pylogging.getLogger(f"local_builder::{path_for_name}")
+
+        self._ledger = CacheLedger.load_or_initialize(cache_dir, source, processor)
+        if self._ledger.is_finished:
+            self.logger.info("Cache already finished. Nothing to do.")
+            self._finished_promise.set_result(None)
+            return
+
+        self._tokenize_pbar = tqdm(total=len(source.shard_names), desc=f"{path_for_name}: tokenizing", unit="shard")
+        self._copy_pbar = tqdm(total=len(source.shard_names), desc=f"{path_for_name}: copying", unit="shard")
+
+        self._thread = threading.Thread(target=self._run, name=f"cache_builder::{path_for_name}", daemon=True)
+        self._thread.start()
+
+    def current_ledger(self) -> CacheLedger:
+        if self.failed():
+            raise self._finished_promise.exception()  # type: ignore
+        return self._ledger
+
+    def is_finished(self):
+        if self.failed():
+            return False
+        return self._ledger.is_finished
+
+    def failed(self):
+        return self._finished_promise.done() and self._finished_promise.exception() is not None
+
+    def finished_sentinel(self) -> threading_Future[None]:
+        return self._finished_promise
+
+    def await_cleanup(self, timeout: Optional[float] = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                raise TimeoutError("Timed out waiting for cache builder to clean up")
+
+    def updated_ledger(self, timeout: Optional[float] = None) -> CacheLedger | TimeoutError:
+        """
+        Same contract as [[_TreeStoreCacheBuilder.updated_ledger]]: we **return** a timeout error.
+        """
+        with self._condition:
+            if not self._finished_promise.done():
+                version = self._ledger_version
+                updated = self._condition.wait_for(
+                    lambda: self._ledger_version != version or self._finished_promise.done(), timeout
+                )
+                if not updated:
+                    return TimeoutError("Timed out waiting for cache to update")
+
+            return self.current_ledger()
+
+    def wait_for_updated_ledger(self, timeout: Optional[float] = None) -> CacheLedger:
+        """Like [[updated_ledger]] but raises TimeoutError"""
+        ledger = self.updated_ledger(timeout)
+        if isinstance(ledger, TimeoutError):
+            raise ledger
+        return ledger
+
+    def _notify_updated_ledger(self, ledger: CacheLedger):
+        with self._condition:
+            _check_ledger_update(self._ledger, ledger)
+            self._ledger = ledger
+            self._ledger_version += 1
+            if self._ledger.is_finished:
+                self.logger.info(f"Finalizing cache {self._cache_dir}...")
+                self._finished_promise.set_result(None)
+            self._condition.notify_all()
+
+    def _run(self):
+        try:
+            self._build()
+        except Exception as e:
+            self.logger.exception("Local cache builder failed")
+            with self._condition:
+                if not self._finished_promise.done():
+                    self._finished_promise.set_exception(e)
+                self._condition.notify_all()
+
+    def _build(self):
+        cache_dir = self._cache_dir
+        source = self.source
+        processor = self._processor
+        options = self._options
+
+        if len(source.shard_names) == 0:
+            self.logger.info("No shards to process. Writing empty ledger.")
+            ledger = CacheLedger.load_or_initialize(cache_dir, source, processor)
+            ledger.is_finished = True
+            ledger._serialize_and_commit(cache_dir)
+            self._notify_updated_ledger(ledger)
+            return
+
+        group_caches_path = _group_caches_path(cache_dir, options)
+        shard_groups = _assign_shards_to_groups(source, options.num_shard_groups)
+        first_group = next(iter(shard_groups))
+
+        num_workers = options.num_local_workers
+        if num_workers is None:
+            num_workers = max(1, logical_cpu_core_count() // max(processor.num_cpus, 1))
+        num_workers = min(num_workers, len(shard_groups))
+
+        self.logger.debug(
+            f"Tokenizing {len(source.shard_names)} shards in {len(shard_groups)} groups with {num_workers} processes."
+        )
+
+        # spawn, not fork: the parent has usually already initialized JAX and started threads
+        mp_context = multiprocessing.get_context("spawn")
+        pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=mp_context,
+            initializer=_init_local_cache_worker,
+            initargs=(source, processor),
+        )
+        # if anything fails, don't wait for the other groups to finish before reporting it
+        with mp_context.Manager() as manager, _shutdown_without_waiting(pool):
+            # workers send (report, ledger) pairs back here. The ledger is only sent for the first group.
+            reports = manager.Queue()
+
+            group_cache_paths: dict[str, str] = {}
+            group_ledgers: dict[str, CacheLedger | None] = {}
+            tokenize_futures: dict[str, threading_Future[CacheLedger]] = {}
+
+            for group_name, group_shards in shard_groups.items():
+                if group_name == first_group:
+                    group_cache_path = cache_dir
+                else:
+                    group_cache_path = os.path.join(group_caches_path, group_name)
+
+                group_cache_paths[group_name] = group_cache_path
+
+                ledger = _try_load(group_cache_path)
+                group_ledgers[group_name] = ledger
+
+                if ledger is not None:
+                    if group_name == first_group:
+                        self._notify_updated_ledger(ledger)
+                    continue
+
+                tokenize_futures[group_name] = pool.submit(
+                    _tokenize_one_shard_group_in_local_worker,
+                    group_cache_path=group_cache_path,
+                    shards=list(group_shards),
+                    options=options,
+                    report_fn=functools.partial(_queue_progress_report, reports, group_name == first_group),
+                    # don't finalize the first group b/c we write it directly to the output cache
+                    force_unfinalized=group_name == first_group,
+                )
+
+            def await_group(group) -> CacheLedger:
+                if group in tokenize_futures:
+                    group_ledgers[group] = self._await_group(tokenize_futures.pop(group), reports)
+                ledger = group_ledgers[group]
+                assert ledger is not None
+                return ledger
+
+            self.logger.info(f"Waiting for first group {first_group} to finish")
+            overall_ledger = await_group(first_group)
+
+            if options.virtual_concat:
+                self.logger.info(f"First group {first_group} finished. Concatenating other groups once they're done.")
+                overall_ledger = _concatenate_groups_virtually(
+                    cache_dir, shard_groups, first_group, group_cache_paths, await_group
+                )
+            else:
+                self.logger.info(f"First group {first_group} finished. Copying other groups into permanent cache.")
+                overall_ledger = self._copy_groups_to_final_cache(
+                    overall_ledger, shard_groups, first_group, group_cache_paths, await_group
+                )
+
+            overall_ledger = copy.deepcopy(overall_ledger)
+            overall_ledger.is_finished = True
+            overall_ledger._serialize_and_commit(cache_dir)
+            self._notify_updated_ledger(overall_ledger)
+
+        if not options.virtual_concat:
+            _clean_up_temp_caches(group_caches_path)
+
+    def _copy_groups_to_final_cache(
+        self,
+        overall_ledger: CacheLedger,
+        shard_groups: dict[str, Sequence[str]],
+        first_group: str,
+        group_cache_paths: dict[str, str],
+        await_group: Callable[[str], CacheLedger],
+    ) -> CacheLedger:
+        """
+        This is the same bookkeeping as [[_copy_temp_caches_to_final_cache]], except that we copy each group as soon as
+        it (and all groups before it) are done, overlapping the copy with tokenization of later groups.
+        """
+        cache_dir = self._cache_dir
+        exemplar = self._processor.output_exemplar
+
+        permanent_cache = TreeStore.open(exemplar, cache_dir, mode="a", cache_metadata=False)
+        data_offset_tree = jax.tree.map(lambda x: x.data_size, permanent_cache.tree)
+        total_rows_from_caches = overall_ledger.total_num_rows
+        self._report_copy_progress(
+            _ProgressReport(new_shards=len(overall_ledger.finished_shards), new_rows=overall_ledger.total_num_rows)
+        )
+
+        found_one_to_copy = False
+
+        for group in shard_groups:
+            if group == first_group:
+                continue
+
+            this_ledger = await_group(group)
+
+            shards_copied = [shard for shard in shard_groups[group] if shard in overall_ledger.finished_shards]
+            if len(shards_copied) == len(shard_groups[group]):
+                assert not found_one_to_copy, f"Found a finished group after an unfinished group: {group}"
+                self.logger.info(f"Group {group} already copied. Skipping.")
+                continue
+            elif len(shards_copied) > 0:
+                raise RuntimeError(
+                    "Some shards were copied but not all. This should never happen."
+                    f"Specifically the following shards were copied: {shards_copied}"
+                    f"And the following shards were not: {set(shard_groups[group]) - set(shards_copied)}"
+                )
+
+            found_one_to_copy = True
+
+            asyncio.run(
+                _extend_cache_with_other_cache(
+                    cache_dir, group_cache_paths[group], exemplar, data_offset_tree, total_rows_from_caches
+                )
+            )
+            asyncio.run(
+                _extend_cache_metadata_with_other(
+                    cache_dir, group_cache_paths[group], exemplar, data_offset_tree, total_rows_from_caches
+                )
+            )
+
+            total_rows_from_caches += this_ledger.total_num_rows
+            this_cache = TreeStore.open(exemplar, group_cache_paths[group], mode="r", cache_metadata=True)
+            data_offset_tree = jax.tree.map(
+                operator.add, data_offset_tree, jax.tree.map(lambda x: x.data_size, this_cache.tree)
+            )
+
+            _expose_available_rows(permanent_cache, total_rows_from_caches)
+            # _merge_ledgers mutates its destination, and we've already handed overall_ledger out to readers
+            overall_ledger = _merge_ledgers(copy.deepcopy(overall_ledger), this_ledger)
+            overall_ledger._serialize_and_commit(cache_dir)
+            self._notify_updated_ledger(overall_ledger)
+            self._report_copy_progress(
+                _ProgressReport(new_shards=len(this_ledger.finished_shards), new_rows=this_ledger.total_num_rows)
+            )
+            self.logger.info(f"Group {group} copied. Updating ledger.")
+
+        return overall_ledger
+
+    def _await_group(self, future: threading_Future[CacheLedger], reports) -> CacheLedger:
+        """Waits for a tokenization task, handling progress reports from all workers while we wait."""
+        while not future.done():
+            try:
+                self._handle_report(*reports.get(timeout=1.0))
+            except queue.Empty:
+                pass
+
+        # the worker enqueued all of its reports before returning, so this gets the rest of them
+        while True:
+            try:
+                self._handle_report(*reports.get_nowait())
+            except queue.Empty:
+                break
+
+        return future.result()
+
+    def _handle_report(self, report: "_ProgressReport", ledger: Optional[CacheLedger]):
+        self._report_progress(report)
+        if ledger is not None:
+            self._notify_updated_ledger(ledger)
+
+    def _report_progress(self, report: "_ProgressReport"):
+        if report.new_shards > 0:
+            self._tokenize_pbar.update(report.new_shards)
+
+    def _report_copy_progress(self, report: "_ProgressReport"):
+        self._copy_pbar.update(report.new_shards)
+
+
+@contextlib.contextmanager
+def _shutdown_without_waiting(pool: concurrent.futures.Executor):
+    try:
+        yield pool
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+# set by _init_local_cache_worker in each of _LocalCacheBuilder's worker processes
+_local_worker_source: Optional[ShardedDataSource] = None
+_local_worker_processor: Optional[BatchProcessor] = None
+
+
+def _init_local_cache_worker(source: ShardedDataSource, processor: BatchProcessor):
+    global _local_worker_source, _local_worker_processor
+    # same as the JAX_PLATFORMS=cpu runtime env we give the Ray tasks
+    jax.config.update("jax_platforms", "cpu")
+    pylogging.basicConfig(format=LOG_FORMAT)
+    logger.setLevel(DEFAULT_LOG_LEVEL)
+    # sent once per worker rather than once per group, since processors can be large (e.g. tokenizers)
+    _local_worker_source = source
+    _local_worker_processor = processor
+
+
+def _tokenize_one_shard_group_in_local_worker(
+    group_cache_path: str,
+    shards: list[str],
+    options: CacheOptions,
+    report_fn: Callable[["_ProgressReport", CacheLedger], None],
+    force_unfinalized: bool,
+) -> CacheLedger:
+    assert _local_worker_source is not None and _local_worker_processor is not None
+    return _tokenize_one_shard_group(
+        group_cache_path,
+        _local_worker_source,
+        shards,
+        _local_worker_processor,
+        options,
+        report_fn,
+        force_unfinalized,
+    )
+
+
+def _queue_progress_report(reports, include_ledger: bool, report: "_ProgressReport", ledger: CacheLedger):
+    reports.put((report, ledger if include_ledger else None))
+
+
 #####
 # Core implementation starts below.
 #####
@@ -881,7 +1342,7 @@ def _core_writer_task(
         ray.get(parent._notify_updated_ledger.remote(ledger))
 
     with log_failures_to(parent):
-        temporary_cache_path = os.path.join(cache_dir, "___temp")
+        group_caches_path = _group_caches_path(cache_dir, options)
 
         group_cache_paths: dict[str, str] = {}
         group_ledgers: dict[str, CacheLedger | None] = {}
@@ -901,7 +1362,7 @@ def _core_writer_task(
             assert len(group) > 0
 
         logger.debug(
-            f"Tokenizing {len(source.shard_names)} shards in {len(shard_groups)} groups to {temporary_cache_path}."
+            f"Tokenizing {len(source.shard_names)} shards in {len(shard_groups)} groups to {group_caches_path}."
         )
 
         processor_ref = ray.put(processor)
@@ -915,7 +1376,7 @@ def _core_writer_task(
             if group_name == first_group:
                 group_cache_path = cache_dir
             else:
-                group_cache_path = os.path.join(temporary_cache_path, group_name)
+                group_cache_path = os.path.join(group_caches_path, group_name)
 
             group_cache_paths[group_name] = group_cache_path
 
@@ -936,7 +1397,7 @@ def _core_writer_task(
                     num_gpus=processor.num_gpus,
                     resources=processor.resources,
                     memory=3 * 1024 * 1024 * 1024,  # made this up
-                    name=f"tokenize::{temporary_cache_path}::{group_name}",
+                    name=f"tokenize::{group_caches_path}::{group_name}",
                     retry_exceptions=True,
                     max_retries=10,
                 )
@@ -959,29 +1420,54 @@ def _core_writer_task(
             logger.info(f"Waiting for first group {first_group} to finish")
             ray.get(write_refs[first_group])
 
-        logger.info(f"First group {first_group} finished. Copying other groups into permanent cache.")
+        if options.virtual_concat:
+            # empty sources returned early above, so there's always a first group
+            assert first_group is not None
+            logger.info(f"First group {first_group} finished. Concatenating other groups once they're done.")
 
-        ledger = _copy_temp_caches_to_final_cache(
-            parent,
-            cache_dir,
-            shard_groups,
-            first_group,
-            write_refs,
-            group_ledgers,
-            group_cache_paths,
-            processor,
-            processor_ref,
-        )
+            def await_group(group):
+                if write_refs.get(group) is not None:
+                    group_ledgers[group] = ray.get(write_refs[group])
+                return group_ledgers[group]
+
+            ledger = _concatenate_groups_virtually(
+                cache_dir, shard_groups, first_group, group_cache_paths, await_group
+            )
+        else:
+            logger.info(f"First group {first_group} finished. Copying other groups into permanent cache.")
+
+            ledger = _copy_temp_caches_to_final_cache(
+                parent,
+                cache_dir,
+                shard_groups,
+                first_group,
+                write_refs,
+                group_ledgers,
+                group_cache_paths,
+                processor,
+                processor_ref,
+            )
 
         ledger.is_finished = True
         ledger._serialize_and_commit(cache_dir)
         ray.get(parent._notify_updated_ledger.remote(ledger))
 
-        _clean_up_temp_caches(temporary_cache_path)
+        if not options.virtual_concat:
+            _clean_up_temp_caches(group_caches_path)
         # Fire and forget
         parent._notify_cleanup_finished.remote()
 
 
+def _group_caches_path(cache_dir: str, options: CacheOptions) -> str:
+    """
+    Where the caches of the shard groups after the first one are built. Usually they're temporary and deleted once
+    they've been copied into the cache, but with `virtual_concat` they are part of the finished cache.
+    """
+    if options.virtual_concat:
+        return os.path.join(cache_dir, "___groups")
+    return os.path.join(cache_dir, "___temp")
+
+
 def _clean_up_temp_caches(path):
     logger.info(f"Cleaning up temporary cache at {path}")
     if fsspec_exists(path):
@@ -1188,6 +1674,123 @@ def _copy_temp_caches_to_final_cache(
     return overall_ledger
 
 
+def _concatenate_groups_virtually(
+    cache_dir: str,
+    shard_groups: dict[str, Sequence[str]],
+    first_group: str,
+    group_cache_paths: dict[str, str],
+    await_group: Callable[[str], CacheLedger],
+) -> CacheLedger:
+    """
+    The alternative to copying the temporary caches into the output cache (see CacheOptions.virtual_concat): we record
+    the groups in the ledger's `virtual_groups`, and readers see the concatenation of all of the groups' stores.
+    Groups that have already been copied (by an earlier run that wasn't virtual) are left as is.
+
+    Args:
+        await_group: blocks until the given group is tokenized and returns its ledger
+
+    Returns:
+        The final ledger (not yet marked finished)
+    """
+    overall_ledger = copy.deepcopy(await_group(first_group))
+
+    for group in shard_groups:
+        if group == first_group:
+            continue
+
+        this_ledger = await_group(group)
+
+        if all(shard in overall_ledger.finished_shards for shard in shard_groups[group]):
+            logger.info(f"Group {group} already copied. Skipping.")
+            continue
+
+        _merge_ledgers(overall_ledger, this_ledger)
+        group_path = group_cache_paths[group]
+        assert group_path.startswith(cache_dir), f"{group_path} is not in {cache_dir}"
+        overall_ledger.virtual_groups.append(group_path[len(cache_dir) :].lstrip("/"))
+
+    return overall_ledger
+
+
+def consolidate_cache(cache_dir: str, exemplar, *, delete_groups: bool = True) -> CacheLedger:
+    """
+    Copies the shard groups of a cache built with `CacheOptions.virtual_concat` into the cache's own store, so that it
+    doesn't need them anymore. The data of all groups is copied in parallel.
+
+    This is safe to run (e.g. in the background) while the cache is in use: readers that open the cache afterward
+    read the consolidated store. However, if `delete_groups` is set, readers that opened the cache *before* this
+    finished will fail when they try to read from the deleted groups.
+
+    Returns:
+        The updated ledger
+    """
+    ledger = CacheLedger.load(cache_dir)
+    if not ledger.is_finished:
+        raise ValueError(f"Cache at {cache_dir} isn't finished, so it can't be consolidated")
+
+    if not ledger.virtual_groups:
+        logger.info(f"Cache at {cache_dir} has no virtual groups. Nothing to consolidate.")
+        return ledger
+
+    group_paths = [os.path.join(cache_dir, group) for group in ledger.virtual_groups]
+    permanent_cache = TreeStore.open(exemplar, cache_dir, mode="a", cache_metadata=False)
+
+    # if we crashed after exposing the rows but before committing the ledger, the data is already there
+    if len(permanent_cache) < ledger.total_num_rows:
+        data_offset_tree = jax.tree.map(lambda x: x.data_size, permanent_cache.tree)
+        total_rows = len(permanent_cache)
+        copy_args = []
+        for group_path in group_paths:
+            group_cache = TreeStore.open(exemplar, group_path, mode="r", cache_metadata=True)
+            copy_args.append((group_path, data_offset_tree, total_rows))
+            data_offset_tree = jax.tree.map(
+                operator.add, data_offset_tree, jax.tree.map(lambda x: x.data_size, group_cache.tree)
+            )
+            total_rows += len(group_cache)
+
+        if total_rows != ledger.total_num_rows:
+            raise ValueError(
+                f"Cache at {cache_dir} has {total_rows} rows, but its ledger says {ledger.total_num_rows}"
+            )
+
+        async def _copy_all():
+            await asyncio.gather(
+                *(
+                    _extend_cache_with_other_cache(cache_dir, group_path, exemplar, data_offsets, rows)
+                    for group_path, data_offsets, rows in copy_args
+                )
+            )
+            # metadata goes one group at a time: concurrent writes to the same offsets chunks cause lots of retries
+            for group_path, data_offsets, rows in copy_args:
+                await _extend_cache_metadata_with_other(cache_dir, group_path, exemplar, data_offsets, rows)
+
+        asyncio.run(_copy_all())
+        _expose_available_rows(permanent_cache, total_rows)
+
+    ledger.virtual_groups = []
+    ledger._serialize_and_commit(cache_dir)
+
+    if delete_groups:
+        for group_path in group_paths:
+            _clean_up_temp_caches(group_path)
+
+    return ledger
+
+
+def _open_virtually_concatenated_store(exemplar, cache_dir: str, ledger: CacheLedger) -> TreeStore:
+    """Opens a finished cache whose ledger has virtual groups. See CacheOptions.virtual_concat."""
+    store = TreeStore.open(exemplar, cache_dir, mode="r", cache_metadata=True, in_memory_metadata=True)
+    if len(store) >= ledger.total_num_rows:
+        # consolidate_cache copied the groups in, but didn't get to update the ledger
+        return store
+
+    group_stores = [
+        TreeStore.open(exemplar, os.path.join(cache_dir, group), mode="r", cache_metadata=True)
+        for group in ledger.virtual_groups
+    ]
+    return TreeStore.concat([store, *group_stores])
+
+
 def _expose_available_rows(permanent_cache, num_available_rows):
     """
     Updates the permanent cache to expose the available rows. This is done by updating the offsets[0] of the
@@ -1218,7 +1821,11 @@ def _copy_cache_data(dest_path, source_path, processor, data_offset_tree, rows_s
         rows_so_far: The total number of rows in the destination cache before this copy.
     """
     with log_failures_to(parent):
-        asyncio.run(_extend_cache_with_other_cache(dest_path, source_path, processor, data_offset_tree, rows_so_far))
+        asyncio.run(
+            _extend_cache_with_other_cache(
+                dest_path, source_path, processor.output_exemplar, data_offset_tree, rows_so_far
+            )
+        )
 
 
 @ray.remote(
@@ -1250,12 +1857,14 @@ class _MetadataCopier:
         """
         with log_failures_to(self.parent):
             asyncio.run(
-                _extend_cache_metadata_with_other(dest_path, source_path, processor, data_offset_tree, rows_so_far)
+                _extend_cache_metadata_with_other(
+                    dest_path, source_path, processor.output_exemplar, data_offset_tree, rows_so_far
+                )
             )
 
 
 async def _extend_cache_with_other_cache(
-    dest_path: str, source_path: str, processor: BatchProcessor, data_offset_tree: PyTree[int], row_offset
+    dest_path: str, source_path: str, exemplar, data_offset_tree: PyTree[int], row_offset
 ) -> int:
     """
     Copies the data from one cache to another, appending it to the end of the destination cache.
@@ -1267,8 +1876,8 @@ async def _extend_cache_with_other_cache(
     try:
 
         logger.info(f"Copying data from {source_path} to {dest_path}.")
-        dest = TreeStore.open(processor.output_exemplar, dest_path, mode="a", cache_metadata=False)
-        source = TreeStore.open(processor.output_exemplar, source_path, mode="r", cache_metadata=True)
+        dest = TreeStore.open(exemplar, dest_path, mode="a", cache_metadata=False)
+        source = TreeStore.open(exemplar, source_path, mode="r", cache_metadata=True)
 
         source_num_rows = await source.async_len()
 
@@ -1278,8 +1887,8 @@ async def _extend_cache_with_other_cache(
             data_size = source_array.data_size
             data = source_array.data
 
-            # To prevent OOM, copy in smaller batches
-            MAX_ELEMS = 1024 * 1024 * 1024
+            # To prevent OOM, copy in smaller batches. Up to 4 of these are in flight at once.
+            MAX_ELEMS = 128 * 1024 * 1024
             await _copy_in_batches(dest_array.data, data_offset, data, data_size, MAX_ELEMS)
 
         futures = jax.tree.map(_copy_one_array, dest.tree, source.tree, data_offset_tree)
@@ -1293,37 +1902,55 @@ async def _extend_cache_with_other_cache(
         raise
 
 
-async def _copy_in_batches(dest_array, dest_offset, src_array, src_len, elems_per_batch):
+async def _copy_in_batches(dest_array, dest_offset, src_array, src_len, elems_per_batch, max_concurrent_batches=4):
     """
-    Copies the data from one array to another in batches.
+    Copies the data from one array to another in batches, with up to `max_concurrent_batches` batches in flight.
+    Batches are cut at multiples of the destination's write chunk size, so no two batches write to the same chunk.
     """
-    last_future: ts.Future | None = None
-    start = 0
-    out_start = dest_offset
-    while start < src_len:
-        if last_future is not None:
-            await last_future
-        async with ts.Transaction() as txn:
-            num_to_copy = min(elems_per_batch, src_len - start)
-            end = start + num_to_copy
-            out_end = out_start + num_to_copy
+    if src_len == 0:
+        return
+
+    chunk_size = _write_chunk_size(dest_array)
+    elems_per_batch = max(chunk_size, elems_per_batch // chunk_size * chunk_size)
+
+    # batch boundaries, in destination coordinates
+    dest_end = dest_offset + src_len
+    first_boundary = (dest_offset // elems_per_batch + 1) * elems_per_batch
+    boundaries = [dest_offset, *range(first_boundary, dest_end, elems_per_batch), dest_end]
+
+    semaphore = asyncio.Semaphore(max_concurrent_batches)
+
+    async def _copy_batch(out_start, out_end):
+        async with semaphore:
+            start = out_start - dest_offset
+            end = out_end - dest_offset
+            async with ts.Transaction() as txn:
+                future = dest_array.with_transaction(txn)[out_start:out_end].write(src_array[start:end])
+            await future
+
+    await asyncio.gather(*(_copy_batch(a, b) for a, b in zip(boundaries[:-1], boundaries[1:])))
 
-            last_future = dest_array.with_transaction(txn)[out_start:out_end].write(src_array[start:end])
-            start += num_to_copy
-            out_start += num_to_copy
 
-    if last_future is not None:
-        await last_future
+def _write_chunk_size(array: ts.TensorStore) -> int:
+    try:
+        chunk_shape = array.chunk_layout.write_chunk.shape
+    except (AttributeError, ValueError):
+        chunk_shape = None
+
+    if not chunk_shape or not chunk_shape[0]:
+        return 1
+
+    return int(chunk_shape[0])
 
 
 async def _extend_cache_metadata_with_other(
-    dest_path: str, source_path: str, processor: BatchProcessor, data_offset_tree: PyTree[int], row_offset
+    dest_path: str, source_path: str, exemplar, data_offset_tree: PyTree[int], row_offset
 ) -> int:
     """Copies just the offsets and shapes (if present)"""
     try:
         logger.info(f"Copying metadata from {source_path} to {dest_path}.")
-        dest = TreeStore.open(processor.output_exemplar, dest_path, mode="a")
-        source = TreeStore.open(processor.output_exemplar, source_path, mode="r", cache_metadata=True)
+        dest = TreeStore.open(exemplar, dest_path, mode="a")
+        source = TreeStore.open(exemplar, source_path, mode="r", cache_metadata=True)
 
         source_num_rows = await source.async_len()
 
@@ -1448,15 +2075,35 @@ def _tokenize_one_shard_group(
             report_fn(_ProgressReport(new_rows=rows_this_shard), ledger)
             found_shard_with_rows = True
 
-        shard_iterator = source.open_shard_at_row(shard_name, rows_this_shard)
+        byte_offset = 0 if rows_this_shard == 0 else ledger.shard_byte_offsets.get(shard_name)
+        next_byte_offset: list[Optional[int]] = [None]  # byte offset of the row after the last one we've read
+        # columnar sources + processors skip building a dict per row entirely
+        columnar = processor.supports_record_batches and source.supports_record_batches(shard_name)
+
+        if byte_offset is not None and source.supports_byte_offsets(shard_name):
+            if rows_this_shard != 0:
+                logger.info(f"Resuming {shard_name} at row {rows_this_shard} (byte offset {byte_offset}).")
+            next_byte_offset[0] = byte_offset
+            shard_iterator = _track_byte_offsets(
+                source.open_shard_at_byte_offset(shard_name, byte_offset), next_byte_offset
+            )
+            batch_iterator = batched(shard_iterator, options.batch_size)
+            columnar = False
+        elif columnar:
+            batch_iterator = source.open_shard_record_batches_at_row(shard_name, rows_this_shard, options.batch_size)
+        else:
+            batch_iterator = batched(source.open_shard_at_row(shard_name, rows_this_shard), options.batch_size)
 
         prepared_batch: PyTree[PreparedBatch] | None = None
         this_batch_size = 0
 
-        for batch in batched(shard_iterator, options.batch_size):
-            tokenized = processor(batch)
-            tokenized = _canonicalize_batch(tokenized)  # type: ignore
-            this_prepared = writer._tree_store.batch_preparer(tokenized)
+        for batch in batch_iterator:
+            if columnar:
+                this_prepared = processor.process_record_batch(batch)
+            else:
+                tokenized = processor(batch)
+                tokenized = _canonicalize_batch(tokenized)  # type: ignore
+                this_prepared = writer._tree_store.batch_preparer(tokenized)
 
             this_batch_size += len(batch)
             rows_this_shard += len(batch)
@@ -1472,7 +2119,7 @@ def _tokenize_one_shard_group(
             batch_byte_size = sum(prepared_batch.byte_size for prepared_batch in jax.tree.leaves(prepared_batch))
 
             if batch_byte_size > options.target_bytes_per_flush:
-                writer.write_prepared_batch(shard_name, this_batch_size, prepared_batch)
+                writer.write_prepared_batch(shard_name, this_batch_size, prepared_batch, next_byte_offset[0])
                 report_fn(_ProgressReport(new_rows=this_batch_size, new_bytes=batch_byte_size), writer.ledger)
 
                 nice_bytes = humanfriendly.format_size(batch_byte_size)
@@ -1488,7 +2135,7 @@ def _tokenize_one_shard_group(
 
             report_fn(_ProgressReport(new_rows=this_batch_size, new_bytes=batch_byte_size), writer.ledger)
 
-            writer.write_prepared_batch(shard_name, this_batch_size, prepared_batch)
+            writer.write_prepared_batch(shard_name, this_batch_size, prepared_batch, next_byte_offset[0])
             logger.debug(
                 f"Processed {rows_this_shard} rows. Wrote {this_batch_size} rows to {shard_name}. ({nice_bytes})"
             )
@@ -1507,6 +2154,12 @@ def _tokenize_one_shard_group(
     return writer.ledger
 
 
+def _track_byte_offsets(iterator: Iterator[tuple[T, int]], next_byte_offset: list) -> Iterator[T]:
+    for item, offset in iterator:
+        next_byte_offset[0] = offset
+        yield item
+
+
 class ShardGroupCacheWriter:
     """
     Similar to SerialCacheWriter, but tracks shard metadata for one shard.
@@ -1542,9 +2195,16 @@ class ShardGroupCacheWriter:
             raise ValueError(f"Expected {num_rows} rows in finished shard {shard_name}, but found {current_rows}")
 
         self._ledger.finished_shards.append(shard_name)
+        self._ledger.shard_byte_offsets.pop(shard_name, None)
         self._ledger._serialize_and_commit(self.cache_dir)
 
-    def write_prepared_batch(self, shard_name: str, row_count: int, batch: PyTree[PreparedBatch]):
+    def write_prepared_batch(
+        self, shard_name: str, row_count: int, batch: PyTree[PreparedBatch], byte_offset: Optional[int] = None
+    ):
+        """
+        Writes a batch of rows from the given shard. `byte_offset`, if known, is the offset in the shard of the row
+        after this batch, which is recorded in the ledger so we can seek to it when resuming.
+        """
         if self.is_finished:
             raise RuntimeError("Cannot write to a finished cache")
         self._tree_store.extend_with_batch(batch)
@@ -1553,6 +2213,10 @@ class ShardGroupCacheWriter:
             raise ValueError(f"Shard {shard_name} not in tracked shards")
         self._ledger.shard_rows[shard_name] += row_count
         self._ledger.total_num_rows += row_count
+        if byte_offset is not None:
+            self._ledger.shard_byte_offsets[shard_name] = byte_offset
+        else:
+            self._ledger.shard_byte_offsets.pop(shard_name, None)
 
         self._ledger._serialize_and_commit(self.cache_dir)
 
@@ -1579,6 +2243,18 @@ class _RestrictedShardedDataSource(ShardedDataSource):
     def open_shard_at_row(self, shard_name, row):
         return self._source.open_shard_at_row(shard_name, row)
 
+    def supports_byte_offsets(self, shard_name):
+        return self._source.supports_byte_offsets(shard_name)
+
+    def open_shard_at_byte_offset(self, shard_name, byte_offset):
+        return self._source.open_shard_at_byte_offset(shard_name, byte_offset)
+
+    def supports_record_batches(self, shard_name):
+        return self._source.supports_record_batches(shard_name)
+
+    def open_shard_record_batches_at_row(self, shard_name, row, batch_size):
+        return self._source.open_shard_record_batches_at_row(shard_name, row, batch_size)
+
 
 def _randomize_shards(shards: Sequence[T], seed: int) -> list[T]:
     prng = random.Random(seed)
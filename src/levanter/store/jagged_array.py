@@ -1,7 +1,8 @@
 import asyncio
+import itertools
 import os
 from dataclasses import dataclass
-from typing import Optional, Sequence
+from typing import Awaitable, Optional, Sequence
 
 import fsspec.core
 import jax.experimental.array_serialization.serialization as ser
@@ -47,6 +48,16 @@ class PreparedBatch:
         data, offsets, shapes = _prepare_batch(items, item_rank)
         return PreparedBatch(data, offsets, shapes)
 
+    @staticmethod
+    def from_ragged_sequences(rows: Sequence[Sequence], dtype) -> "PreparedBatch":
+        """
+        Builds a rank-1 PreparedBatch from a sequence of variable-length sequences (e.g. lists of token ids) without
+        materializing an array per row.
+        """
+        lengths = np.fromiter((len(row) for row in rows), dtype=np.int64, count=len(rows))
+        data = np.fromiter(itertools.chain.from_iterable(rows), dtype=dtype, count=int(lengths.sum()))
+        return PreparedBatch(data, np.cumsum(lengths), None)
+
     @staticmethod
     def concat(batches: Sequence["PreparedBatch"]) -> "PreparedBatch":
         data = np.concatenate([batch.data for batch in batches])
@@ -101,10 +112,20 @@ class JaggedArrayStore:
     _cache_metadata: bool = False
     _cached_num_rows: Optional[int] = None
     _cached_data_size: Optional[int] = None
+    # if set, offsets (and shapes) are read into memory the first time they're needed. Only for stores that won't change
+    _in_memory_metadata: bool = False
+    _offsets_in_memory: Optional[np.ndarray] = None  # row i spans data[offsets[i]:offsets[i+1]]
+    _shapes_in_memory: Optional[np.ndarray] = None
 
     @staticmethod
     async def open_async(
-        path: Optional[str], *, mode="a", item_rank=1, dtype, cache_metadata: bool = False
+        path: Optional[str],
+        *,
+        mode="a",
+        item_rank=1,
+        dtype,
+        cache_metadata: bool = False,
+        in_memory_metadata: bool = False,
     ) -> "JaggedArrayStore":
         offset_path = _extend_path(path, "offsets")
         cache_settings = {"total_bytes_limit": CACHE_BYTES_LIMIT} if cache_metadata and mode == "r" else {}
@@ -123,11 +144,34 @@ class JaggedArrayStore:
             shapes = None
 
         return JaggedArrayStore(
-            await offsets, await data, await shapes if shapes is not None else None, item_rank, cache_metadata
+            await offsets,
+            await data,
+            await shapes if shapes is not None else None,
+            item_rank,
+            cache_metadata,
+            _in_memory_metadata=in_memory_metadata and mode == "r",
         )
 
     @staticmethod
-    def open(path: Optional[str], *, mode="a", item_rank=1, dtype, cache_metadata: bool = False) -> "JaggedArrayStore":
+    def open(
+        path: Optional[str],
+        *,
+        mode="a",
+        item_rank=1,
+        dtype,
+        cache_metadata: bool = False,
+        in_memory_metadata: bool = False,
+    ) -> "JaggedArrayStore":
+        """
+        Opens a jagged array store.
+
+        Args:
+            cache_metadata: cache the number of rows and data size after they're first read
+            in_memory_metadata: only for read-only stores that are finished (i.e. will not change). Reads the offsets
+                (and shapes) arrays into memory the first time row bounds are needed, after which they're answered
+                without touching tensorstore. Costs 8 bytes per row. The number of rows and data size are cached
+                scalar reads until then.
+        """
         offset_path = _extend_path(path, "offsets")
         cache_settings = {"total_bytes_limit": CACHE_BYTES_LIMIT} if cache_metadata and mode == "r" else {}
         offsets = _ts_open_sync(offset_path, jnp.int64, [1], mode=mode, cache_settings=cache_settings)
@@ -141,22 +185,81 @@ class JaggedArrayStore:
         else:
             shapes = None
 
-        return JaggedArrayStore(offsets, data, shapes, item_rank, cache_metadata)
+        return JaggedArrayStore(
+            offsets, data, shapes, item_rank, cache_metadata, _in_memory_metadata=in_memory_metadata and mode == "r"
+        )
+
+    @staticmethod
+    def concat(stores: Sequence["JaggedArrayStore"]) -> "JaggedArrayStore":
+        """
+        Returns a read-only store whose rows are the rows of `stores`, in order, without copying any data: `data` and
+        `shapes` are tensorstore concatenations of the stores' arrays. The stores shouldn't change after this is
+        called. The offsets of all the stores are read into memory, as with `in_memory_metadata` in [open][].
+        """
+        if len(stores) == 0:
+            raise ValueError("Need at least one store to concatenate")
+
+        item_rank = stores[0].item_rank
+        if any(store.item_rank != item_rank for store in stores):
+            raise ValueError("All stores must have the same item rank")
+
+        # there can be a lot of stores, so get all the reads in flight before waiting on any of them
+        num_rows_reads = [store.offsets[0].read() for store in stores]
+        offsets_reads = [store.offsets[0 : int(n.result()) + 1].read() for store, n in zip(stores, num_rows_reads)]
+
+        bounds: list[np.ndarray] = [np.zeros(1, dtype=np.int64)]
+        row_counts = []
+        data_sizes: list[int] = []
+        for offsets_read in offsets_reads:
+            store_bounds = _offsets_to_bounds(offsets_read.result())
+            bounds.append(store_bounds[1:] + sum(data_sizes))
+            row_counts.append(len(store_bounds) - 1)
+            data_sizes.append(int(store_bounds[-1]))
+
+        all_bounds = np.concatenate(bounds)
+        num_rows = len(all_bounds) - 1
+
+        # offsets[0] is the number of rows
+        offsets = ts.array(np.concatenate([[num_rows], all_bounds[1:]]).astype(np.int64))
+        data = ts.concat([store.data[:size] for store, size in zip(stores, data_sizes)], axis=0)
+        if item_rank > 1:
+            store_shapes = []
+            for store, count in zip(stores, row_counts):
+                assert store.shapes is not None
+                store_shapes.append(store.shapes[:count])
+            shapes = ts.concat(store_shapes, axis=0)
+        else:
+            shapes = None
+
+        return JaggedArrayStore(
+            offsets,
+            data,
+            shapes,
+            item_rank,
+            _cache_metadata=True,
+            _in_memory_metadata=True,
+            _offsets_in_memory=all_bounds,
+        )
 
     @property
     def num_rows(self):
         if self._cached_num_rows is not None:
             return self._cached_num_rows
+        if self._offsets_in_memory is not None:
+            return len(self._offsets_in_memory) - 1
         result = int(self.offsets[0].read().result())
-        if self._cache_metadata:
+        # a store with in-memory metadata is finished, so this can't change
+        if self._cache_metadata or self._in_memory_metadata:
             self._cached_num_rows = result
         return result
 
     async def num_rows_async(self):
         if self._cached_num_rows is not None:
             return self._cached_num_rows
+        if self._offsets_in_memory is not None:
+            return len(self._offsets_in_memory) - 1
         result = int(await self.offsets[0].read())
-        if self._cache_metadata:
+        if self._cache_metadata or self._in_memory_metadata:
             self._cached_num_rows = result
         return result
 
@@ -165,19 +268,53 @@ class JaggedArrayStore:
         # return int(self.offsets[self.num_rows].read().result())
         if self._cached_data_size is not None:
             return self._cached_data_size
+        if self._offsets_in_memory is not None:
+            return int(self._offsets_in_memory[-1])
         result = int(self.offsets[self.num_rows].read().result())
-        if self._cache_metadata:
+        if self._cache_metadata or self._in_memory_metadata:
             self._cached_data_size = result
         return result
 
     async def data_size_async(self):
         if self._cached_data_size is not None:
             return self._cached_data_size
-        result = int(await self.offsets[self.num_rows].read())
-        if self._cache_metadata:
+        if self._offsets_in_memory is not None:
+            return int(self._offsets_in_memory[-1])
+        result = int(await self.offsets[await self.num_rows_async()].read())
+        if self._cache_metadata or self._in_memory_metadata:
             self._cached_data_size = result
         return result
 
+    def _load_offsets(self) -> np.ndarray:
+        if self._offsets_in_memory is None:
+            num_rows = int(self.offsets[0].read().result())
+            self._offsets_in_memory = _offsets_to_bounds(self.offsets[0 : num_rows + 1].read().result())
+        return self._offsets_in_memory
+
+    async def _load_offsets_async(self) -> np.ndarray:
+        if self._offsets_in_memory is None:
+            num_rows = int(await self.offsets[0].read())
+            self._offsets_in_memory = _offsets_to_bounds(await self.offsets[0 : num_rows + 1].read())
+        return self._offsets_in_memory
+
+    def _row_shape(self, item: int) -> np.ndarray:
+        assert self.shapes is not None
+        if self._in_memory_metadata:
+            return self._load_shapes()[item]
+        return np.array(self.shapes[item])
+
+    def _load_shapes(self) -> np.ndarray:
+        assert self.shapes is not None
+        if self._shapes_in_memory is None:
+            self._shapes_in_memory = self.shapes[0 : self.num_rows].read().result()
+        return self._shapes_in_memory
+
+    async def _load_shapes_async(self) -> np.ndarray:
+        assert self.shapes is not None
+        if self._shapes_in_memory is None:
+            self._shapes_in_memory = await self.shapes[0 : await self.num_rows_async()].read()
+        return self._shapes_in_memory
+
     async def append_async(self, data: np.ndarray):
         await self.extend_async([data])
 
@@ -370,7 +507,7 @@ class JaggedArrayStore:
                 data = await self.data[start:stop].read()
 
                 if self.shapes is not None:
-                    shapes = np.array(self.shapes[item])
+                    shapes = self._row_shape(item)
                     data = data.reshape(*shapes, -1)
                 return data
             except ValueError as e:
@@ -381,43 +518,46 @@ class JaggedArrayStore:
                     raise e
 
     async def get_batch(self, indices: Sequence[int]) -> Sequence[np.ndarray]:
-        # get indices
-        all_indices_fut = self._bounds_for_rows_batch_async(indices)
+        if len(indices) == 0:
+            return []
+
+        starts, stops = await self._bounds_for_rows_batch_async(indices)
 
         # shapes, if applicable
+        shapes_fut: Awaitable[np.ndarray]
         if self.shapes is not None:
-            with ts.Batch():
-                shapes_futs = [self.shapes[i].read() for i in indices]
-
-        all_indices = await all_indices_fut
+            if self._in_memory_metadata:
+                shapes_fut = asyncio.ensure_future(self._load_shapes_async())
+            else:
+                shapes_fut = self.shapes.vindex[np.asarray(indices, dtype=np.int64)].read()
 
-        # get data
-        with ts.Batch():
-            data_futs = [self.data[start:stop].read() for start, stop in all_indices]
-
-        data = await asyncio.gather(*data_futs)
+        data = await read_coalesced_ranges(self.data, starts, stops)
 
         if self.shapes is not None:
-            shapes = await asyncio.gather(*shapes_futs)
-
+            shapes = await shapes_fut
+            if self._in_memory_metadata:
+                shapes = shapes[np.asarray(indices, dtype=np.int64)]
             data = [d.reshape(*s, -1) for d, s in zip(data, shapes)]
 
         return data
 
     def get_batch_sync(self, indices: Sequence[int]) -> Sequence[np.ndarray]:
-        all_indices = self._bounds_for_rows_batch(indices)
+        if len(indices) == 0:
+            return []
 
-        with ts.Batch():
-            # shapes, if applicable
-            if self.shapes is not None:
-                shapes_futs = [self.shapes[i].read() for i in indices]
+        starts, stops = self._bounds_for_rows_batch(indices)
 
-            data_futs = [self.data[start:stop].read() for start, stop in all_indices]
+        # shapes, if applicable
+        if self.shapes is not None and not self._in_memory_metadata:
+            shapes_fut = self.shapes.vindex[np.asarray(indices, dtype=np.int64)].read()
 
-        data = [d.result() for d in data_futs]
+        data = read_coalesced_ranges_sync(self.data, starts, stops)
 
         if self.shapes is not None:
-            shapes = [s.result() for s in shapes_futs]  # noqa
+            if self._in_memory_metadata:
+                shapes = self._load_shapes()[np.asarray(indices, dtype=np.int64)]
+            else:
+                shapes = shapes_fut.result()
             data = [d.reshape(*s, -1) for d, s in zip(data, shapes)]
 
         return data
@@ -445,7 +585,7 @@ class JaggedArrayStore:
                 data = self.data[start:stop].read().result()
 
                 if self.shapes is not None:
-                    shapes = np.array(self.shapes[item])
+                    shapes = self._row_shape(item)
                     data = data.reshape(*shapes, -1)
                 return data
             except ValueError as e:
@@ -460,6 +600,10 @@ class JaggedArrayStore:
         if start >= num_rows or stop > num_rows:
             raise IndexError("Index out of bounds")
         start, stop, step = slice(start, stop).indices(num_rows)
+        if self._in_memory_metadata:
+            offsets = self._load_offsets()[start : stop + 1].copy()
+            return offsets[0], offsets[-1], offsets
+
         offsets = self.offsets[start : stop + 1].read().result()
         data_start, data_stop = offsets[0], offsets[-1]
         if start == 0:
@@ -469,63 +613,172 @@ class JaggedArrayStore:
 
         return data_start, data_stop, offsets
 
-    def _bounds_for_rows_batch(self, indices):
-        num_rows = self.num_rows
-        offsets_futs: list = []
+    def _bounds_for_rows_batch(self, indices) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the (starts, stops) of the given rows in `data`, reading all needed offsets in a single request."""
+        if self._in_memory_metadata:
+            offsets = self._load_offsets()
+            indices = _check_row_indices(indices, len(offsets) - 1)
+            return offsets[indices], offsets[indices + 1]
 
-        zero_pos = None
+        needed, inverse = _offset_positions_for_rows(indices, self.num_rows)
+        offsets = self.offsets.vindex[needed].read().result()
+        return _bounds_from_offsets(needed, inverse, offsets)
 
-        with ts.Batch():
-            for index in indices:
-                if index >= num_rows or index < 0:
-                    raise IndexError("Index out of bounds")
-                offsets = self.offsets[index : index + 2].read()
-                offsets_futs.append(offsets)
+    async def _bounds_for_rows_batch_async(self, indices) -> tuple[np.ndarray, np.ndarray]:
+        if self._in_memory_metadata:
+            offsets = await self._load_offsets_async()
+            indices = _check_row_indices(indices, len(offsets) - 1)
+            return offsets[indices], offsets[indices + 1]
+
+        needed, inverse = _offset_positions_for_rows(indices, await self.num_rows_async())
+        offsets = await self.offsets.vindex[needed].read()
+        return _bounds_from_offsets(needed, inverse, offsets)
+
+    async def _bounds_for_rows_async(self, start, stop):
+        if self._in_memory_metadata:
+            offsets = (await self._load_offsets_async())[start : stop + 1].copy()
+            return offsets[0], offsets[-1], offsets
+
+        offsets = await self.offsets[start : stop + 1].read()
+        data_start, data_stop = offsets[0], offsets[-1]
+        if start == 0:
+            # The first offset is the number of rows
+            data_start = 0
+            offsets[0] = 0
 
-                if index == 0:
-                    zero_pos = len(offsets_futs) - 1
+        return data_start, data_stop, offsets
 
-        offsets = [fut.result() for fut in offsets_futs]
-        offsets = [(offset[0], offset[-1]) for offset in offsets]
 
-        if zero_pos is not None:
-            offsets[zero_pos] = [0, offsets[zero_pos][1]]
+def _offset_positions_for_rows(indices, num_rows: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Row i spans `data[offsets[i]:offsets[i+1]]`. Returns the sorted, distinct positions in `offsets` that are needed
+    for the given rows, and for each of [*starts, *stops] its position in that array.
+    """
+    indices = _check_row_indices(indices, num_rows)
+    return np.unique(np.concatenate([indices, indices + 1]), return_inverse=True)
 
-        return offsets
 
-    async def _bounds_for_rows_batch_async(self, indices):
-        num_rows = await self.num_rows_async()
-        offsets_futs: list = []
+def _check_row_indices(indices, num_rows: int) -> np.ndarray:
+    indices = np.asarray(indices, dtype=np.int64)
+    if np.any(indices >= num_rows) or np.any(indices < 0):
+        raise IndexError("Index out of bounds")
+    return indices
+
+
+def _offsets_to_bounds(offsets: np.ndarray) -> np.ndarray:
+    """Converts a stored offsets array (whose first element is the number of rows) into row bounds."""
+    offsets = np.array(offsets, dtype=np.int64)
+    offsets[0] = 0
+    return offsets
+
+
+def _bounds_from_offsets(
+    needed: np.ndarray, inverse: np.ndarray, offsets: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    offsets = np.array(offsets, dtype=np.int64)
+    # The first offset is the number of rows, the first row starts at 0
+    offsets[needed == 0] = 0
+    bounds = offsets[inverse]
+    num_rows = len(bounds) // 2
+    return bounds[:num_rows], bounds[num_rows:]
+
+
+def plan_coalesced_reads(
+    starts: np.ndarray, stops: np.ndarray, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Plans a small number of large reads that cover the ranges `[starts[i], stops[i])`.
+
+    Ranges are merged when they overlap or touch the same or adjacent chunks of size `chunk_size`. Those chunks have
+    to be fetched and decoded anyway, so merging only costs a copy of the (less than two chunks of) data in between.
+
+    Returns:
+        (read_starts, read_stops, read_ids), where read_ids[i] is the read that covers the i'th range.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    stops = np.asarray(stops, dtype=np.int64)
+    if starts.shape != stops.shape or starts.ndim != 1:
+        raise ValueError("starts and stops must be 1-d arrays of the same length")
+    if len(starts) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+
+    order = np.argsort(starts, kind="stable")
+    sorted_starts = starts[order]
+    sorted_stops = np.maximum(stops[order], sorted_starts)
+
+    first_chunk = sorted_starts // chunk_size
+    last_chunk = np.maximum(sorted_stops - 1, sorted_starts) // chunk_size
+    last_chunk_so_far = np.maximum.accumulate(last_chunk)
+
+    new_read = np.ones(len(starts), dtype=bool)
+    new_read[1:] = first_chunk[1:] > last_chunk_so_far[:-1] + 1
+    read_heads = np.flatnonzero(new_read)
+
+    read_starts = sorted_starts[read_heads]
+    read_stops = np.maximum.reduceat(sorted_stops, read_heads)
+
+    read_ids = np.empty(len(starts), dtype=np.int64)
+    read_ids[order] = np.cumsum(new_read) - 1
 
-        zero_pos = None
+    return read_starts, read_stops, read_ids
+
+
+async def read_coalesced_ranges(
+    array: ts.TensorStore, starts: Sequence[int] | np.ndarray, stops: Sequence[int] | np.ndarray
+) -> list[np.ndarray]:
+    """
+    Reads `array[starts[i]:stops[i]]` for every i, using [plan_coalesced_reads][] to merge nearby ranges into a few
+    large reads. The returned arrays are views into the merged reads.
+    """
+    plan = _CoalescedReads.issue(array, starts, stops)
+    reads = await asyncio.gather(*plan.futures)
+    return plan.slice(reads)
+
+
+def read_coalesced_ranges_sync(
+    array: ts.TensorStore, starts: Sequence[int] | np.ndarray, stops: Sequence[int] | np.ndarray
+) -> list[np.ndarray]:
+    """Synchronous version of [read_coalesced_ranges][]."""
+    plan = _CoalescedReads.issue(array, starts, stops)
+    return plan.slice([fut.result() for fut in plan.futures])
+
+
+@dataclass
+class _CoalescedReads:
+    futures: list
+    read_ids: np.ndarray
+    rel_starts: np.ndarray
+    rel_stops: np.ndarray
+
+    @staticmethod
+    def issue(array: ts.TensorStore, starts, stops) -> "_CoalescedReads":
+        starts = np.asarray(starts, dtype=np.int64)
+        stops = np.asarray(stops, dtype=np.int64)
+        read_starts, read_stops, read_ids = plan_coalesced_reads(starts, stops, _read_chunk_size(array))
 
         with ts.Batch():
-            for index in indices:
-                if index >= num_rows or index < 0:
-                    raise IndexError("Index out of bounds")
-                offsets = self.offsets[index : index + 2].read()
-                offsets_futs.append(offsets)
+            futures = [array[start:stop].read() for start, stop in zip(read_starts.tolist(), read_stops.tolist())]
 
-                if index == 0:
-                    zero_pos = len(offsets_futs) - 1
+        return _CoalescedReads(futures, read_ids, starts - read_starts[read_ids], stops - read_starts[read_ids])
 
-        offsets = await asyncio.gather(*[fut for fut in offsets_futs])
-        offsets = [(offset[0], offset[-1]) for offset in offsets]
+    def slice(self, reads: Sequence[np.ndarray]) -> list[np.ndarray]:
+        return [
+            reads[r][start:stop]
+            for r, start, stop in zip(self.read_ids.tolist(), self.rel_starts.tolist(), self.rel_stops.tolist())
+        ]
 
-        if zero_pos is not None:
-            offsets[zero_pos] = [0, offsets[zero_pos][1]]
 
-        return offsets
+def _read_chunk_size(array: ts.TensorStore) -> int:
+    try:
+        chunk_shape = array.chunk_layout.read_chunk.shape
+    except (AttributeError, ValueError):
+        chunk_shape = None
 
-    async def _bounds_for_rows_async(self, start, stop):
-        offsets = await self.offsets[start : stop + 1].read()
-        data_start, data_stop = offsets[0], offsets[-1]
-        if start == 0:
-            # The first offset is the number of rows
-            data_start = 0
-            offsets[0] = 0
+    if not chunk_shape or not chunk_shape[0]:
+        return DEFAULT_CHUNK_SIZE
 
-        return data_start, data_stop, offsets
+    return int(chunk_shape[0])
 
 
 def _unshaped_spec(store: ts.TensorStore) -> ts.Spec:
@@ -54,13 +54,33 @@ class TreeStore(Generic[T]):
         return TreeBatchPreparer(jtu.tree_map(lambda writer: 9, self.tree, is_leaf=heuristic_is_leaf))
 
     @staticmethod
-    def open(exemplar: T, path: str, *, mode="a", cache_metadata: bool = False) -> "TreeStore":
+    def open(
+        exemplar: T, path: str, *, mode="a", cache_metadata: bool = False, in_memory_metadata: bool = False
+    ) -> "TreeStore":
         """
         Open a TreeStoreBuilder from a file.
+
+        If `in_memory_metadata` is set (and mode is "r"), the offsets of each leaf are read into memory on first use.
+        See [JaggedArrayStore.open][].
         """
-        tree = _construct_builder_tree(exemplar, path, mode, cache_metadata)
+        tree = _construct_builder_tree(exemplar, path, mode, cache_metadata, in_memory_metadata)
         return TreeStore(tree, path, mode)
 
+    @staticmethod
+    def concat(stores: Sequence["TreeStore[T]"]) -> "TreeStore[T]":
+        """
+        A read-only TreeStore whose rows are the rows of `stores`, in order, without copying any data.
+        See [JaggedArrayStore.concat][]. The result has the path of the first store.
+        """
+        if len(stores) == 0:
+            raise ValueError("Need at least one store to concatenate")
+        tree = jtu.tree_map(
+            lambda *leaves: JaggedArrayStore.concat(leaves),
+            *(store.tree for store in stores),
+            is_leaf=heuristic_is_leaf,
+        )
+        return TreeStore(tree, stores[0].path, "r")
+
     def append(self, ex: T):
         return self.extend([ex])
 
@@ -176,7 +196,7 @@ class TreeStore(Generic[T]):
         return await jax.tree.leaves(self.tree)[0].num_rows_async()
 
 
-def _construct_builder_tree(exemplar, path, mode, cache_metadata):
+def _construct_builder_tree(exemplar, path, mode, cache_metadata, in_memory_metadata=False):
     def open_builder(tree_path, item):
         item = np.asarray(item)
         rank = item.ndim
@@ -187,6 +207,7 @@ def _construct_builder_tree(exemplar, path, mode, cache_metadata):
             item_rank=rank,
             dtype=item.dtype,
             cache_metadata=cache_metadata,
+            in_memory_metadata=in_memory_metadata,
         )
 
     return jtu.tree_map_with_path(open_builder, exemplar, is_leaf=heuristic_is_leaf)
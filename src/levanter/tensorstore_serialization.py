@@ -1,18 +1,21 @@
 # References:
 # * Orbax: https://github.com/google/orbax/blob/11d2934ecfff77e86b5e07d0fef02b67eff4511b/orbax/checkpoint/pytree_checkpoint_handler.py#L312
+import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from functools import partial
-from typing import Any, Callable, Optional
+from functools import lru_cache, partial
+from typing import Any, Callable, Mapping, Optional
 
 import equinox
+import fsspec
 import jax
 import jax.experimental.array_serialization.serialization as array_ser
 import jax.numpy as jnp
 import jax.tree_util as jtu
 import numpy as np
-from jax.sharding import Mesh, Sharding
+from jax.sharding import Mesh, NamedSharding, PartitionSpec, Sharding
 from jaxtyping import PyTree
 
 import haliax as hax
@@ -25,6 +28,9 @@ from levanter.utils import fsspec_utils, jax_utils
 
 logger = logging.getLogger(__name__)
 
+# Written next to the arrays at save time so that restore can check for every leaf with a single read
+MANIFEST_FILE = "manifest.json"
+
 
 def _is_named_or_none(x):
     return x is None or is_named_array(x)
@@ -70,23 +76,53 @@ def tree_serialize_leaves_tensorstore(
 
     arrays = [_ensure_is_array(x) for x in leaves]
 
-    # filter out the None leaves and paths (must be zip)
-    arrays, paths = zip(*[(a, p) for a, p in zip(arrays, paths) if equinox.is_array_like(a)])
-
-    arrays = list(arrays)
-    paths = list(paths)
+    # filter out the None leaves and paths
+    to_write = [(a, p) for a, p in zip(arrays, paths) if equinox.is_array_like(a)]
+    arrays = [a for a, _ in to_write]
+    paths = [p for _, p in to_write]
 
     if commit_callback is None:
         commit_callback = lambda: logger.info("Committed checkpoint to Tensorstore")  # noqa
 
-    manager.serialize_with_paths(arrays, paths, on_commit_callback=commit_callback)
+    manifest = {
+        _relative_path(checkpoint_dir, p): {"shape": list(a.shape), "dtype": str(a.dtype), "nbytes": int(a.nbytes)}
+        for a, p in zip(arrays, paths)
+    }
+
+    def _write_manifest_and_commit():
+        # the manifest goes before the caller's callback, which typically marks the checkpoint as complete
+        if jax.process_index() == 0:
+            with fsspec.open(os.path.join(checkpoint_dir, MANIFEST_FILE), "w") as f:
+                json.dump(manifest, f)
+        commit_callback()
+
+    manager.serialize_with_paths(arrays, paths, on_commit_callback=_write_manifest_and_commit)
 
     if manager_was_none:
         manager.wait_until_finished()
 
 
-def _fs_paths_from_key_paths(checkpoint_dir, leaf_key_paths):
+def _relative_path(checkpoint_dir, path):
+    return path[len(str(checkpoint_dir)) :].lstrip("/")
+
+
+def load_manifest(checkpoint_dir) -> Optional[dict]:
+    """
+    Loads the manifest written by [levanter.tensorstore_serialization.tree_serialize_leaves_tensorstore][], mapping
+    each array's path (relative to `checkpoint_dir`) to its shape, dtype, and size in bytes. Returns None for
+    checkpoints that predate manifests.
+    """
+    manifest_path = os.path.join(checkpoint_dir, MANIFEST_FILE)
+    if not fsspec_utils.exists(manifest_path):
+        return None
+    with fsspec.open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def _fs_paths_from_key_paths(checkpoint_dir, leaf_key_paths, overrides: Optional[Mapping[str, str]] = None):
     def path_from_key_path(key_path):
+        if overrides is not None and key_path in overrides:
+            return overrides[key_path]
         return os.path.join(checkpoint_dir, *key_path.split("."))
 
     paths = jtu.tree_map(path_from_key_path, leaf_key_paths)
@@ -121,6 +157,10 @@ def tree_deserialize_leaves_tensorstore(
     manager: Optional[array_ser.GlobalAsyncCheckpointManager] = None,
     *,
     allow_missing: bool = False,
+    leaf_path_overrides: Optional[Mapping[str, str]] = None,
+    manifest: Optional[Mapping[str, dict]] = None,
+    concurrent_gb: int = 32,
+    dedupe_reads: bool = True,
 ):
     """
     Deserializes a PyTree of Arrays and NamedArrays from a Tensorstore checkpoint, returning a pytree with the same shape
@@ -135,6 +175,15 @@ def tree_deserialize_leaves_tensorstore(
         mesh: optional, the mesh for the NamedArrays (if they are not yet arrays)
         manager: optional, the checkpoint manager to use. If not provided, a new one will be created
         allow_missing: if True, missing leaves will be allowed and kept as-is
+        leaf_path_overrides: optional, a map from leaf key path to the path to read that leaf from instead of
+            `checkpoint_dir` (used by incremental checkpoints)
+        manifest: optional, a map from (full) array path to its manifest entry. If not provided, the manifest in
+            `checkpoint_dir` is used if there is one. Paths in the manifest are assumed to exist, so that we don't
+            need a round trip per leaf before reading anything. Other paths are checked concurrently.
+        concurrent_gb: the maximum number of gigabytes to have in flight while reading
+        dedupe_reads: if True, arrays that are replicated over part of the mesh are first read split over the whole
+            mesh (so no two devices, on this host or any other, read the same bytes) and then resharded on device.
+            This trades a collective for redundant reads, which is almost always a good trade.
 
     Returns:
         A pytree with the same shape as the exemplar pytree, but with the arrays deserialized from the checkpoint
@@ -142,13 +191,18 @@ def tree_deserialize_leaves_tensorstore(
     if manager is None:
         manager = array_ser.GlobalAsyncCheckpointManager()
 
+    if manifest is None:
+        relative_manifest = load_manifest(checkpoint_dir)
+        if relative_manifest is not None:
+            manifest = {os.path.join(checkpoint_dir, k): v for k, v in relative_manifest.items()}
+
     shardings: PyTree[Optional[Sharding]] = jtu.tree_map(
         partial(_sharding_from_leaf, axis_mapping=axis_mapping, mesh=mesh), pytree, is_leaf=_is_named_or_none
     )
 
     # TODO: support ShapeDtypeStructs that are not NamedArrays
     leaf_key_paths = jax_utils.leaf_key_paths(shardings, is_leaf=_is_named_or_none)
-    paths = _fs_paths_from_key_paths(checkpoint_dir, leaf_key_paths)
+    paths = _fs_paths_from_key_paths(checkpoint_dir, leaf_key_paths, leaf_path_overrides)
     paths = jtu.tree_leaves(paths, is_leaf=lambda x: x is None)
 
     shardings_leaves, shardings_structure = jtu.tree_flatten(shardings, is_leaf=_is_named_or_none)
@@ -163,10 +217,20 @@ def tree_deserialize_leaves_tensorstore(
     missing_paths = []
     missing_indices = []
 
+    exemplar_leaves = jax.tree.leaves(pytree, is_leaf=_is_named_or_none)
+    assert len(exemplar_leaves) == len(shardings_leaves)
+
+    # only hit the filesystem for paths the manifest doesn't know about
+    to_check = [paths[i] for i in real_indices if manifest is None or paths[i] not in manifest]
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        exists = dict(zip(to_check, pool.map(fsspec_utils.exists, to_check)))
+
     for i in real_indices:
         path = paths[i]
 
-        if not fsspec_utils.exists(path):
+        if manifest is not None and path in manifest:
+            _check_against_manifest(path, exemplar_leaves[i], manifest[path])
+        elif not exists[path]:
             missing_paths.append(path)
             missing_indices.append(i)
             continue
@@ -186,12 +250,25 @@ def tree_deserialize_leaves_tensorstore(
                 to_log += f"\n  - {leaf_paths[i]}"
             logger.warning(to_log)
 
-    deser_leaves = manager.deserialize_with_paths(shardings=shardings_to_load, paths=paths_to_load)
+    if dedupe_reads:
+        read_shardings = [
+            _read_sharding(sharding, _leaf_shape(exemplar_leaves[i]))
+            for i, sharding in zip(indices_to_load, shardings_to_load)
+        ]
+    else:
+        read_shardings = shardings_to_load
+
+    deser_leaves = manager.deserialize_with_paths(
+        shardings=read_shardings, paths=paths_to_load, concurrent_gb=concurrent_gb
+    )
+    deser_leaves = [
+        x if read_sharding == sharding else _reshard(x, sharding)
+        for x, read_sharding, sharding in zip(deser_leaves, read_shardings, shardings_to_load)
+    ]
 
     # now we need to recreate the original structure
 
-    out_leaves = jax.tree.leaves(pytree, is_leaf=_is_named_or_none)
-    assert len(out_leaves) == len(shardings_leaves)
+    out_leaves = exemplar_leaves
     # out_leaves = [None] * len(shardings_leaves)
     for i, x in zip(indices_to_load, deser_leaves):
         out_leaves[i] = x
@@ -210,3 +287,71 @@ def tree_deserialize_leaves_tensorstore(
             return array
 
     return jtu.tree_map(_rebuild_named_array, pytree, deser_arrays, is_leaf=_is_named_or_none)
+
+
+def _check_against_manifest(path, leaf, entry):
+    if is_named_array(leaf):
+        leaf = leaf.array
+    shape = getattr(leaf, "shape", None)
+    if shape is not None and tuple(shape) != tuple(entry["shape"]):
+        raise ValueError(f"Shape mismatch for {path}: expected {tuple(shape)}, checkpoint has {tuple(entry['shape'])}")
+
+
+def _leaf_shape(leaf) -> Optional[tuple]:
+    if is_named_array(leaf):
+        leaf = leaf.array
+    shape = getattr(leaf, "shape", None)
+    return tuple(shape) if shape is not None else None
+
+
+def _read_sharding(sharding: Sharding, shape: Optional[tuple]) -> Sharding:
+    """
+    Returns a sharding for reading an array that will end up with `sharding`. Mesh axes that `sharding` replicates
+    over are added to the largest dimension they evenly divide, so that every device reads a distinct piece.
+    """
+    if not isinstance(sharding, NamedSharding) or not shape:
+        return sharding
+
+    full_shape: tuple = shape
+    mesh = sharding.mesh
+    spec: list = [_as_axis_tuple(s) for s in sharding.spec] + [()] * (len(full_shape) - len(sharding.spec))
+    used = {ax for dim_axes in spec for ax in dim_axes}
+
+    changed = False
+    for ax in mesh.axis_names:
+        if ax in used or mesh.shape[ax] == 1:
+            continue
+        candidates = [
+            d for d in range(len(full_shape)) if full_shape[d] % (_num_partitions(mesh, spec[d]) * mesh.shape[ax]) == 0
+        ]
+        if not candidates:
+            continue
+        d = max(candidates, key=lambda d: full_shape[d] // _num_partitions(mesh, spec[d]))
+        spec[d] = spec[d] + (ax,)
+        changed = True
+
+    if not changed:
+        return sharding
+
+    return NamedSharding(mesh, PartitionSpec(*[None if not a else a[0] if len(a) == 1 else a for a in spec]))
+
+
+def _as_axis_tuple(spec_entry) -> tuple:
+    if spec_entry is None:
+        return ()
+    if isinstance(spec_entry, str):
+        return (spec_entry,)
+    return tuple(spec_entry)
+
+
+def _num_partitions(mesh, axes: tuple) -> int:
+    return int(np.prod([mesh.shape[ax] for ax in axes], dtype=np.int64))
+
+
+def _reshard(x: jax.Array, sharding: Sharding) -> jax.Array:
+    return _reshard_fn(sharding)(x)
+
+
+@lru_cache(maxsize=None)
+def _reshard_fn(sharding: Sharding):
+    return jax.jit(lambda x: x, out_shardings=sharding)
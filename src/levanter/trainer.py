@@ -1,20 +1,35 @@
 import atexit
+import collections
 import copy
 import functools
 import logging as pylogging
 import os
 import sys
+import time
 import typing
 import warnings
 from dataclasses import dataclass
 from functools import cached_property
 from pathlib import Path
-from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Protocol, Sequence, Tuple, TypeVar, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Protocol,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 import equinox as eqx
 import fsspec
 import jax
-import jax.numpy as jnp
 import jmp
 import numpy as np
 from draccus import field
@@ -38,7 +53,12 @@ import levanter.utils.logging
 from levanter import tracker
 from levanter.callbacks import Callback, CBInfo, JitCallback, LambdaCallback, M, S, StepInfo
 from levanter.callbacks.watch import WatchConfig
-from levanter.checkpoint import CheckpointerConfig, is_checkpoint_path, load_checkpoint_or_initialize
+from levanter.checkpoint import (
+    CheckpointerConfig,
+    discover_latest_checkpoint,
+    is_checkpoint_path,
+    load_checkpoint_or_initialize,
+)
 from levanter.config import JsonAtom
 from levanter.data import AsyncDataset, DataLoader
 from levanter.data.loader import _round_to_nearest_multiple
@@ -75,6 +95,16 @@ class _Hook:
     every: int
 
 
+@dataclass
+class _PendingStep(Generic[S]):
+    """A training step that's been dispatched but whose loss we haven't waited for yet."""
+
+    loss: Scalar
+    state: S
+    metrics: dict[str, Any]
+    cb_states: Sequence[Any] | None
+
+
 @dataclass
 class _JitHook:
     fn: JitCallback
@@ -362,6 +392,7 @@ class Trainer:
             is_checkpointed=saveable_train_state,
             do_load=load_checkpoint,
             allow_partial=self.config.allow_partial_checkpoint,
+            concurrent_gb=self.config.checkpoint_read_concurrent_gb,
         )(model_init, training_key)
 
         return state
@@ -371,65 +402,122 @@ class Trainer:
         checkpoint_path = self.config.load_checkpoint_path
         if checkpoint_path is None:
             checkpoint_path = self.config.checkpointer.expanded_path(self.run_id)
+            local_path = self.config.checkpointer.expanded_local_path(self.run_id)
+            if local_path is not None:
+                # prefer a newer staged checkpoint if this machine has one
+                checkpoint_path = discover_latest_checkpoint(checkpoint_path, local_path=local_path) or checkpoint_path
         return checkpoint_path
 
     def train_step(self, state: S, *batch: X, **batch_kwargs) -> StepInfo[S]:
         """
         Performs a single training step.
         """
+        with capture_time() as step_time:
+            pending = self._dispatch_train_step(state, int(state.step), batch, batch_kwargs)
+            # force the loss so timing numbers are accurate. laziness isn't going to help here (i think?)
+            loss = self._materialize_loss(pending)
+            info = self._finish_train_step(pending, loss, step_time())
+
+        return info
+
+    def _dispatch_train_step(self, state: S, step: int, batch, batch_kwargs) -> "_PendingStep[S]":
+        """
+        Dispatches a training step without waiting for it. `step` is the (host-side) step of `state`, so that we
+        don't have to sync with the device to decide whether to run jit hooks.
+        """
         # jit hooks impose a nontrivial cost even when they're not run (since they defeat some compiler optimizations)
         # so we avoid running them when they're not needed
         # this results in two compiles, but the cost of the second compile is worth it
-        hooks_this_time = any(state.step % h.every == 0 for h in self.hooks.jit_hooks)
+        hooks_this_time = any(step % h.every == 0 for h in self.hooks.jit_hooks)
 
-        with capture_time() as step_time:
-            if hooks_this_time:
-                loss, new_state, metrics, cb_states = self._maybe_save_jaxpr(
-                    "train_step", self._jit_train_step_fn, state, batch, batch_kwargs
-                )
-                # force the loss so timing numbers are accurate. laziness isn't going to help here (i think?)
-            else:
-                loss, new_state, metrics, _ = self._maybe_save_jaxpr(
-                    "train_step_hooks", self._jit_train_step_fn_no_hook, state, batch, batch_kwargs
-                )
-            loss = loss.item()  # type: ignore
+        if hooks_this_time:
+            loss, new_state, metrics, cb_states = self._maybe_save_jaxpr(
+                "train_step", self._jit_train_step_fn, state, batch, batch_kwargs
+            )
+        else:
+            loss, new_state, metrics, cb_states = self._maybe_save_jaxpr(
+                "train_step_hooks", self._jit_train_step_fn_no_hook, state, batch, batch_kwargs
+            )
+            cb_states = None
+
+        return _PendingStep(loss, new_state, metrics, cb_states)
+
+    def _materialize_loss(self, pending: "_PendingStep[S]") -> float:
+        loss = pending.loss.item()  # type: ignore
 
-            if self.config.crash_on_nan and jnp.isnan(loss):
-                raise RuntimeError("Loss is NaN")
+        if self.config.crash_on_nan and np.isnan(loss):
+            raise RuntimeError("Loss is NaN")
 
-            if self.config.crash_on_inf and jnp.isinf(loss):
-                raise RuntimeError("Loss is Inf")
+        if self.config.crash_on_inf and np.isinf(loss):
+            raise RuntimeError("Loss is Inf")
 
-            info = StepInfo(new_state, loss, step_time())
+        return loss
 
-            with capture_time() as hook_time:
-                self.run_hooks(info)
-                if hooks_this_time:
-                    self.hooks.run_jit_hooks_outside_step(info, cb_states)
+    def _finish_train_step(self, pending: "_PendingStep[S]", loss: float, step_duration: float) -> StepInfo[S]:
+        info = StepInfo(pending.state, loss, step_duration)
 
-            levanter.tracker.log({**metrics, "throughput/hook_time": hook_time()}, step=info.step)
+        with capture_time() as hook_time:
+            self.run_hooks(info)
+            if pending.cb_states is not None:
+                self.hooks.run_jit_hooks_outside_step(info, pending.cb_states)
+
+        levanter.tracker.log({**pending.metrics, "throughput/hook_time": hook_time()}, step=info.step)
 
         return info
 
     def training_steps(self, state: S, train_loader) -> typing.Iterator[StepInfo[S]]:
         """
         Generator that yields training steps and runs hooks.
+
+        If `config.steps_in_flight` is k > 0, we dispatch up to k steps ahead of the one whose loss we're waiting
+        for, so hooks, logging, and NaN/Inf checks for a step happen k steps after it's dispatched.
         """
         iter_data = iter(train_loader)
-
-        while int(state.step) < self.num_train_steps:
+        steps_in_flight = self.config.steps_in_flight
+        pending: collections.deque[tuple[_PendingStep[S], float]] = collections.deque()
+        # we track the step on the host so that we never have to wait on the device to know it
+        step = int(state.step)
+        last_finish_time = time.perf_counter()
+
+        def finish_oldest():
+            nonlocal last_finish_time
+            oldest, loading_time = pending.popleft()
+            loss = self._materialize_loss(oldest)
+            now = time.perf_counter()
+            # once the pipeline is full, the time between finished steps is the time per step
+            info = self._finish_train_step(oldest, loss, now - last_finish_time)
+            last_finish_time = time.perf_counter()
+            levanter.tracker.log({"throughput/loading_time": loading_time}, step=info.step)
+            return info
+
+        while step < self.num_train_steps:
             with capture_time() as loading_time:
                 try:
                     example = next(iter_data)
                 except StopIteration:
                     logger.info("Reached end of training data loader")
                     break
-            info = self.train_step(state, example)
-            state = info.state
 
-            levanter.tracker.log({"throughput/loading_time": loading_time()}, step=info.step)
+            if steps_in_flight <= 0:
+                info = self.train_step(state, example)
+                state = info.state
+                step += 1
+                levanter.tracker.log({"throughput/loading_time": loading_time()}, step=info.step)
+                yield info
+                continue
 
-            yield info
+            if not pending:
+                last_finish_time = time.perf_counter()
+            next_pending = self._dispatch_train_step(state, step, (example,), {})
+            pending.append((next_pending, loading_time()))
+            state = next_pending.state
+            step += 1
+
+            if len(pending) > steps_in_flight:
+                yield finish_oldest()
+
+        while pending:
+            yield finish_oldest()
 
     def train(self, state: S, train_loader: Iterable[X]) -> StepInfo[S]:
         """
@@ -530,7 +618,7 @@ class Trainer:
             self._train_step,
             axis_resources=self.parameter_axis_mapping,
             out_axis_resources=self.parameter_axis_mapping,
-            donate_args=(True,),
+            donate_args=(self._donate_train_state,),
         )
 
     @cached_property
@@ -539,9 +627,15 @@ class Trainer:
             functools.partial(self._train_step, _no_hooks=True),
             axis_resources=self.parameter_axis_mapping,
             out_axis_resources=self.parameter_axis_mapping,
-            donate_args=(True,),
+            donate_args=(self._donate_train_state,),
         )
 
+    @property
+    def _donate_train_state(self) -> bool:
+        # With steps in flight, hooks for a step run after later steps have been dispatched, so its state has to
+        # outlive them.
+        return self.config.steps_in_flight <= 0
+
     def _train_step(
         self, state: S, batch, batch_kwargs, _no_hooks=False
     ) -> tuple[Scalar, S, dict[str, Any], Sequence[CBInfo] | None]:
@@ -662,6 +756,14 @@ class TrainerConfig:
     crash_on_nan: bool = True
     crash_on_inf: bool = True
 
+    steps_in_flight: int = 0
+    """
+    How many training steps to dispatch before waiting for the loss of an earlier one. 0 (the default) waits for each
+    step's loss before starting the next. With k > 0, losses stay on device until k steps later, when we log them,
+    check for NaN/Inf, and run hooks, so the host never stalls the device. This keeps k extra train states alive
+    (the train state isn't donated), so it's best for small models where host overhead dominates.
+    """
+
     # config related to partitioning
 
     batch_axis: str = "batch"  # Batch axis for data parallel.
@@ -712,6 +814,8 @@ class TrainerConfig:
     allow_partial_checkpoint: bool = False
     """If True, we allow loading a checkpoint that doesn't have all the parameters in the model.
         Missing parameters are initialized from the model_init function."""
+    checkpoint_read_concurrent_gb: int = 32
+    """How many gigabytes of checkpoint reads to have in flight at once when restoring."""
 
     jax_config: Mapping[str, JsonAtom] = field(
         default_factory=lambda: copy.deepcopy(DEFAULT_JAX_CONFIG)
@@ -1,5 +1,6 @@
 import dataclasses
 import datetime
+import os
 import pathlib
 import tempfile
 from datetime import timedelta
@@ -9,6 +10,7 @@ import jax
 import jax.tree_util as jtu
 import numpy as np
 import optax
+import pytest
 from chex import assert_trees_all_close, assert_trees_all_equal
 from jax import ShapeDtypeStruct
 from jax import numpy as jnp
@@ -16,6 +18,7 @@ from jax import numpy as jnp
 import haliax as hax
 from haliax import Axis
 
+import levanter.checkpoint
 from levanter.callbacks import StepInfo
 from levanter.checkpoint import (
     Checkpointer,
@@ -314,6 +317,150 @@ def test_checkpointer_deletes_previous_checkpoints():
         assert _get_checkpoint_steps(tmpdir) == [5, 8, 10]
 
 
+def test_checkpointer_stages_checkpoints_locally():
+    fake_now = datetime.datetime(2021, 1, 1, 0, 0, 0)
+
+    tick = 10
+
+    def advance_time(delta_seconds):
+        nonlocal fake_now
+        fake_now += timedelta(seconds=delta_seconds)
+
+    with tempfile.TemporaryDirectory() as remote_dir, tempfile.TemporaryDirectory() as local_dir:
+        checkpointer = Checkpointer(
+            remote_dir,
+            timedelta(seconds=tick),
+            [CheckpointInterval(every=5, until=None)],
+            dt_now_injection=lambda: fake_now,
+            local_path=local_dir,
+            max_concurrent_uploads=2,
+        )
+
+        checkpointer.on_step(_dummy_step_info(0))
+        for i in range(1, 6):
+            checkpointer.on_step(_dummy_step_info(i))
+        advance_time(tick)
+        checkpointer.on_step(_dummy_step_info(6))
+        advance_time(tick)
+        checkpointer.on_step(_dummy_step_info(7))
+        checkpointer.wait_until_finished()
+
+        # temporary checkpoints are still replaced in the remote tier, and only the newest is kept locally
+        assert _get_checkpoint_steps(remote_dir) == [5, 7]
+        assert _get_checkpoint_steps(local_dir) == [7]
+
+        def _files(d):
+            return sorted(str(p.relative_to(d)) for p in pathlib.Path(d).rglob("*") if p.is_file())
+
+        assert _files(f"{remote_dir}/step-7") == _files(f"{local_dir}/step-7")
+
+        # a checkpoint that only made it to the local tier is preferred when it's newer
+        save_checkpoint(dict(step=9), step=9, checkpoint_path=f"{local_dir}/step-9")
+        assert discover_latest_checkpoint(remote_dir) == f"{remote_dir}/step-7"
+        assert discover_latest_checkpoint(remote_dir, local_path=local_dir) == f"{local_dir}/step-9"
+
+
+def test_failed_upload_is_raised_and_not_committed(monkeypatch):
+    with tempfile.TemporaryDirectory() as remote_dir, tempfile.TemporaryDirectory() as local_dir:
+        checkpointer = Checkpointer(
+            remote_dir,
+            None,
+            [CheckpointInterval(every=2, until=None)],
+            local_path=local_dir,
+        )
+
+        def fail_upload(upload):
+            upload.manager.wait_until_finished()
+            raise OSError("bucket went away")
+
+        monkeypatch.setattr(checkpointer, "_upload_staged_files", fail_upload)
+        checkpointer.on_step(_dummy_step_info(2))
+
+        with pytest.raises(RuntimeError, match="Failed to upload"):
+            checkpointer.wait_until_finished()
+
+        # the checkpoint is still staged, but was never committed remotely
+        assert _get_checkpoint_steps(local_dir) == [2]
+        assert discover_latest_checkpoint(remote_dir) is None
+
+        # the error is only raised once
+        checkpointer.wait_until_finished()
+
+
+def test_staged_checkpoints_are_ignored_with_multiple_processes(monkeypatch):
+    with tempfile.TemporaryDirectory() as remote_dir, tempfile.TemporaryDirectory() as local_dir:
+        save_checkpoint(dict(step=7), step=7, checkpoint_path=f"{remote_dir}/step-7")
+        # e.g. process 0's copy of a checkpoint whose upload was interrupted
+        save_checkpoint(dict(step=9), step=9, checkpoint_path=f"{local_dir}/step-9")
+
+        assert discover_latest_checkpoint(remote_dir, local_path=local_dir) == f"{local_dir}/step-9"
+
+        # other hosts only have their own shards staged, so every host has to agree on the remote checkpoint
+        monkeypatch.setattr(jax, "process_count", lambda: 2)
+        assert discover_latest_checkpoint(remote_dir, local_path=local_dir) == f"{remote_dir}/step-7"
+
+
+def test_incremental_checkpoints_reuse_unchanged_arrays(monkeypatch):
+    def step_info(step, frozen, trained):
+        info = _dummy_step_info(step)
+        state = dataclasses.replace(
+            info.state, model={"frozen": frozen, "trained": trained}, training_key=jax.random.PRNGKey(step)
+        )
+        return dataclasses.replace(info, state=state)
+
+    frozen = jnp.arange(8.0)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        checkpointer = Checkpointer(tmpdir, None, [CheckpointInterval(every=1000)], incremental=True)
+
+        checkpointer.save_checkpoint(step_info(1, frozen, jnp.zeros(4)), "step-1", is_temporary=True)
+        checkpointer.save_checkpoint(step_info(2, frozen, jnp.ones(4)), "step-2", is_temporary=True)
+        checkpointer.wait_until_finished()
+
+        assert (pathlib.Path(tmpdir) / "step-1" / "model" / "frozen").exists()
+        assert not (pathlib.Path(tmpdir) / "step-2" / "model" / "frozen").exists()
+        assert (pathlib.Path(tmpdir) / "step-2" / "model" / "trained").exists()
+
+        exemplar = {"model": {"frozen": jnp.zeros(8), "trained": jnp.zeros(4)}}
+
+        def check_latest(expected_frozen, expected_trained):
+            loaded = load_checkpoint(exemplar, tmpdir)
+            assert_trees_all_equal(loaded["model"], {"frozen": expected_frozen, "trained": expected_trained})
+            assert_trees_all_equal(load_checkpoint(exemplar["model"], tmpdir, subpath="model"), loaded["model"])
+
+        check_latest(frozen, jnp.ones(4))
+
+        # step-1 still holds the frozen array, so deleting it keeps that around
+        checkpointer._rm_checkpoint("step-1")
+        checkpointer.wait_until_finished()
+        assert discover_latest_checkpoint(tmpdir) == f"{tmpdir}/step-2"
+        assert (pathlib.Path(tmpdir) / "step-1" / "model" / "frozen").exists()
+        assert not (pathlib.Path(tmpdir) / "step-1" / "model" / "trained").exists()
+        check_latest(frozen, jnp.ones(4))
+
+        # once nothing uses it anymore, it's really gone
+        checkpointer.save_checkpoint(step_info(3, frozen + 1, jnp.ones(4)), "step-3", is_temporary=True)
+        checkpointer.wait_until_finished()
+
+        # collecting step-2 and then step-1 reads each leaf index only once
+        index_reads = []
+        load_leaf_index = levanter.checkpoint._load_leaf_index
+
+        def recording_load_leaf_index(checkpoint_path, fs=None):
+            index_reads.append(os.path.basename(checkpoint_path.rstrip("/")))
+            return load_leaf_index(checkpoint_path, fs)
+
+        monkeypatch.setattr(levanter.checkpoint, "_load_leaf_index", recording_load_leaf_index)
+        checkpointer._rm_checkpoint("step-2")
+        checkpointer.wait_until_finished()
+        monkeypatch.undo()
+        assert len(index_reads) == len(set(index_reads))
+
+        assert sorted(p.name for p in pathlib.Path(tmpdir).iterdir()) == ["step-2", "step-3"]
+        assert not (pathlib.Path(tmpdir) / "step-2" / "model" / "frozen").exists()
+        assert (pathlib.Path(tmpdir) / "step-2" / "model" / "trained").exists()
+        check_latest(frozen + 1, jnp.ones(4))
+
+
 def test_load_from_checkpoint_or_initialize():
     In = Axis("in", 2)
     Out = Axis("out", 1)
@@ -1,3 +1,4 @@
+import json
 import os
 import tempfile
 
@@ -15,12 +16,21 @@ import haliax
 from haliax import Axis
 from haliax.state_dict import ModuleWithStateDictSerialization
 
-from levanter.compat.hf_checkpoints import SAFE_TENSORS_MODEL, ModelWithHfSerializationMixin, _convert_to_jnp
+from levanter.compat.hf_checkpoints import (
+    SAFE_TENSORS_MODEL,
+    ModelWithHfSerializationMixin,
+    _convert_to_jnp,
+    _load_safe_tensors_remote,
+    _load_shards_concurrently,
+    _RemoteSafetensorsSlice,
+    _save_hf_shards_streaming,
+    _shard_hf_checkpoint,
+)
 from levanter.models.attention import AttentionMask
 from levanter.models.backpack import BackpackConfig, BackpackLMHeadModel
 from levanter.models.gpt2 import Gpt2Config, Gpt2LMHeadModel
 from levanter.utils.tree_utils import inference_mode
-from test_utils import skip_if_no_torch
+from test_utils import skip_if_no_torch, skip_if_not_enough_devices
 
 
 @skip_if_no_torch
@@ -291,3 +301,146 @@ def test_save_pretrained_default_dtype():
         assert tensors.get_tensor("a_float_param").dtype == expected_float_dtype
         assert tensors.get_tensor("an_int_param").dtype == jnp.int32
         assert tensors.get_tensor("a_bool_buffer").dtype == jnp.bool_
+
+
+def test_save_hf_shards_streaming_casts_floats():
+    state_dict = {
+        "a": jnp.arange(24, dtype=jnp.float32).reshape(6, 4),
+        "b": jnp.array([True, False, True]),
+        "c": jnp.arange(5, dtype=jnp.int32),
+    }
+    shards, index = _shard_hf_checkpoint(state_dict, max_shard_size=48, dtype=jnp.bfloat16)
+    # "a" is 48 bytes in bfloat16, so it gets a shard to itself
+    assert index is not None
+    assert index["metadata"]["total_size"] == 48 + 3 + 20
+    assert len(shards) == 2
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _save_hf_shards_streaming(shards, index, tmpdir, dtype=jnp.bfloat16)
+
+        loaded = {}
+        for shard_file in shards:
+            with safetensors.safe_open(os.path.join(tmpdir, shard_file), framework="numpy") as f:
+                for key in f.keys():
+                    loaded[key] = f.get_tensor(key)
+
+    assert loaded["a"].dtype == jnp.bfloat16
+    np.testing.assert_array_equal(loaded["a"], np.asarray(state_dict["a"].astype(jnp.bfloat16)))
+    assert loaded["b"].dtype == np.bool_
+    assert loaded["c"].dtype == np.int32
+    np.testing.assert_array_equal(loaded["c"], np.asarray(state_dict["c"]))
+
+
+def test_load_safe_tensors_remote_reads_slices():
+    import fsspec
+
+    tensors = {
+        "a": np.arange(24, dtype=np.float32).reshape(6, 4),
+        "b": (np.arange(10) / 3.14).astype(jnp.bfloat16),
+        "c": np.array(7, dtype=np.int32),
+    }
+    fs = fsspec.filesystem("memory")
+    fs.pipe("/ckpt/model.safetensors", safetensors.numpy.save(tensors))
+
+    header_size = int.from_bytes(fs.cat_file("/ckpt/model.safetensors", start=0, end=8), "little")
+    offset = 8 + header_size
+    a_slice = _RemoteSafetensorsSlice(fs, "/ckpt/model.safetensors", offset, np.float32, (6, 4))
+    np.testing.assert_array_equal(a_slice[2:4, 1:3], tensors["a"][2:4, 1:3])
+    np.testing.assert_array_equal(a_slice[:], tensors["a"])
+    np.testing.assert_array_equal(a_slice[5], tensors["a"][5])
+
+    mesh = jax.sharding.Mesh(
+        np.array(jax.devices()).reshape(-1, 1),
+        (haliax.partitioning.ResourceAxis.DATA, haliax.partitioning.ResourceAxis.MODEL),
+    )
+    with mesh:
+        loaded = _load_safe_tensors_remote(fs, "/ckpt/model.safetensors", jnp.float32)
+    np.testing.assert_array_equal(loaded["a"], tensors["a"])
+    np.testing.assert_array_equal(loaded["b"], tensors["b"].astype(np.float32))
+    assert loaded["b"].dtype == jnp.float32
+    assert loaded["c"] == 7
+
+
+def test_remote_safetensors_slice_reads_each_row_range_once():
+    import fsspec
+
+    a = np.arange(64, dtype=np.float32).reshape(4, 16)
+    fs = fsspec.filesystem("memory")
+    fs.pipe("/ckpt/model.safetensors", safetensors.numpy.save({"a": a}))
+    header_size = int.from_bytes(fs.cat_file("/ckpt/model.safetensors", start=0, end=8), "little")
+
+    bytes_read = []
+    cat_file = fs.cat_file
+
+    def counting_cat_file(path, start=None, end=None, **kwargs):
+        data = cat_file(path, start=start, end=end, **kwargs)
+        bytes_read.append(len(data))
+        return data
+
+    fs.cat_file = counting_cat_file
+    try:
+        a_slice = _RemoteSafetensorsSlice(fs, "/ckpt/model.safetensors", 8 + header_size, np.float32, (4, 16))
+        # as if the last axis were split across 8 devices
+        for i in range(8):
+            np.testing.assert_array_equal(a_slice[:, 2 * i : 2 * (i + 1)], a[:, 2 * i : 2 * (i + 1)])
+    finally:
+        del fs.cat_file
+
+    assert sum(bytes_read) == a.nbytes
+
+
+@skip_if_not_enough_devices(2)
+def test_load_shards_concurrently_uses_callers_mesh():
+    import fsspec
+
+    shards = {
+        "model-00001-of-00002.safetensors": {"a": np.arange(64, dtype=np.float32).reshape(8, 8)},
+        "model-00002-of-00002.safetensors": {"b": np.arange(16, dtype=np.int32).reshape(2, 8), "c": np.ones(3)},
+    }
+    fs = fsspec.filesystem("memory")
+    for name, tensors in shards.items():
+        fs.pipe(f"/sharded_ckpt/{name}", safetensors.numpy.save(tensors))
+
+    mesh = jax.sharding.Mesh(
+        np.array(jax.devices()).reshape(-1, 1),
+        (haliax.partitioning.ResourceAxis.DATA, haliax.partitioning.ResourceAxis.MODEL),
+    )
+    with mesh:
+        loaded = _load_shards_concurrently(
+            sorted(shards), lambda name: _load_safe_tensors_remote(fs, f"/sharded_ckpt/{name}", None)
+        )
+
+    assert set(loaded) == {"a", "b", "c"}
+    for tensors in shards.values():
+        for key, value in tensors.items():
+            np.testing.assert_array_equal(loaded[key], value)
+    assert loaded["a"].sharding.mesh == mesh
+    assert len(loaded["a"].sharding.device_set) == len(jax.devices())
+
+
+def test_save_hf_shards_streaming_round_trips():
+    state_dict = {
+        "a": jnp.arange(24, dtype=jnp.float32).reshape(6, 4),
+        "b": (jnp.arange(10) / 3.14).astype(jnp.bfloat16),
+        "c": jnp.array([True, False, True]),
+        "d": jnp.array(7, dtype=jnp.int32),
+    }
+    shards, index = _shard_hf_checkpoint(state_dict, max_shard_size=64)
+    assert index is not None
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _save_hf_shards_streaming(shards, index, tmpdir)
+
+        with open(os.path.join(tmpdir, "model.safetensors.index.json")) as f:
+            assert json.load(f) == index
+
+        loaded = {}
+        for shard_file in shards:
+            with safetensors.safe_open(os.path.join(tmpdir, shard_file), framework="numpy") as f:
+                for key in f.keys():
+                    loaded[key] = f.get_tensor(key)
+
+        assert loaded.keys() == state_dict.keys()
+        for key, value in state_dict.items():
+            assert loaded[key].dtype == value.dtype
+            np.testing.assert_array_equal(loaded[key], np.asarray(value))
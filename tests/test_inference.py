@@ -0,0 +1,142 @@
+import time
+
+import jax.numpy as jnp
+import jax.random as jrandom
+import numpy as np
+import pytest
+
+import haliax as hax
+
+from levanter.inference import InferenceEngine, SamplingParams, sample_tokens, top_p_filter
+from levanter.models.attention import AttentionMask
+from levanter.models.gemma import GemmaConfig
+from levanter.models.llama import LlamaConfig
+from levanter.models.mistral import MistralConfig
+from levanter.models.qwen import QwenConfig
+
+
+Vocab = hax.Axis("vocab", 61)
+
+
+def _tiny_config(config_class, **kwargs):
+    return config_class(
+        seq_len=64,
+        hidden_dim=16,
+        intermediate_dim=32,
+        num_layers=2,
+        num_heads=4,
+        num_kv_heads=2,
+        gradient_checkpointing=False,
+        **kwargs,
+    )
+
+
+def _greedy_reference(model, prompt, max_new_tokens):
+    tokens = list(prompt)
+    for _ in range(max_new_tokens):
+        # pad on the right so flash attention's block size divides the length. causal masking ignores the padding
+        padded = np.zeros(32, dtype=np.int32)
+        padded[: len(tokens)] = tokens
+        logits = model(hax.named(padded, "position"), AttentionMask.causal())
+        tokens.append(int(jnp.argmax(logits.array[len(tokens) - 1])))
+    return tokens[len(prompt) :]
+
+
+@pytest.mark.parametrize(
+    "config",
+    [
+        _tiny_config(LlamaConfig, use_flash_attention=False),
+        _tiny_config(LlamaConfig, use_flash_attention=True, flash_attention_block_size=8),
+        _tiny_config(LlamaConfig, use_flash_attention=False, scan_layers=False),
+        _tiny_config(MistralConfig, use_flash_attention=False),
+        _tiny_config(QwenConfig, use_flash_attention=False),
+        _tiny_config(GemmaConfig, use_flash_attention=False),
+    ],
+    ids=["llama", "llama_flash", "llama_unrolled", "mistral", "qwen", "gemma"],
+)
+def test_greedy_generation_matches_full_forward(config):
+    model = config.build(Vocab, key=jrandom.PRNGKey(0))
+    # prompts of different lengths exercise the right padding, and the third prompt spills into a second batch
+    prompts = [[1, 2, 3, 4, 5], [7, 8], list(range(10, 27))]
+
+    engine = InferenceEngine(model, max_seq_len=32, batch_size=2)
+    out = engine.generate(prompts, SamplingParams(max_new_tokens=6), key=jrandom.PRNGKey(1))
+
+    for prompt, generated in zip(prompts, out):
+        assert generated == _greedy_reference(model, prompt, 6)
+
+
+def test_generation_stops_at_stop_sequences_and_max_seq_len():
+    model = _tiny_config(LlamaConfig, use_flash_attention=False).build(Vocab, key=jrandom.PRNGKey(0))
+    prompts = [[1, 2, 3, 4, 5], [7, 8]]
+
+    engine = InferenceEngine(model, max_seq_len=16, batch_size=2)
+    full = engine.generate(prompts, SamplingParams(max_new_tokens=8), key=jrandom.PRNGKey(1))
+    assert [len(g) for g in full] == [8, 8]
+
+    stop = full[0][2:4]
+    out = engine.generate(prompts, SamplingParams(max_new_tokens=8, stop_sequences=[stop]), key=jrandom.PRNGKey(1))
+    assert out[0] == full[0][:4]
+    # the other sequence keeps going (unless it happens to contain the same stop sequence)
+    assert out[1] == full[1][: len(out[1])]
+    assert len(out[1]) == 8 or out[1][-2:] == stop
+
+    # a prompt that ends in a stop sequence doesn't count
+    out = engine.generate(
+        [[1, 2, 3]], SamplingParams(max_new_tokens=4, stop_sequences=[[2, 3]]), key=jrandom.PRNGKey(1)
+    )
+    assert len(out[0]) == 4
+
+    # generation can't run past the end of the cache
+    out = engine.generate([list(range(1, 14))], SamplingParams(max_new_tokens=8), key=jrandom.PRNGKey(1))
+    assert len(out[0]) == 3
+
+
+def test_top_p_and_temperature_sampling():
+    V = hax.Axis("vocab", 4)
+    logits = hax.named(jnp.log(jnp.array([0.1, 0.5, 0.3, 0.1])), V)
+
+    filtered = top_p_filter(logits, V, 0.7)
+    np.testing.assert_array_equal(np.isfinite(filtered.array), [False, True, True, False])
+    # the most likely token is always kept
+    filtered = top_p_filter(logits, V, 0.0)
+    np.testing.assert_array_equal(np.isfinite(filtered.array), [False, True, False, False])
+
+    Batch = hax.Axis("batch", 512)
+    batch_logits = logits.broadcast_axis(Batch)
+    greedy = sample_tokens(batch_logits, V, temperature=0.0, top_p=1.0, key=jrandom.PRNGKey(0))
+    assert np.all(greedy.array == 1)
+
+    sampled = sample_tokens(batch_logits, V, temperature=1.0, top_p=0.7, key=jrandom.PRNGKey(0))
+    assert set(np.unique(sampled.array).tolist()) == {1, 2}
+
+    sampled = sample_tokens(batch_logits, V, temperature=1.0, top_p=1.0, key=jrandom.PRNGKey(0))
+    assert set(np.unique(sampled.array).tolist()) == {0, 1, 2, 3}
+
+
+@pytest.mark.slow
+def test_generation_throughput_benchmark():
+    config = LlamaConfig(
+        seq_len=1024,
+        hidden_dim=256,
+        intermediate_dim=704,
+        num_layers=4,
+        num_heads=8,
+        num_kv_heads=4,
+        gradient_checkpointing=False,
+    )
+    model = config.build(hax.Axis("vocab", 4096), key=jrandom.PRNGKey(0))
+    rng = np.random.default_rng(0)
+
+    for batch_size in [1, 8, 32]:
+        engine = InferenceEngine(model, max_seq_len=512, batch_size=batch_size)
+        prompts = [rng.integers(0, 4096, size=128).tolist() for _ in range(batch_size)]
+        params = SamplingParams(max_new_tokens=128, temperature=0.7, top_p=0.9)
+
+        engine.generate(prompts, params, key=jrandom.PRNGKey(0))  # compile
+        start = time.perf_counter()
+        out = engine.generate(prompts, params, key=jrandom.PRNGKey(1))
+        elapsed = time.perf_counter() - start
+
+        num_tokens = sum(len(g) for g in out)
+        print(f"batch {batch_size}: {num_tokens / elapsed:.0f} tokens/s")
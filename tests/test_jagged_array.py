@@ -6,7 +6,7 @@ import jax.numpy as jnp
 import numpy as np
 import pytest
 
-from levanter.store.jagged_array import JaggedArrayStore, PreparedBatch
+from levanter.store.jagged_array import JaggedArrayStore, PreparedBatch, plan_coalesced_reads, read_coalesced_ranges
 
 
 @pytest.mark.parametrize("cache_metadata", [True, False])
@@ -393,5 +393,122 @@ async def test_get_batch_empty():
     assert batch == []
 
 
+def test_plan_coalesced_reads():
+    chunk = 100
+    starts = np.array([250, 0, 10, 1000, 120, 5000, 5050])
+    stops = np.array([260, 10, 20, 1010, 130, 5100, 5060])
+
+    read_starts, read_stops, read_ids = plan_coalesced_reads(starts, stops, chunk)
+
+    # [0, 260) spans chunks 0-2, [1000, 1010) is on its own, and [5000, 5100) covers the last two
+    assert read_starts.tolist() == [0, 1000, 5000]
+    assert read_stops.tolist() == [260, 1010, 5100]
+    assert read_ids.tolist() == [0, 0, 0, 1, 0, 2, 2]
+
+
+def test_plan_coalesced_reads_empty():
+    read_starts, read_stops, read_ids = plan_coalesced_reads(np.array([]), np.array([]))
+    assert len(read_starts) == len(read_stops) == len(read_ids) == 0
+
+
+@pytest.mark.asyncio
+async def test_read_coalesced_ranges_matches_individual_reads():
+    tmpdir = tempfile.TemporaryDirectory().name
+    builder = await create_builder_with_data(tmpdir, num_sequences=10, sequence_length=1000)
+
+    rng = np.random.default_rng(0)
+    starts = rng.integers(0, builder.data_size - 500, size=50)
+    stops = starts + rng.integers(0, 500, size=50)
+
+    results = await read_coalesced_ranges(builder.data, starts, stops)
+
+    for start, stop, result in zip(starts, stops, results):
+        expected = await builder.data[start:stop].read()
+        assert np.array_equal(result, expected)
+
+
+@pytest.mark.asyncio
+async def test_get_batch_with_duplicates_and_row_zero():
+    tmpdir = tempfile.TemporaryDirectory().name
+    builder = await create_builder_with_data(tmpdir, num_sequences=10, sequence_length=100)
+
+    indices = [0, 9, 0, 3, 4, 3]
+    batch = await builder.get_batch(indices)
+    batch_sync = builder.get_batch_sync(indices)
+
+    for idx, result, result_sync in zip(indices, batch, batch_sync):
+        expected_data = await builder.get_item_async(idx)
+        assert np.array_equal(result, expected_data)
+        assert np.array_equal(result_sync, expected_data)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("sequence_length", [100, (10, 10)])
+async def test_in_memory_metadata_matches_tensorstore(sequence_length):
+    tmpdir = tempfile.TemporaryDirectory().name
+    builder = await create_builder_with_data(tmpdir, num_sequences=10, sequence_length=sequence_length)
+    item_rank = 1 if isinstance(sequence_length, int) else len(sequence_length)
+
+    reader = await JaggedArrayStore.open_async(
+        tmpdir, mode="r", item_rank=item_rank, dtype=jnp.int64, in_memory_metadata=True
+    )
+    assert reader._offsets_in_memory is None
+
+    # lengths are scalar reads: the offsets are only loaded once we need row bounds
+    assert await reader.num_rows_async() == builder.num_rows
+    assert reader.data_size == builder.data_size
+    assert await reader.data_size_async() == builder.data_size
+    assert reader._offsets_in_memory is None
+
+    indices = [0, 9, 3, 3, 5]
+    for expected, result, result_sync in zip(
+        await builder.get_batch(indices), await reader.get_batch(indices), reader.get_batch_sync(indices)
+    ):
+        assert np.array_equal(result, expected)
+        assert np.array_equal(result_sync, expected)
+    assert reader._offsets_in_memory is not None
+    assert len(reader) == builder.num_rows
+
+    assert np.array_equal(reader[4], builder[4])
+    assert np.array_equal(await reader.get_item_async(0), await builder.get_item_async(0))
+
+    with pytest.raises(IndexError):
+        await reader.get_batch([10])
+
+
+def test_in_memory_metadata_ignored_for_writable_stores():
+    tmpdir = tempfile.TemporaryDirectory().name
+    store = JaggedArrayStore.open(tmpdir, item_rank=1, dtype=jnp.int64, in_memory_metadata=True)
+    store.append(np.arange(10))
+    store.append(np.arange(5))
+    assert store.num_rows == 2
+    assert store.data_size == 15
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("sequence_length", [100, (10, 10)])
+async def test_concat_matches_rows_of_each_store(sequence_length):
+    tmpdirs = [tempfile.TemporaryDirectory().name for _ in range(3)]
+    builders = [
+        await create_builder_with_data(tmpdir, num_sequences=n, sequence_length=sequence_length)
+        for tmpdir, n in zip(tmpdirs, [10, 0, 7])
+    ]
+    concat = JaggedArrayStore.concat(builders)
+
+    expected = [await b.get_item_async(i) for b in builders for i in range(b.num_rows)]
+    assert concat.num_rows == 17
+    assert concat.data_size == sum(b.data_size for b in builders)
+
+    indices = [16, 0, 9, 10, 10, 3]
+    for i, result, result_sync in zip(indices, await concat.get_batch(indices), concat.get_batch_sync(indices)):
+        assert np.array_equal(result, expected[i])
+        assert np.array_equal(result_sync, expected[i])
+
+    assert np.array_equal(concat[12], expected[12])
+
+    with pytest.raises(IndexError):
+        await concat.get_batch([17])
+
+
 if __name__ == "__main__":
     pytest.main()
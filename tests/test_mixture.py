@@ -115,14 +115,14 @@ async def test_mixture_dataset_normalized_weights():
 
 
 @pytest.mark.asyncio
-async def test_mixture_dataset_unpermuted_ids():
+async def test_mixture_dataset_block_starts():
     mixture_ds = MixtureDataset(datasets(), weights(), block_size=10, key=key())
 
-    unpermuted_ids = mixture_ds._compute_unpermuted_ids(
-        mixture_ds._compute_expected_counts_per_block(weights(), block_size())
-    )
-    assert len(unpermuted_ids) == 10
-    assert unpermuted_ids[0] >> 32 in range(3)  # Ensure the dataset ID is valid
+    # each dataset's examples are laid out contiguously in the unpermuted block
+    assert mixture_ds._block_starts_table.tolist() == [[0, 5, 8]]
+    dataset_ids, dataset_indices = mixture_ds._index_into_datasets_for_ids(np.arange(10), np.zeros(10, dtype=int))
+    assert dataset_ids.tolist() == [0] * 5 + [1] * 3 + [2] * 2
+    assert dataset_indices.tolist() == [0, 1, 2, 3, 4, 0, 1, 2, 0, 1]
 
 
 @pytest.mark.asyncio
@@ -188,6 +188,92 @@ async def test_mixture_dataset_samples_all_elements():
     assert set(samples) == {1, 2, 3, 4, 5, 10, 20, 30, 40, 50, 100, 200, 300, 400, 500}
 
 
+@pytest.mark.asyncio
+async def test_mixture_dataset_get_batch_matches_getitem_across_stages():
+    stages = [(0, {"ds1": 0.5, "ds2": 0.3, "ds3": 0.2}), (30, {"ds1": 0.1, "ds3": 0.9}), (60, weights())]
+    mixture_ds = MixtureDataset(datasets(), stages, block_size=10, key=key())
+
+    indices = [95, 0, 31, 7, 59, 60, 61, 14, 14, 200]
+    batch = await mixture_ds.get_batch(indices)
+
+    assert batch == [await mixture_ds.getitem_async(i) for i in indices]
+
+
+@pytest.mark.asyncio
+async def test_mixture_dataset_default_order_is_unchanged():
+    # pinned so that resuming a run with the default block permutation gives the same data order
+    dses = {
+        "a": ListAsyncDataset(list(range(100))),
+        "b": ListAsyncDataset(list(range(100, 200))),
+        "c": ListAsyncDataset(list(range(200, 300))),
+    }
+    stages = [(0, {"a": 0.5, "b": 0.3, "c": 0.2}), (20, {"a": 0.1, "b": 0.0, "c": 0.9})]
+    mixture_ds = MixtureDataset(dses, stages, block_size=10, key=0)
+
+    batch = await mixture_ds.get_batch(list(range(40)))
+
+    # fmt: off
+    assert batch == [
+        0, 200, 2, 4, 1, 102, 201, 100, 3, 101, 5, 8, 203, 103, 6, 202, 9, 104, 7, 105,
+        210, 207, 206, 204, 209, 10, 205, 208, 212, 211, 220, 214, 221, 213, 219, 216, 215, 217, 218, 11,
+    ]
+    # fmt: on
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("block_permutation_type", [None, "feistel", "linear"])
+async def test_mixture_dataset_large_blocks_and_many_datasets(block_permutation_type):
+    num_datasets = 3000
+    dses = {f"ds{i}": ListAsyncDataset(list(range(i * 1000, i * 1000 + 100))) for i in range(num_datasets)}
+    for ds in dses.values():
+        ds.finalize()
+
+    block_size = 2**17
+    mixture_ds = MixtureDataset(
+        dses,
+        {name: 1.0 for name in dses},
+        block_size=block_size,
+        key=key(),
+        block_permutation_type=block_permutation_type,
+    )
+
+    # a whole block draws exactly the expected number of examples from every dataset
+    counts = mixture_ds._counts_per_block_table[0]
+    batch = await mixture_ds.get_batch(range(block_size))
+    drawn_per_dataset = np.bincount(np.array(batch) // 1000, minlength=num_datasets)
+    assert drawn_per_dataset.tolist() == counts.tolist()
+
+    indices = [0, 17, block_size - 1, block_size, 3 * block_size + 12345]
+    batch = await mixture_ds.get_batch(indices)
+    assert batch == [await mixture_ds.getitem_async(i) for i in indices]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("block_permutation_type", ["feistel", "linear"])
+async def test_mixture_dataset_prp_block_permutation(block_permutation_type):
+    stages = [(0, {"ds1": 0.5, "ds2": 0.3, "ds3": 0.2}), (30, {"ds1": 0.1, "ds3": 0.9})]
+
+    def make():
+        return MixtureDataset(
+            datasets(), stages, block_size=10, key=key(), block_permutation_type=block_permutation_type
+        )
+
+    mixture_ds = make()
+    batch = await mixture_ds.get_batch(list(range(60)))
+    assert batch == await make().get_batch(list(range(60)))
+    assert batch == [await mixture_ds.getitem_async(i) for i in range(60)]
+
+    # each block is a permutation of its unpermuted block
+    for block_id in range(6):
+        assert sorted((await mixture_ds._get_block(block_id)).tolist()) == list(range(10))
+
+    unshuffled = MixtureDataset(datasets(), stages, block_size=10, key=key(), randomize_blocks=False)
+    unshuffled_batch = await unshuffled.get_batch(list(range(60)))
+    for block_start in range(0, 60, 10):
+        block = slice(block_start, block_start + 10)
+        assert sorted(batch[block]) == sorted(unshuffled_batch[block])
+
+
 def test_rescale_mixture_schedule_for_batch_schedule():
     mixture_schedule = [(0, {"ds1": 0.5, "ds2": 0.5}), (10, {"ds1": 0.2, "ds2": 0.8})]
     batch_schedule = BatchSchedule([ScheduleStep(start=0, value=10), ScheduleStep(start=5, value=20)])
@@ -205,3 +291,30 @@ def test_rescale_mixture_schedule_for_batch_schedule():
     expected_schedule = [(0, {"ds1": 0.5, "ds2": 0.5}), (100, {"ds1": 0.2, "ds2": 0.8})]
 
     assert rescaled_schedule == expected_schedule
+
+
+@pytest.mark.asyncio
+async def test_mixture_dataset_forwards_get_batch_slices():
+    class SliceRecordingDataset(ListAsyncDataset):
+        def __init__(self, data):
+            super().__init__(data, is_complete=True)
+            self.slice_calls = 0
+
+        async def get_batch_slices(self, indices, item_slice):
+            self.slice_calls += 1
+            return await super().get_batch_slices(indices, item_slice)
+
+    inner = {
+        name: SliceRecordingDataset([np.arange(8) + offset + i for i in range(5)])
+        for name, offset in [("ds1", 0), ("ds2", 100), ("ds3", 1000)]
+    }
+    mixture_ds = MixtureDataset(inner, weights(), 10, key=key(), randomize_blocks=True)
+
+    indices = list(range(15))
+    batch = await mixture_ds.get_batch_slices(indices, slice(1, 5))
+    whole = await mixture_ds.get_batch(indices)
+
+    # each dataset that contributed to the batch was asked for just the slice
+    assert sum(ds.slice_calls for ds in inner.values()) == len({int(ex[0]) // 100 for ex in whole})
+    for sliced, ex in zip(batch, whole):
+        np.testing.assert_array_equal(sliced, ex[1:5])
@@ -1,14 +1,30 @@
 import asyncio
+import json
+import os
 import tempfile
+import time
 from typing import Any, Dict, Iterator, Sequence
 
 import numpy as np
 import pytest
 import ray
+import tensorstore as ts
 
 from levanter.data import BatchProcessor, ShardedDataSource, batched
-from levanter.data.sharded_datasource import TextUrlDataSource
-from levanter.store.cache import CacheOptions, SerialCacheWriter, TreeStore, _get_builder_actor, build_or_load_cache
+from levanter.data.metrics_monitor import InProgressCacheMetrics
+from levanter.data.sharded_datasource import JsonlDataSource, TextUrlDataSource
+from levanter.store.cache import (
+    CacheLedger,
+    CacheOptions,
+    SerialCacheWriter,
+    TreeCache,
+    TreeStore,
+    _copy_in_batches,
+    _get_builder_actor,
+    _tokenize_one_shard_group,
+    build_or_load_cache,
+    consolidate_cache,
+)
 from levanter.utils.py_utils import logical_cpu_core_count
 
 
@@ -123,6 +139,98 @@ def test_serial_cache_writer():
             np.testing.assert_array_equal(x["data"], np.asarray([i % 10 + i // 10 * 10] * 10))
 
 
+def test_finished_cache_keeps_offsets_in_memory():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        exemplar = {"data": np.array([0], dtype=np.int64)}
+
+        with SerialCacheWriter(tmpdir, exemplar) as writer:
+            writer.write_batch([{"data": np.arange(i + 1, dtype=np.int64)} for i in range(20)])
+
+        cache = writer.result()
+        assert cache.is_finished
+
+        data_store = cache.store.tree["data"]
+        assert data_store._in_memory_metadata
+
+        batch = cache.get_batch_sync([19, 0, 7])
+        assert data_store._offsets_in_memory is not None
+        np.testing.assert_array_equal(batch[0]["data"], np.arange(20))
+        np.testing.assert_array_equal(batch[1]["data"], np.arange(1))
+        np.testing.assert_array_equal(batch[2]["data"], np.arange(8))
+        assert len(cache) == 20
+
+
+class _JsonlIdsProcessor(BatchProcessor[dict, dict[str, np.ndarray]]):
+    def __call__(self, batch: Sequence[dict]) -> Sequence[dict[str, np.ndarray]]:
+        return [{"data": np.asarray(doc["ids"], dtype=np.int64)} for doc in batch]
+
+    @property
+    def num_cpus(self) -> int:
+        return 1
+
+    @property
+    def output_exemplar(self) -> dict[str, np.ndarray]:
+        return {"data": np.array([0], dtype=np.int64)}
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        return {}
+
+
+class _PreemptedJsonlDataSource(JsonlDataSource):
+    """Records where it was opened, and optionally dies after reading a number of rows."""
+
+    def __init__(self, urls, die_after: int | None = None):
+        super().__init__(urls)
+        self.die_after = die_after
+        self.opened_at: list[int] = []
+
+    def open_shard_at_row(self, shard_name: str, row: int):
+        raise AssertionError("should have resumed from a byte offset")
+
+    def open_shard_at_byte_offset(self, shard_name: str, byte_offset: int):
+        self.opened_at.append(byte_offset)
+        for i, item in enumerate(super().open_shard_at_byte_offset(shard_name, byte_offset)):
+            if self.die_after is not None and i >= self.die_after:
+                raise RuntimeError("preempted")
+            yield item
+
+
+def test_cache_resumes_jsonl_shard_from_byte_offset():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = f"{tmpdir}/data.jsonl"
+        with open(path, "w") as f:
+            for i in range(100):
+                f.write(json.dumps({"ids": list(range(i, i + 1 + i % 5))}) + "\n")
+
+        cache_dir = f"{tmpdir}/cache"
+        processor = _JsonlIdsProcessor()
+        options = CacheOptions(batch_size=8, target_size_per_flush=1)
+
+        preempted = _PreemptedJsonlDataSource([path], die_after=45)
+        shards = list(preempted.shard_names)
+        with pytest.raises(RuntimeError, match="preempted"):
+            _tokenize_one_shard_group(cache_dir, preempted, shards, processor, options, lambda *args: None, False)
+
+        ledger = CacheLedger.load(cache_dir)
+        assert ledger.shard_rows[shards[0]] == 40
+        resume_offset = ledger.shard_byte_offsets[shards[0]]
+        with open(path, "rb") as f:
+            assert resume_offset == sum(len(f.readline()) for _ in range(40))
+
+        resumed = _PreemptedJsonlDataSource([path])
+        ledger = _tokenize_one_shard_group(cache_dir, resumed, shards, processor, options, lambda *args: None, False)
+
+        assert resumed.opened_at == [resume_offset]
+        assert ledger.is_finished
+        assert ledger.total_num_rows == 100
+        assert ledger.shard_byte_offsets == {}
+
+        store = TreeStore.open(processor.output_exemplar, cache_dir, mode="r")
+        for i, row in enumerate(store.get_batch_sync(list(range(100)))):
+            np.testing.assert_array_equal(row["data"], np.arange(i, i + 1 + i % 5))
+
+
 @pytest.mark.ray
 def test_full_end_to_end_cache():
     td = tempfile.TemporaryDirectory()
@@ -161,6 +269,115 @@ def test_full_end_to_end_cache_with_groups():
         check_datasets_equal(all_data, expected)
 
 
+def test_local_backend_end_to_end_cache_with_groups():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = build_or_load_cache(
+            tmpdir,
+            SimpleShardSource(num_shards=15),
+            TestProcessor(),
+            await_finished=True,
+            options=CacheOptions(num_shard_groups=3, batch_size=8, backend="local", num_local_workers=2),
+        )
+
+        expected = simple_process(TestProcessor(), SimpleShardSource(num_shards=15))
+
+        check_datasets_equal(cache[:], expected)
+        assert cache.is_finished
+
+
+def test_virtual_concat_cache_and_consolidate():
+    options = CacheOptions(num_shard_groups=3, batch_size=8, backend="local", num_local_workers=3, virtual_concat=True)
+    expected = simple_process(TestProcessor(), SimpleShardSource(num_shards=15))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = build_or_load_cache(tmpdir, SimpleShardSource(num_shards=15), TestProcessor(), options=options)
+
+        assert cache.ledger.virtual_groups == ["___groups/group_1", "___groups/group_2"]
+        assert not os.path.exists(os.path.join(tmpdir, "___temp"))
+        check_datasets_equal(cache[:], expected)
+
+        reloaded = TreeCache.load(tmpdir, TestProcessor().output_exemplar)
+        check_datasets_equal(reloaded[:], expected)
+
+        ledger = consolidate_cache(tmpdir, TestProcessor().output_exemplar)
+        assert ledger.virtual_groups == []
+        assert not os.path.exists(os.path.join(tmpdir, "___groups", "group_1"))
+
+        # the cache's own store has all the rows now
+        assert len(TreeStore.open(TestProcessor().output_exemplar, tmpdir, mode="r")) == len(expected)
+        consolidated = TreeCache.load(tmpdir, TestProcessor().output_exemplar)
+        check_datasets_equal(consolidated[:], expected)
+
+
+@pytest.mark.asyncio
+async def test_copy_in_batches_with_concurrent_batches():
+    def _array(shape, chunk):
+        spec = {
+            "driver": "zarr",
+            "kvstore": {"driver": "memory"},
+            "metadata": {"shape": [shape], "chunks": [chunk], "dtype": "<i8"},
+        }
+        return ts.open(spec, create=True).result()
+
+    src = _array(100, 7)
+    src[:].write(np.arange(100)).result()
+    dest = _array(150, 16)
+
+    await _copy_in_batches(dest, 13, src, 90, elems_per_batch=20, max_concurrent_batches=3)
+
+    result = dest[:].read().result()
+    np.testing.assert_array_equal(result[13:103], np.arange(90))
+    assert not result[:13].any() and not result[103:].any()
+
+
+def test_local_backend_recovers_from_crash():
+    options = CacheOptions(
+        num_shard_groups=2, target_size_per_flush=1, batch_size=1, backend="local", num_local_workers=2
+    )
+    with tempfile.TemporaryDirectory() as tmpdir, tempfile.TemporaryDirectory() as tmpdir2:
+        with pytest.raises(_CustomException):
+            build_or_load_cache(tmpdir, _CrashingShardSource(4), TestProcessor(), options=options)
+
+        # the first rows of each shard made it into the ledgers, so we resume from there
+        ledger = CacheLedger.load(tmpdir)
+        assert not ledger.is_finished
+        assert ledger.total_num_rows > 0
+
+        reader1 = build_or_load_cache(tmpdir, _CrashingShardSource(100000), TestProcessor(), options=options)
+        reader2 = build_or_load_cache(tmpdir2, SimpleShardSource(num_shards=4), TestProcessor(), options=options)
+
+        check_datasets_equal(reader1, reader2)
+
+
+class _SlowShardSource(ShardedDataSource[list[int]]):
+    @property
+    def shard_names(self) -> Sequence[str]:
+        return ["shard_0"]
+
+    def open_shard_at_row(self, shard_name: str, row: int) -> Iterator[list[int]]:
+        for i in range(row, 20):
+            time.sleep(0.05)
+            yield [i] * 10
+
+
+def test_local_backend_reports_progress_before_finishing():
+    metrics: list[InProgressCacheMetrics] = []
+    options = CacheOptions(target_size_per_flush=1, batch_size=1, backend="local", num_local_workers=1)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = build_or_load_cache(
+            tmpdir,
+            _SlowShardSource(),
+            TestProcessor(),
+            await_finished=True,
+            monitors=[metrics.append],
+            options=options,
+        )
+        assert len(cache) == 20
+
+    # the monitor saw ledgers from before the cache finished, not just the final one
+    assert any(not m.is_finished and m.rows_finished > 0 for m in metrics)
+
+
 @pytest.mark.ray
 def test_cache_remembers_its_cached():
     directory = tempfile.TemporaryDirectory()
@@ -191,6 +408,23 @@ class _CustomException(Exception):
     pass
 
 
+class _CrashingShardSource(ShardedDataSource[list[int]]):
+    def __init__(self, crash_point: int):
+        self.crash_point = crash_point
+
+    @property
+    def shard_names(self) -> Sequence[str]:
+        return [f"shard_{i}" for i in range(4)]
+
+    def open_shard_at_row(self, shard_name: str, row: int) -> Iterator[list[int]]:
+        shard_num = int(shard_name.split("_")[1])
+        for i in range(10):
+            if i == self.crash_point:
+                raise _CustomException(f"Crashing at {shard_num} {i} {self.crash_point}")
+            if i >= row:
+                yield [shard_num * 10 + i] * 10
+
+
 @pytest.mark.ray
 def test_cache_recover_from_crash():
     class CrashingShardSource(ShardedDataSource[list[int]]):
@@ -10,9 +10,17 @@ import haliax
 from haliax import Axis
 from haliax.partitioning import ResourceAxis
 
+import levanter.data.loader
 from levanter.data.dataset import AsyncDataset, ListAsyncDataset
-from levanter.data.loader import DataLoader, check_sharded_consistency
+from levanter.data.loader import (
+    DataLoader,
+    _HostBufferRing,
+    _stack_numpy,
+    _union_of_item_slices,
+    check_sharded_consistency,
+)
 from levanter.schedule import ScheduleStep
+from levanter.utils.thread_utils import blocking_wait
 
 from .test_utils import skip_if_not_enough_devices
 
@@ -351,3 +359,155 @@ def test_padded_final_batch(model_axis_size):
         # ensure all the padded examples are all 0's
         num_padding = 32 - (1007 - 240) % 32
         assert np.all(batch[-num_padding:] == 0)
+
+
+@pytest.mark.parametrize("max_buffered_bytes", [None, 1, 3 * 8 * 128 * 8])
+def test_pipelined_loader_matches_unbuffered_loader(max_buffered_bytes):
+    devices = jax.devices()
+    mesh = Mesh(np.array(devices).reshape(-1, 1), (ResourceAxis.DATA, ResourceAxis.MODEL))
+
+    with mesh, haliax.axis_mapping({"batch": ResourceAxis.DATA}):
+        cache = _small_dataset(128, num_sequences=100)
+        batch_size = 8 * len(devices)
+        expected = [np.asarray(batch) for batch in DataLoader(cache, batch_size, max_buffered_batches=0, mesh=mesh)]
+
+        # a budget smaller than one batch still makes progress
+        loader = DataLoader(
+            cache,
+            batch_size,
+            max_buffered_batches=10,
+            mesh=mesh,
+            prefetch_size=4,
+            max_buffered_bytes=max_buffered_bytes,
+            device_prefetch_size=1,
+        )
+        batches = [np.asarray(batch) for batch in loader]
+
+        assert len(batches) == len(expected)
+        for batch, expected_batch in zip(batches, expected):
+            np.testing.assert_array_equal(batch, expected_batch)
+
+
+def test_loader_stacks_into_reused_host_buffers(monkeypatch):
+    # on CPU we normally don't reuse host buffers (arrays may alias them), so copy each batch as soon as we get it
+    monkeypatch.setattr(levanter.data.loader, "_can_reuse_host_buffers", lambda mesh: True)
+
+    devices = jax.devices()
+    mesh = Mesh(np.array(devices).reshape(-1, 1), (ResourceAxis.DATA, ResourceAxis.MODEL))
+
+    with mesh, haliax.axis_mapping({"batch": ResourceAxis.DATA}):
+        batch_size = 8 * len(devices)
+        cache = _small_dataset(128, num_sequences=5 * batch_size)
+        loader = DataLoader(cache, batch_size, max_buffered_batches=0, mesh=mesh)
+        iterator = iter(loader)
+        assert iterator._host_buffers is not None
+
+        batches = [np.array(batch) for batch in iterator]
+
+    assert len(batches) == 5
+    expected = np.stack(blocking_wait(cache.get_batch(range(5 * batch_size))))
+    np.testing.assert_array_equal(np.concatenate(batches), expected)
+
+
+def test_host_buffer_ring_reuses_buffers():
+    ring = _HostBufferRing(2)
+    slot = ring.start_batch()
+    buffer = ring.buffer(slot, (0, 4), 0, (4, 3), np.int32)
+    out = _stack_numpy([np.full(3, i, dtype=np.int32) for i in range(4)], out=buffer)
+    assert out is buffer
+    np.testing.assert_array_equal(out[:, 0], np.arange(4))
+    ring.finish_batch(slot, [])
+
+    other_slot = ring.start_batch()
+    assert other_slot != slot
+    assert ring.buffer(other_slot, (0, 4), 0, (4, 3), np.int32) is not buffer
+    ring.finish_batch(other_slot, [])
+
+    assert ring.start_batch() == slot
+    assert ring.buffer(slot, (0, 4), 0, (4, 3), np.int32) is buffer
+    # shapes that change get a new buffer
+    assert ring.buffer(slot, (0, 4), 0, (4, 5), np.int32).shape == (4, 5)
+
+
+def test_union_of_item_slices():
+    # e.g. a host whose devices hold the 3rd and 4th of 8 shards of a 1024-long position axis
+    device_indices = [
+        (slice(0, 4), slice(256, 384)),
+        (slice(4, 8), slice(256, 384)),
+        (slice(0, 4), slice(384, 512)),
+    ]
+    assert _union_of_item_slices(device_indices, 1024) == slice(256, 512)
+
+    # the whole axis, or leaves without an item axis, mean we load whole examples
+    assert _union_of_item_slices([(slice(0, 4), slice(None))], 1024) is None
+    assert _union_of_item_slices([(slice(0, 4),)], 1024) is None
+
+
+@skip_if_not_enough_devices(4)
+@pytest.mark.parametrize("force_item_slice", [None, "whole", "second_half"])
+def test_loader_with_sharded_item_axis(monkeypatch, force_item_slice):
+    # all our devices are local, so we need the whole axis. Pretend we don't, to exercise the sliced path.
+    if force_item_slice == "whole":
+        monkeypatch.setattr(
+            levanter.data.loader, "_union_of_item_slices", lambda device_indices, item_len: slice(0, item_len)
+        )
+    elif force_item_slice == "second_half":
+        monkeypatch.setattr(
+            levanter.data.loader,
+            "_union_of_item_slices",
+            lambda device_indices, item_len: slice(item_len // 2, item_len),
+        )
+
+    devices = jax.devices()
+    mesh = Mesh(np.array(devices).reshape(-1, 2), (ResourceAxis.DATA, ResourceAxis.MODEL))
+    Height = Axis("Height", 16)
+    Width = Axis("Width", 16)
+    dataset = StructuredDatasetWithNames(Height, Width, 0, 64, 1)
+
+    with mesh, haliax.axis_mapping({"batch": ResourceAxis.DATA, "Height": ResourceAxis.MODEL}):
+        loader = DataLoader(dataset, len(devices), max_buffered_batches=10, mesh=mesh, axis_resources=None)
+        iterator = iter(loader)
+        assert (iterator._item_slice is not None) == (force_item_slice is not None)
+
+        if force_item_slice == "second_half":
+            # devices that hold the first half of Height ask for rows we didn't load
+            with pytest.raises(ValueError, match="only loaded"):
+                list(iterator)
+            return
+
+        batches = list(iterator)
+
+    assert len(batches) == 64 // len(devices)
+    for step, batch in enumerate(batches):
+        check_sharded_consistency(batch, check_disjoint_indices_are_different=True)
+        expected = blocking_wait(dataset.get_batch(range(step * len(devices), (step + 1) * len(devices))))
+        np.testing.assert_array_equal(
+            np.asarray(batch["extra"]["mask"].array), np.stack([ex["extra"]["mask"].array for ex in expected])
+        )
+        np.testing.assert_array_equal(
+            np.asarray(batch["input_ids"].array), np.stack([ex["input_ids"].array for ex in expected])
+        )
+
+
+@skip_if_not_enough_devices(2)
+def test_shift_into_item_slice():
+    devices = jax.devices()
+    mesh = Mesh(np.array(devices).reshape(-1, 1), (ResourceAxis.DATA, ResourceAxis.MODEL))
+    Height = Axis("Height", 16)
+    Width = Axis("Width", 16)
+    dataset = StructuredDatasetWithNames(Height, Width, 0, 64, 1)
+
+    with mesh, haliax.axis_mapping({"batch": ResourceAxis.DATA}):
+        loader = DataLoader(dataset, len(devices), max_buffered_batches=0, mesh=mesh, axis_resources=None)
+        iterator = iter(loader)
+
+    # e.g. a host whose devices hold the second half of Height
+    iterator._item_slice = slice(8, 16)
+    assert iterator._shift_into_item_slice(slice(8, 12)) == slice(0, 4, 1)
+    assert iterator._shift_into_item_slice(slice(12, 16)) == slice(4, 8, 1)
+    assert iterator._shift_into_item_slice(slice(8, None)) == slice(0, 8, 1)
+
+    with pytest.raises(ValueError, match="only loaded"):
+        iterator._shift_into_item_slice(slice(4, 12))
+    with pytest.raises(ValueError, match="only loaded"):
+        iterator._shift_into_item_slice(slice(None))
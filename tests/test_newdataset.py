@@ -1,10 +1,11 @@
 import asyncio
 
 import jax.random
+import numpy as np
 import pytest
 
-from levanter.data import EraShufflingDataset, PermutationDataset
-from levanter.data.dataset import ListAsyncDataset
+from levanter.data import ChunkShufflingDataset, EraShufflingDataset, PermutationDataset
+from levanter.data.dataset import EpochDataset, ListAsyncDataset
 
 
 @pytest.mark.asyncio
@@ -142,3 +143,120 @@ async def test_era_shuffling_can_grow():
 
     batch = await coro
     assert set(batch) == set(range(16))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("perm_type", ["feistel", "linear"])
+async def test_chunk_shuffling_dataset_is_a_local_permutation(perm_type):
+    # 103 isn't a multiple of the chunk size, so the last chunk is partial
+    dataset = ListAsyncDataset(list(range(103)))
+    dataset.finalize()
+    chunk_size = 4
+    window_chunks = 3
+    key = jax.random.PRNGKey(0)
+    shuffling_dataset = ChunkShufflingDataset(dataset, chunk_size, window_chunks, key=key, perm_type=perm_type)
+
+    assert await shuffling_dataset.current_len() == 103
+    batch = await shuffling_dataset.get_batch(list(range(103)))
+    assert sorted(batch) == list(range(103))
+    assert batch != list(range(103))
+    assert batch == [await shuffling_dataset.getitem_async(i) for i in range(103)]
+
+    # each window is made of exactly window_chunks whole chunks
+    window_size = chunk_size * window_chunks
+    for start in range(0, 103, window_size):
+        window = batch[start : start + window_size]
+        chunks = {x // chunk_size for x in window}
+        assert len(chunks) == min(window_chunks, len(range(start, 103, chunk_size)))
+        assert len(window) == sum(min(chunk_size, 103 - c * chunk_size) for c in chunks)
+
+    # stateless: a fresh dataset with the same key gives the same order
+    again = ChunkShufflingDataset(dataset, chunk_size, window_chunks, key=key, perm_type=perm_type)
+    assert await again.get_batch([50, 3, 102]) == [batch[50], batch[3], batch[102]]
+
+
+@pytest.mark.asyncio
+async def test_chunk_shuffling_dataset_shorter_than_a_chunk():
+    dataset = ListAsyncDataset(list(range(3)))
+    dataset.finalize()
+    shuffling_dataset = dataset.chunk_shuffle(8, 2, jax.random.PRNGKey(0))
+
+    assert sorted(await shuffling_dataset.get_batch([0, 1, 2])) == [0, 1, 2]
+    with pytest.raises(IndexError):
+        await shuffling_dataset.getitem_async(3)
+
+
+@pytest.mark.asyncio
+async def test_chunk_shuffle_keeps_batches_within_a_window():
+    length = 65536
+    examples_per_chunk = 64  # e.g. 256K-token read chunks of 4096-token sequences
+    window_chunks = 16
+    batch_size = 256  # windows are a whole number of batches
+    dataset = ListAsyncDataset(list(range(length)))
+    dataset.finalize()
+    key = jax.random.PRNGKey(0)
+
+    async def chunks_per_batch(ds):
+        order = np.array(await ds.get_batch(range(length)))
+        return [
+            len(np.unique(order[start : start + batch_size] // examples_per_chunk))
+            for start in range(0, length, batch_size)
+        ]
+
+    chunk_shuffled = await chunks_per_batch(dataset.chunk_shuffle(examples_per_chunk, window_chunks, key))
+    assert max(chunk_shuffled) <= window_chunks
+    # but the examples of a batch are still spread over the window, not read one chunk at a time
+    assert min(chunk_shuffled) > batch_size // examples_per_chunk
+
+    # a full shuffle touches a different chunk for nearly every example
+    assert np.mean(await chunks_per_batch(dataset.shuffle(key))) > 10 * window_chunks
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("perm_type", ["feistel", "linear"])
+async def test_era_shuffling_get_batch_matches_getitem(perm_type):
+    # 23 isn't a multiple of the era length, so the last era is short
+    dataset = ListAsyncDataset(list(range(23)))
+    dataset.finalize()
+    shuffling_dataset = EraShufflingDataset(dataset, 5, key=jax.random.PRNGKey(0), perm_type=perm_type)
+
+    indices = [22, 0, 7, 3, 20, 7, 14]
+    batch = await shuffling_dataset.get_batch(indices)
+    assert batch == [await shuffling_dataset.getitem_async(i) for i in indices]
+    assert sorted(await shuffling_dataset.get_batch(list(range(23)))) == list(range(23))
+
+    with pytest.raises(ValueError):
+        await shuffling_dataset.get_batch([-1])
+
+
+class _SliceRecordingDataset(ListAsyncDataset[np.ndarray]):
+    """Records the calls to get_batch_slices, so we can check that wrappers forward them."""
+
+    def __init__(self, data):
+        super().__init__(data, is_complete=True)
+        self.slice_calls: list[slice] = []
+
+    async def get_batch_slices(self, indices, item_slice):
+        self.slice_calls.append(item_slice)
+        return await super().get_batch_slices(indices, item_slice)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("wrapper", ["permutation", "era", "chunk", "sliced", "epoch"])
+async def test_index_remapping_datasets_forward_get_batch_slices(wrapper):
+    inner = _SliceRecordingDataset([np.arange(8) + 10 * i for i in range(23)])
+    key = jax.random.PRNGKey(0)
+    dataset = {
+        "permutation": lambda: PermutationDataset(inner, key),
+        "era": lambda: EraShufflingDataset(inner, 5, key=key),
+        "chunk": lambda: ChunkShufflingDataset(inner, 4, 2, key=key),
+        "sliced": lambda: inner.slice_dataset(3, 20),
+        "epoch": lambda: EpochDataset(inner, max_epochs=2),
+    }[wrapper]()
+
+    indices = [0, 7, 3, 16, 7]
+    batch = await dataset.get_batch_slices(indices, slice(2, 6))
+
+    assert inner.slice_calls == [slice(2, 6)]
+    for sliced, whole in zip(batch, await dataset.get_batch(indices)):
+        np.testing.assert_array_equal(sliced, whole[2:6])
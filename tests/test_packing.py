@@ -4,6 +4,7 @@ from typing import Generator
 import jax.numpy as jnp
 import numpy as np
 import pytest
+import tensorstore as ts
 
 import haliax as hax
 
@@ -12,7 +13,9 @@ from levanter.data.packing import (
     PromptCompletion,
     SequencePacker,
     greedy_pack_prompt_completions,
+    pack_documents,
     pack_prompt_completions,
+    pack_ranges,
     per_segment_correct,
     per_segment_loss,
 )
@@ -257,7 +260,7 @@ def simple_dataset() -> Generator[tuple[dict[str, JaggedArrayStore], dict[str, i
 async def test_simple_pack(simple_dataset):
     dataset, max_length, offsets = simple_dataset
     tester = GreedyPrepackedDataset(dataset, max_length)
-    packs = tester._pack_indices
+    packs = pack_ranges(tester._pack_boundaries)
     # We expect, given document lengths [100,200,150,150] and budget 300,
     # that the first pack covers docs 0 and 1: token range = [offsets[0], offsets[2]) = [0,300),
     # and the second pack covers docs 2 and 3: [offsets[2], offsets[4]) = [300,600).
@@ -286,7 +289,7 @@ async def test_simple_pack(simple_dataset):
 def test_simple_pack_max_examples(simple_dataset):
     dataset, max_length, offsets = simple_dataset
     tester = GreedyPrepackedDataset(dataset, max_length, max_segments_per_example=1, pad_with_zeros=False)
-    packs = tester._pack_indices
+    packs = pack_ranges(tester._pack_boundaries)
     # We expect, given document lengths [100,200,150,150] and budget 300,
     # that each pack covers exactly one document
     assert len(packs) == 4
@@ -328,7 +331,7 @@ def test_simple_pack_max_examples(simple_dataset):
 def test_simple_pack_max_examples_padded(simple_dataset):
     dataset, max_length, offsets = simple_dataset
     tester = GreedyPrepackedDataset(dataset, max_length, max_segments_per_example=1, pad_with_zeros=True)
-    packs = tester._pack_indices
+    packs = pack_ranges(tester._pack_boundaries)
     # We expect, given document lengths [100,200,150,150] and budget 300,
     # that each pack covers exactly one document
     assert len(packs) == 4
@@ -402,7 +405,7 @@ def multi_leaf_dataset():
 def test_multi_leaf_pack(multi_leaf_dataset):
     dataset, max_length, _ = multi_leaf_dataset
     tester = GreedyPrepackedDataset(dataset, max_length, pad_with_zeros=False)
-    packs = tester._pack_indices
+    packs = pack_ranges(tester._pack_boundaries)
     # Here the effective allowed max is computed per leaf:
     # For store1: budget = 300, for store2: budget = 250. Thus the pack must satisfy both.
     # Document lengths for store1: [100,200,150,150]; for store2: [90,190,150,150].
@@ -464,7 +467,7 @@ def test_multi_leaf_pack(multi_leaf_dataset):
 def test_multi_leaf_pack_padded(multi_leaf_dataset):
     dataset, max_length, _ = multi_leaf_dataset
     tester = GreedyPrepackedDataset(dataset, max_length, pad_with_zeros=True)
-    packs = tester._pack_indices
+    packs = pack_ranges(tester._pack_boundaries)
     # Here the effective allowed max is computed per leaf:
     # For store1: budget = 300, for store2: budget = 250. Thus the pack must satisfy both.
     # Document lengths for store1: [100,200,150,150]; for store2: [90,190,150,150].
@@ -563,7 +566,7 @@ def test_max_segments_constraint(dataset_with_segments):
     dataset, max_length, offsets = dataset_with_segments
     # With max_segments_per_example set to 1, each pack must cover exactly one document.
     tester = GreedyPrepackedDataset(dataset, max_length, max_segments_per_example=1, pad_with_zeros=False)
-    packs = tester._pack_indices
+    packs = pack_ranges(tester._pack_boundaries)
     # There are 4 documents so expect 4 packs.
     assert len(packs) == 4
     # For each document, the returned range should be exactly one document index
@@ -586,7 +589,7 @@ def test_max_segments_constraint_padded(dataset_with_segments):
     dataset, max_length, offsets = dataset_with_segments
     # With max_segments_per_example set to 1, each pack must cover exactly one document.
     tester = GreedyPrepackedDataset(dataset, max_length, max_segments_per_example=1, pad_with_zeros=True)
-    packs = tester._pack_indices
+    packs = pack_ranges(tester._pack_boundaries)
     # There are 4 documents so expect 4 packs.
     assert len(packs) == 4
     # For each document, the returned range should be exactly one document index
@@ -616,7 +619,7 @@ def test_too_long_to_pack(multi_leaf_dataset):
         GreedyPrepackedDataset(dataset, max_length)
 
     tester = GreedyPrepackedDataset(dataset, max_length, slice_strategy="right", pad_with_zeros=False)
-    pack2 = tester._pack_indices[2]
+    pack2 = pack_ranges(tester._pack_boundaries)[2]
     assert list(pack2) == [2]
 
     # now check that we can get the data out
@@ -642,7 +645,7 @@ def test_too_long_to_pack_padded(multi_leaf_dataset):
         GreedyPrepackedDataset(dataset, max_length)
 
     tester = GreedyPrepackedDataset(dataset, max_length, slice_strategy="right", pad_with_zeros=True)
-    pack2 = tester._pack_indices[2]
+    pack2 = pack_ranges(tester._pack_boundaries)[2]
     assert list(pack2) == [2]
 
     # now check that we can get the data out, with padding
@@ -742,7 +745,43 @@ def test_too_long_document_error():
 
         # Should not raise when slice_strategy is not "raise"
         tester = GreedyPrepackedDataset({"store": store}, max_length={"store": 300}, slice_strategy="right")
-        assert len(tester._pack_indices) == 1
+        assert len(pack_ranges(tester._pack_boundaries)) == 1
+
+
+def test_persisted_pack_index():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = JaggedArrayStore.open(tmpdir + "/store", item_rank=1, dtype=jnp.int64)
+        for length in [100, 200, 150, 150, 10]:
+            store.append(np.arange(length))
+
+        index_path = tmpdir + "/pack_index"
+        built = GreedyPrepackedDataset({"store": store}, max_length={"store": 300}, pack_index_path=index_path)
+        assert isinstance(built._pack_boundaries, np.ndarray)
+
+        loaded = GreedyPrepackedDataset({"store": store}, max_length={"store": 300}, pack_index_path=index_path)
+        # loaded from the sidecar: we shouldn't have read the offsets
+        assert isinstance(loaded._pack_boundaries, ts.TensorStore)
+        assert loaded._offsets is None
+        assert len(loaded.as_sync_dataset()) == len(built.as_sync_dataset()) == 3
+
+        for (data, seg_ids), (expected_data, expected_seg_ids) in zip(
+            loaded.as_sync_dataset().get_batch([2, 0, 1]), built.as_sync_dataset().get_batch([2, 0, 1])
+        ):
+            assert np.array_equal(data["store"], expected_data["store"])
+            assert np.array_equal(seg_ids["store"], expected_seg_ids["store"])
+
+        # a different config doesn't reuse the index
+        other = GreedyPrepackedDataset(
+            {"store": store}, max_length={"store": 300}, max_segments_per_example=1, pack_index_path=index_path
+        )
+        assert isinstance(other._pack_boundaries, np.ndarray)
+        assert len(other.as_sync_dataset()) == 5
+
+        # changing the store invalidates the index
+        store.append(np.arange(50))
+        stale = GreedyPrepackedDataset({"store": store}, max_length={"store": 300}, pack_index_path=index_path)
+        assert isinstance(stale._pack_boundaries, np.ndarray)
+        assert pack_ranges(stale._pack_boundaries)[-1] == range(4, 6)
 
 
 def test_greedy_pack_prompt_completions_simple():
@@ -880,5 +919,70 @@ def test_greedy_pack_prompt_completions_empty():
         )
 
 
+def _reference_pack_documents(lengths: list[np.ndarray], max_length: list[int], max_segments: int | None):
+    # straightforward greedy packer, used to check pack_documents
+    n_docs = len(lengths[0])
+    packs = []
+    i = 0
+    while i < n_docs:
+        start = i
+        totals = [0] * len(lengths)
+        while i < n_docs:
+            if max_segments is not None and i - start >= max_segments:
+                break
+            if any(total + lens[i] > allowed for total, lens, allowed in zip(totals, lengths, max_length)):
+                break
+            totals = [total + lens[i] for total, lens in zip(totals, lengths)]
+            i += 1
+        if i == start:
+            i = start + 1
+        packs.append(range(start, i))
+    return packs
+
+
+@pytest.mark.parametrize("max_segments", [None, 1, 3, 64])
+def test_pack_documents_matches_reference(max_segments):
+    rng = np.random.default_rng(0)
+    lengths = [rng.integers(0, 120, size=2000), rng.integers(1, 40, size=2000)]
+    max_length = [100, 64]
+
+    boundaries = pack_documents(lengths, max_length, max_segments, slice_too_long_examples=True)
+
+    assert boundaries.dtype == np.int64
+    assert boundaries[0] == 0 and boundaries[-1] == 2000
+    assert pack_ranges(boundaries) == _reference_pack_documents(lengths, max_length, max_segments)
+
+
+def test_pack_documents_empty():
+    boundaries = pack_documents(np.zeros((0,), dtype=np.int64), 10)
+    assert boundaries.tolist() == [0]
+    assert pack_ranges(boundaries) == []
+
+
+@pytest.mark.slow
+def test_pack_documents_at_scale():
+    # the old quadratic packer took minutes for this
+    rng = np.random.default_rng(0)
+    n_docs = 10_000_000
+    max_length = 4096
+    max_segments = 64
+    lengths = {"input_ids": rng.integers(1, 1024, size=n_docs), "assistant_masks": rng.integers(1, 1024, size=n_docs)}
+
+    boundaries = pack_documents(lengths, max_length, max_segments_per_example=max_segments)
+
+    assert boundaries[0] == 0 and boundaries[-1] == n_docs
+    num_docs = np.diff(boundaries)
+    assert np.all(num_docs > 0) and np.all(num_docs <= max_segments)
+
+    # every pack fits, and (being greedy) the next document wouldn't have fit
+    next_doc_fits = num_docs[:-1] < max_segments
+    for leaf_lengths in lengths.values():
+        cumsum = np.concatenate([[0], np.cumsum(leaf_lengths)])
+        pack_lengths = cumsum[boundaries[1:]] - cumsum[boundaries[:-1]]
+        assert np.all(pack_lengths <= max_length)
+        next_doc_fits &= pack_lengths[:-1] + leaf_lengths[boundaries[1:-1]] <= max_length
+    assert not np.any(next_doc_fits)
+
+
 if __name__ == "__main__":
     pytest.main()
@@ -1,8 +1,11 @@
+import gzip
+import json
 import os
 import tempfile
 
 from levanter.data.sharded_datasource import (
     AudioTextUrlDataSource,
+    JsonlDataSource,
     ParquetDataSource,
     TextUrlDataSource,
     _sniff_format_for_dataset,
@@ -99,3 +102,51 @@ def test_text_url_data_source_parquet():
         expected_texts = ["line3", "line4", "line5", "line6"]
         assert len(row_data) == len(expected_texts), f"Expected {len(expected_texts)} rows starting from index 2"
         assert row_data == expected_texts, f"Expected texts {expected_texts}, got {row_data}"
+
+
+def test_jsonl_byte_offsets_resume_at_the_right_row():
+    docs = [{"text": f"doc {i}" * (i % 7)} for i in range(50)]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "data.jsonl")
+        with open(path, "w") as f:
+            for doc in docs:
+                f.write(json.dumps(doc) + "\n")
+
+        source = JsonlDataSource([path])
+        shard_name = source.shard_names[0]
+        assert source.supports_byte_offsets(shard_name)
+
+        items_and_offsets = list(source.open_shard_at_byte_offset(shard_name, 0))
+        assert [item for item, _ in items_and_offsets] == docs
+
+        for row in [1, 17, 49]:
+            offset = items_and_offsets[row - 1][1]
+            resumed = [item for item, _ in source.open_shard_at_byte_offset(shard_name, offset)]
+            assert resumed == list(source.open_shard_at_row(shard_name, row))
+
+        gz_path = os.path.join(tmpdir, "data.jsonl.gz")
+        with gzip.open(gz_path, "wt") as f:
+            f.write(json.dumps(docs[0]) + "\n")
+
+        assert not JsonlDataSource([gz_path]).supports_byte_offsets(JsonlDataSource([gz_path]).shard_names[0])
+
+
+def test_parquet_record_batches_at_row_match_rows():
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "data.parquet")
+        table = pa.table({"text": [f"doc {i}" for i in range(100)], "id": list(range(100))})
+        pq.write_table(table, path, row_group_size=30)
+
+        source = ParquetDataSource([path], columns=["text"])
+        shard_name = source.shard_names[0]
+        assert source.supports_record_batches(shard_name)
+
+        for row in [0, 29, 30, 45, 99, 100]:
+            batches = list(source.open_shard_record_batches_at_row(shard_name, row, batch_size=16))
+            assert all(batch.num_rows <= 16 for batch in batches)
+            rows = [r for batch in batches for r in batch.to_pylist()]
+            assert rows == list(source.open_shard_at_row(shard_name, row))
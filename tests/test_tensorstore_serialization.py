@@ -8,10 +8,18 @@ import numpy as np
 import optax
 import pytest
 from chex import assert_trees_all_close
+from jax.sharding import NamedSharding, PartitionSpec
 
 import haliax as hax
 
-from levanter.tensorstore_serialization import tree_deserialize_leaves_tensorstore, tree_serialize_leaves_tensorstore
+from levanter.tensorstore_serialization import (
+    MANIFEST_FILE,
+    _read_sharding,
+    load_manifest,
+    tree_deserialize_leaves_tensorstore,
+    tree_serialize_leaves_tensorstore,
+)
+from levanter.utils import fsspec_utils
 from test_utils import MLP, arrays_only, assert_trees_not_close
 
 
@@ -177,3 +185,73 @@ def test_tensorstore_ok_with_missing():
             m3 = tree_deserialize_leaves_tensorstore(tmpdir, m2, allow_missing=True)
             assert hax.all(m3.a == hax.full(A, 4))
             assert hax.all(m3.b == hax.zeros(A))
+
+
+def test_tensorstore_restore_uses_manifest(monkeypatch):
+    mesh = jax.sharding.Mesh(jax.devices(), ("device",))
+    with mesh:
+        A = hax.Axis("A", 10)
+        B = hax.Axis("B", 3)
+        tree = {"a": hax.arange(A), "b": hax.ones((A, B)), "c": jnp.zeros(4)}
+
+        with TemporaryDirectory() as tmpdir:
+            tree_serialize_leaves_tensorstore(tmpdir, tree)
+
+            manifest = load_manifest(tmpdir)
+            assert manifest == {
+                "a": {"shape": [10], "dtype": "int32", "nbytes": 40},
+                "b": {"shape": [10, 3], "dtype": "float32", "nbytes": 120},
+                "c": {"shape": [4], "dtype": "float32", "nbytes": 16},
+            }
+
+            # every leaf is in the manifest, so we shouldn't need to check for any of them
+            checked = []
+            real_exists = fsspec_utils.exists
+            monkeypatch.setattr(fsspec_utils, "exists", lambda path: checked.append(path) or real_exists(path))
+
+            restored = tree_deserialize_leaves_tensorstore(tmpdir, jax.tree.map(jnp.zeros_like, tree), concurrent_gb=1)
+            assert_trees_all_close(restored, tree)
+            assert checked == [f"{tmpdir}/{MANIFEST_FILE}"]
+
+            with pytest.raises(ValueError, match="Shape mismatch"):
+                tree_deserialize_leaves_tensorstore(tmpdir, {**tree, "c": jnp.zeros(5)})
+
+
+def test_tensorstore_restore_dedupes_replicated_reads():
+    if len(jax.devices()) % 2 != 0:
+        pytest.skip("Need an even number of devices")
+
+    devices = np.array(jax.devices()).reshape(2, -1)
+    mesh = jax.sharding.Mesh(devices, ("data", "model"))
+    Data = hax.Axis("data_dim", 2 * len(jax.devices()))
+    Model = hax.Axis("model_dim", devices.shape[1])
+    mapping = {"model_dim": "model"}
+
+    with mesh:
+        tree = {
+            "w": hax.shard(hax.arange((Data, Model)), mapping),
+            "replicated": hax.arange(Data),
+            "odd": hax.arange(hax.Axis("odd", 3)),
+        }
+
+        # replicated over "data" -> read split over "data" too, along the largest dim it divides
+        w_sharding = NamedSharding(mesh, PartitionSpec(None, "model"))
+        assert _read_sharding(w_sharding, (Data.size, Model.size)) == NamedSharding(
+            mesh, PartitionSpec("data", "model")
+        )
+        # nothing to split it over
+        odd_sharding = NamedSharding(mesh, PartitionSpec())
+        assert _read_sharding(odd_sharding, (3,)) == odd_sharding
+
+        with TemporaryDirectory() as tmpdir:
+            tree_serialize_leaves_tensorstore(tmpdir, tree)
+            exemplar = jax.tree.map(
+                lambda x: jax.ShapeDtypeStruct(x.shape, x.dtype), tree, is_leaf=lambda x: isinstance(x, jax.Array)
+            )
+            restored = tree_deserialize_leaves_tensorstore(tmpdir, exemplar, axis_mapping=mapping, mesh=mesh)
+
+            assert_trees_all_close(restored, tree)
+            assert restored["w"].array.sharding.is_equivalent_to(
+                hax.partitioning.sharding_for_axis((Data, Model), mapping, mesh), 2
+            )
+            assert restored["replicated"].array.sharding.is_fully_replicated
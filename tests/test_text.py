@@ -10,18 +10,22 @@ from transformers import AutoTokenizer
 
 import haliax as hax
 
+from levanter.data import ListAsyncDataset
 from levanter.data.text import (
     BatchTokenizer,
+    CausalLmDataset,
     ChatLmDatasetFormat,
     MultiturnChatDataset,
     SupervisedDataset,
     SupervisedLmDatasetFormat,
+    TokenSeqDataset,
     UrlSingleDatasetLMConfig,
     build_lm_dataset_cache,
     preprocessor_for_format,
 )
 from levanter.models.lm_model import LmExample
 from levanter.models.loss import maybe_fused_next_token_loss
+from levanter.store.cache import SerialCacheWriter
 from tests.test_utils import skip_if_hf_model_not_accessible
 
 
@@ -65,6 +69,160 @@ def test_lm_example_handles_ignore_id():
     assert no_ignore_loss.item() >= ignored_loss.item() + 100 / Pos.size
 
 
+@pytest.mark.asyncio
+async def test_causal_lm_dataset_matches_lm_example_causal():
+    Pos = hax.Axis("position", 16)
+    ignore_id = 3
+    eos_id = 5
+    rng = np.random.default_rng(0)
+    seqs = [rng.integers(0, 8, size=Pos.size, dtype=np.int32) for _ in range(7)]
+
+    for ignore, eos in [(None, None), (ignore_id, None), (None, eos_id), (ignore_id, eos_id)]:
+        dataset = CausalLmDataset(ListAsyncDataset(seqs, is_complete=True), Pos, ignore_index=ignore, eos_id=eos)
+        examples = await dataset.get_batch([4, 0, 6])
+
+        for idx, ex in zip([4, 0, 6], examples):
+            expected = LmExample.causal(hax.named(jnp.array(seqs[idx]), Pos), ignore_id=ignore, eos_id=eos)
+            assert_array_equal(ex.tokens.array, expected.tokens.array)
+            assert_array_equal(ex.loss_mask.array, expected.loss_mask.array)
+            assert ex.loss_mask.array.dtype == expected.loss_mask.array.dtype
+            if eos is None:
+                assert ex.attn_mask.segment_ids is None
+            else:
+                assert_array_equal(ex.attn_mask.segment_ids.array, expected.attn_mask.segment_ids.array)
+
+
+@pytest.mark.asyncio
+async def test_causal_lm_dataset_get_batch_slices_matches_sliced_examples():
+    Pos = hax.Axis("position", 16)
+    rng = np.random.default_rng(0)
+    seqs = [rng.integers(0, 8, size=Pos.size, dtype=np.int32) for _ in range(7)]
+
+    class SliceRecordingDataset(ListAsyncDataset):
+        async def get_batch_slices(self, indices, item_slice):
+            reads.append(item_slice)
+            return await super().get_batch_slices(indices, item_slice)
+
+    for ignore, eos in [(None, None), (3, None), (None, 5), (3, 5)]:
+        dataset = CausalLmDataset(SliceRecordingDataset(seqs, is_complete=True), Pos, ignore_index=ignore, eos_id=eos)
+        whole = await dataset.get_batch([4, 0, 6])
+
+        for item_slice in [slice(0, 8), slice(4, 12), slice(8, 16), slice(5, 6)]:
+            reads: list[slice] = []
+            examples = await dataset.get_batch_slices([4, 0, 6], item_slice)
+
+            # we read one token past the slice (for the loss mask), and everything before it if we need segment ids
+            read_start = 0 if eos is not None else item_slice.start
+            assert reads == [slice(read_start, min(item_slice.stop + 1, Pos.size))]
+
+            for ex, full in zip(examples, whole):
+                assert ex.tokens.axes == (Pos.resize(item_slice.stop - item_slice.start),)
+                assert_array_equal(ex.tokens.array, full.tokens.array[item_slice])
+                assert_array_equal(ex.loss_mask.array, full.loss_mask.array[item_slice])
+                if eos is None:
+                    assert ex.attn_mask.segment_ids is None
+                else:
+                    assert_array_equal(ex.attn_mask.segment_ids.array, full.attn_mask.segment_ids.array[item_slice])
+
+
+def _write_token_cache(path, num_docs, doc_len):
+    rng = np.random.default_rng(0)
+    exemplar = {"input_ids": np.zeros((doc_len,), dtype=np.int32)}
+    with SerialCacheWriter(path, exemplar) as writer:
+        for _ in range(0, num_docs, 128):
+            writer.write_batch(
+                [{"input_ids": rng.integers(0, 1000, size=doc_len, dtype=np.int32)} for _ in range(128)]
+            )
+
+    return writer.result()
+
+
+@pytest.mark.asyncio
+async def test_token_seq_dataset_get_batch(tmp_path):
+    cache = _write_token_cache(str(tmp_path / "cache"), num_docs=256, doc_len=100)
+    all_tokens = np.concatenate([ex["input_ids"] for ex in cache.get_batch_sync(list(range(256)))])
+
+    seq_len = 64
+    dataset = TokenSeqDataset(cache, seq_len)
+    indices = [5, 3, 4, 100, 0, 399, 4]
+    batch = await dataset.get_batch(indices)
+
+    assert len(batch) == len(indices)
+    for idx, seq in zip(indices, batch):
+        assert_array_equal(seq, all_tokens[idx * seq_len : (idx + 1) * seq_len])
+
+    # only part of each sequence, e.g. when the position axis is sharded across hosts
+    batch = await dataset.get_batch_slices(indices, slice(16, 48))
+    for idx, seq in zip(indices, batch):
+        assert_array_equal(seq, all_tokens[idx * seq_len + 16 : idx * seq_len + 48])
+
+
+def _word_level_tokenizer(vocab_size=1000):
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import PreTrainedTokenizerFast
+
+    vocab = {"[UNK]": 0, "<s>": 1, "</s>": 2, **{f"w{i}": i + 3 for i in range(vocab_size)}}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, unk_token="[UNK]", bos_token="<s>", eos_token="</s>")
+
+
+def test_batch_tokenizer_record_batch_matches_dicts():
+    import pyarrow as pa
+
+    from levanter.store.tree_store import TreeBatchPreparer
+
+    batch_tokenizer = BatchTokenizer(_word_level_tokenizer())
+    rng = np.random.default_rng(0)
+    docs = [{"text": " ".join(f"w{j}" for j in rng.integers(0, 1000, size=i % 13))} for i in range(50)]
+
+    columnar = batch_tokenizer.process_record_batch(pa.RecordBatch.from_pylist(docs))
+    expected = TreeBatchPreparer(batch_tokenizer.output_exemplar)(batch_tokenizer(docs))
+
+    assert columnar.keys() == expected.keys()
+    for key in expected:
+        assert_array_equal(columnar[key].data, expected[key].data)
+        assert_array_equal(columnar[key].offsets, expected[key].offsets)
+        assert columnar[key].data.dtype == np.asarray(batch_tokenizer.output_exemplar[key]).dtype
+
+
+def test_parquet_tokenization_matches_row_wise(tmp_path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    from levanter.data.sharded_datasource import ParquetDataSource
+    from levanter.store.cache import CacheOptions, TreeStore, _tokenize_one_shard_group
+
+    class RowWiseBatchTokenizer(BatchTokenizer):
+        @property
+        def supports_record_batches(self) -> bool:
+            return False
+
+    rng = np.random.default_rng(0)
+    num_docs = 2000
+    words = np.array([f"w{i}" for i in range(1000)])
+    docs = [" ".join(words[rng.integers(0, 1000, size=rng.integers(0, 50))]) for _ in range(num_docs)]
+    path = str(tmp_path / "data.parquet")
+    pq.write_table(pa.table({"text": docs, "id": np.arange(num_docs)}), path, row_group_size=300)
+
+    source = ParquetDataSource([path])
+    options = CacheOptions(batch_size=128)
+    tokenizer = _word_level_tokenizer()
+
+    stores = {}
+    for name, processor in [("row-wise", RowWiseBatchTokenizer(tokenizer)), ("columnar", BatchTokenizer(tokenizer))]:
+        cache_dir = str(tmp_path / name)
+        _tokenize_one_shard_group(
+            cache_dir, source, list(source.shard_names), processor, options, lambda *args: None, False
+        )
+        stores[name] = TreeStore.open(processor.output_exemplar, cache_dir, mode="r")
+
+    assert len(stores["row-wise"]) == len(stores["columnar"]) == num_docs
+    indices = list(range(num_docs))
+    for row, col in zip(stores["row-wise"].get_batch_sync(indices), stores["columnar"].get_batch_sync(indices)):
+        assert_array_equal(row["input_ids"], col["input_ids"])
+
+
 def test_merge_split_encodings():
     tokenizer = AutoTokenizer.from_pretrained("gpt2")
     # make this very short for testing
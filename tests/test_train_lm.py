@@ -44,6 +44,38 @@ def test_train_lm():
                 pass
 
 
+@pytest.mark.entry
+def test_train_lm_with_steps_in_flight():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        data_config, _ = tiny_test_corpus.construct_small_data_cache(tmpdir)
+        try:
+            config = train_lm.TrainLmConfig(
+                data=data_config,
+                model=train_lm.Gpt2Config(
+                    num_layers=2,
+                    num_heads=2,
+                    seq_len=64,
+                    hidden_dim=32,
+                    attn_backend=None,  # use default for platform
+                ),
+                trainer=train_lm.TrainerConfig(
+                    num_train_steps=4,
+                    train_batch_size=len(jax.devices()),
+                    max_eval_batches=1,
+                    steps_in_flight=2,
+                    wandb=WandbConfig(mode="disabled"),
+                    require_accelerator=False,
+                    ray=RayConfig(auto_start_cluster=False),
+                ),
+            )
+            train_lm.main(config)
+        finally:
+            try:
+                os.unlink("wandb")
+            except Exception:
+                pass
+
+
 @pytest.mark.entry
 def test_train_lm_fp8():
     # just testing if train_lm has a pulse
@@ -0,0 +1,81 @@
+import jax
+import jax.numpy as jnp
+import numpy as np
+import optax
+import pytest
+
+import haliax as hax
+import haliax.nn as hnn
+
+from levanter.callbacks import JitCallback
+from levanter.checkpoint import CheckpointerConfig
+from levanter.tracker import NoopConfig
+from levanter.trainer import Trainer, TrainerConfig
+
+
+class _GradNormCallback(JitCallback):
+    def __init__(self):
+        self.seen: list[tuple[int, float]] = []
+
+    def inside_step(self, state, inside_info):
+        return optax.global_norm(inside_info.grads)
+
+    def on_step(self, step_info, cb_info):
+        self.seen.append((step_info.step, float(cb_info)))
+
+
+def _train(tmp_path, steps_in_flight: int):
+    Batch = hax.Axis("batch", len(jax.devices()) * 2)
+    In = hax.Axis("in", 4)
+    Out = hax.Axis("out", 3)
+
+    config = TrainerConfig(
+        id="steps_in_flight",
+        num_train_steps=10,
+        train_batch_size=Batch.size,
+        steps_in_flight=steps_in_flight,
+        tracker=NoopConfig(),
+        require_accelerator=False,
+        checkpointer=CheckpointerConfig(base_path=str(tmp_path / "ckpt")),
+        log_dir=tmp_path / "logs",
+    )
+
+    def loss_fn(model, x, *, key=None):
+        return hax.mean(model(x) ** 2).scalar()
+
+    rng = np.random.default_rng(0)
+    batches = [
+        hax.named(jnp.asarray(rng.normal(size=(Batch.size, In.size)), jnp.float32), (Batch, In)) for _ in range(10)
+    ]
+
+    trainer = Trainer(config, optax.sgd(0.1), loss_fn, add_default_hooks=False)
+    hook_steps: list[tuple[int, float]] = []
+    trainer.add_hook(lambda info: hook_steps.append((info.step, info.loss)), every=1)
+    grad_norms = _GradNormCallback()
+    trainer.add_hook(grad_norms, every=3)
+
+    with trainer:
+        state = trainer.initial_state(jax.random.PRNGKey(0), model=hnn.Linear.init(In, Out, key=jax.random.PRNGKey(1)))
+        # with steps_in_flight=0, each state is donated to the next step, so read it as we go
+        infos = [(info.step, info.loss) for info in trainer.training_steps(state, batches)]
+
+    return infos, hook_steps, grad_norms.seen
+
+
+@pytest.mark.parametrize("steps_in_flight", [1, 3])
+def test_steps_in_flight_matches_synchronous_training(tmp_path, steps_in_flight):
+    sync_infos, sync_hooks, sync_jit_hooks = _train(tmp_path / "sync", 0)
+    infos, hooks, jit_hooks = _train(tmp_path / "async", steps_in_flight)
+
+    assert [step for step, _ in sync_infos] == list(range(10))
+    assert [step for step, _ in infos] == [step for step, _ in sync_infos]
+    np.testing.assert_allclose([loss for _, loss in infos], [loss for _, loss in sync_infos], rtol=1e-6)
+
+    # hooks see every step, in order, with that step's loss
+    assert [step for step, _ in hooks] == [step for step, _ in sync_hooks]
+    np.testing.assert_allclose([loss for _, loss in hooks], [loss for _, loss in sync_hooks], rtol=1e-6)
+
+    # jit hooks run on the same steps, with the same values
+    assert [step for step, _ in jit_hooks] == [step for step, _ in sync_jit_hooks]
+    assert len(jit_hooks) > 0
+    np.testing.assert_allclose([v for _, v in jit_hooks], [v for _, v in sync_jit_hooks], rtol=1e-6)